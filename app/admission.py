@@ -0,0 +1,228 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from .metrics import ADMISSION_WAIT
+
+
+AUTH = "auth"
+SEARCH = "search"
+READ = "read"
+WRITE = "write"
+EXPORT = "export"
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "1").lower() in ("1", "true", "yes")
+ADMISSION_LIMITS = os.environ.get("ADMISSION_LIMITS", "")
+DEFAULT_LIMITS = {
+    AUTH: (8, 32, 2.0),
+    SEARCH: (8, 64, 1.0),
+    READ: (16, 256, 1.0),
+    WRITE: (8, 64, 2.0),
+    EXPORT: (2, 4, 1.0),
+}
+AUTH_PATHS = {"/login", "/login_form"}
+SEARCH_SUFFIXES = ("/search", "/suggest", "/facets")
+EXPORT_SUFFIXES = ("/export",)
+EXEMPT_PATHS = {"/metrics", "/cache/stats", "/api/v1/products/changes", "/api/v1/products/changes/stream"}
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    if path in EXEMPT_PATHS:
+        return None
+    if path in AUTH_PATHS and method == "POST":
+        return AUTH
+    if path.endswith(EXPORT_SUFFIXES):
+        return EXPORT
+    if path.endswith(SEARCH_SUFFIXES):
+        return SEARCH
+    return READ if method in SAFE_METHODS else WRITE
+
+
+def parse_limits(value: str = ADMISSION_LIMITS) -> Dict[str, Tuple[int, int, float]]:
+    limits = dict(DEFAULT_LIMITS)
+    for entry in value.split(","):
+        name, _, spec = entry.strip().partition("=")
+        if not name or not spec:
+            continue
+        if name not in limits:
+            raise ValueError(f"Unknown endpoint class {name!r}")
+        concurrency, queue, timeout = spec.split(":")
+        limits[name] = (int(concurrency), int(queue), float(timeout))
+    return limits
+
+
+class Overloaded(Exception):
+
+    def __init__(self, gate: "AdmissionGate"):
+        super().__init__(f"{gate.name} requests are over capacity")
+        self.gate = gate
+
+
+class AdmissionGate:
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        with self._lock:
+            if self.active < self.concurrency and not self._waiters:
+                self.active += 1
+                self.admitted += 1
+                return
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded(self)
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+        timer = loop.call_later(self.timeout, self._expire, waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        finally:
+            timer.cancel()
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.get_loop().call_soon_threadsafe(self._grant, waiter)
+                    return
+            self.active -= 1
+
+    def _grant(self, waiter: asyncio.Future) -> None:
+        if waiter.done():
+            self.release()
+        else:
+            with self._lock:
+                self.admitted += 1
+            waiter.set_result(None)
+
+    def _expire(self, waiter: asyncio.Future) -> None:
+        if waiter.done():
+            return
+        self._discard(waiter)
+        with self._lock:
+            self.timed_out += 1
+        waiter.set_exception(Overloaded(self))
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def retry_after(self) -> int:
+        return max(1, round(self.timeout))
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "timeout": self.timeout,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+class AdmissionController:
+
+    def __init__(self, limits: Dict[str, Tuple[int, int, float]], enabled: bool = ADMISSION_CONTROL):
+        self.enabled = enabled
+        self.gates = {name: AdmissionGate(name, *limit) for name, limit in limits.items()}
+
+    @classmethod
+    def from_env(cls, value: str = ADMISSION_LIMITS) -> "AdmissionController":
+        return cls(parse_limits(value))
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: gate.stats() for name, gate in self.gates.items()}
+
+    def render(self) -> List[str]:
+        lines = []
+        for metric, kind, help in (
+            ("active", "gauge", "Requests holding an admission slot"),
+            ("queued", "gauge", "Requests waiting for an admission slot"),
+            ("admitted", "counter", "Requests admitted"),
+            ("rejected", "counter", "Requests shed because the queue was full"),
+            ("timed_out", "counter", "Requests shed after waiting past the queue deadline"),
+        ):
+            name = f"http_admission_{metric}" + ("_total" if kind == "counter" else "")
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            lines += [f'{name}{{class="{gate.name}"}} {getattr(gate, metric)}' for gate in self.gates.values()]
+        return lines
+
+    def reset(self) -> None:
+        for gate in self.gates.values():
+            gate.admitted = gate.rejected = gate.timed_out = 0
+
+
+admission = AdmissionController.from_env()
+
+
+class AdmissionMiddleware:
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.controller.enabled:
+            await self.app(scope, receive, send)
+            return
+        gate = self.controller.gates.get(classify(scope["method"], scope["path"]))
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await gate.acquire()
+        except Overloaded:
+            ADMISSION_WAIT.observe(time.perf_counter() - started, gate.name, "shed")
+            await self.reject(send, gate)
+            return
+        ADMISSION_WAIT.observe(time.perf_counter() - started, gate.name, "admitted")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+    @staticmethod
+    async def reject(send, gate: AdmissionGate) -> None:
+        body = json.dumps({"detail": f"Too many {gate.name} requests, try again shortly"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(gate.retry_after()).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
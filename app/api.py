@@ -0,0 +1,250 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.crud.product_crud import MAX_BATCH_UPDATE, AsyncProductCRUD, VersionConflict
+from app.schemas.change import ChangePage, ProductChangeMain
+from app.schemas.product import (
+    BatchUpdate,
+    ProductBase,
+    ProductCreate,
+    ProductList,
+    ProductMain,
+    ProductPage,
+    ProductUpdate,
+)
+from .changes import SSE_MAX_SECONDS, clamp_limit, stream_changes, wait_for_changes
+from .dependencies import get_api_user, get_async_read_session_factory, get_db, get_read_db
+from .versioning import TableVersions, etag_matches, make_etag
+
+
+router = APIRouter(prefix="/api/v1/products", tags=["products"])
+
+
+def json_response(model: BaseModel, status_code: int = status.HTTP_200_OK, etag: Optional[str] = None) -> Response:
+    return Response(
+        content=model.model_dump_json(),
+        media_type="application/json",
+        status_code=status_code,
+        headers={"ETag": etag} if etag else None,
+    )
+
+
+async def check_not_modified(request: Request, db: AsyncSession):
+    version = await db.run_sync(TableVersions.get)
+    etag = make_etag(version, request.url.path, sorted(request.query_params.multi_items()))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return etag, Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return etag, None
+
+
+def conflict_exception(error: VersionConflict) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail={"message": "Product was modified by someone else, reload and retry", "ids": error.ids},
+    )
+
+
+def page_response(page, etag: str) -> Response:
+    return json_response(
+        ProductPage.model_validate(
+            {"items": page.items, "next_cursor": page.next_cursor, "prev_cursor": page.prev_cursor},
+            from_attributes=True,
+        ),
+        etag=etag,
+    )
+
+
+@router.get("", response_model=ProductPage, name="api_list_products")
+async def list_products(
+    request: Request,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    etag, not_modified = await check_not_modified(request, db)
+    if not_modified:
+        return not_modified
+    try:
+        page = await AsyncProductCRUD.get_multi(db, cursor=cursor, page_size=page_size)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return page_response(page, etag)
+
+
+@router.get("/search", response_model=ProductPage, name="api_search_products")
+async def search_products(
+    request: Request,
+    query: Optional[str] = None,
+    user_id: Optional[str] = None,
+    area: Optional[str] = None,
+    region: Optional[str] = None,
+    ingredient: Optional[str] = None,
+    match: str = "all",
+    order_by: Optional[str] = None,
+    direction: Optional[str] = None,
+    fulltext: bool = True,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    etag, not_modified = await check_not_modified(request, db)
+    if not_modified:
+        return not_modified
+    filters, sorting = {}, {}
+    if area:
+        filters["area"] = area
+    if region:
+        filters["region"] = region
+    if ingredient:
+        filters["ingredient"] = ingredient
+    if region or ingredient:
+        filters["match"] = match
+    if user_id:
+        filters["user_id"] = user_id
+    if order_by and direction:
+        sorting[order_by] = direction
+    try:
+        page = await AsyncProductCRUD.search(
+            db,
+            search_term=query,
+            filters=filters,
+            sorting=sorting,
+            use_index=fulltext,
+            cursor=cursor,
+            page_size=page_size,
+        )
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return page_response(page, etag)
+
+
+@router.patch("", response_model=ProductList, name="api_batch_update_products")
+async def batch_update_products(
+    batch: BatchUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_api_user),
+):
+    ids = [edit.id for edit in batch.updates]
+    if not ids or len(ids) > MAX_BATCH_UPDATE or len(set(ids)) != len(ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Send between 1 and {MAX_BATCH_UPDATE} updates with distinct ids",
+        )
+    products = await AsyncProductCRUD.get_many(db, ids)
+    missing = [id for id in ids if id not in products]
+    if missing:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail={"message": "No product with such ID", "ids": missing})
+    if any(product.user_id != current_user.id for product in products.values()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    try:
+        updated = await AsyncProductCRUD.update_many(db, [(products[edit.id], edit) for edit in batch.updates])
+    except VersionConflict as error:
+        raise conflict_exception(error)
+    return json_response(ProductList.model_validate({"items": updated}, from_attributes=True))
+
+
+@router.get("/changes", response_model=ChangePage, name="api_product_changes")
+async def product_changes(
+    since: int = 0,
+    limit: Optional[int] = None,
+    wait: float = 0,
+    session_factory = Depends(get_async_read_session_factory),
+):
+    limit = clamp_limit(limit)
+    changes = await wait_for_changes(session_factory, since, limit + 1, timeout=wait)
+    page = ChangePage(
+        changes=[ProductChangeMain.model_validate(change) for change in changes[:limit]],
+        last_seq=changes[:limit][-1].seq if changes else since,
+        has_more=len(changes) > limit,
+    )
+    return json_response(page)
+
+
+@router.get("/changes/stream", name="api_product_change_stream")
+async def product_change_stream(
+    request: Request,
+    since: int = 0,
+    timeout: float = SSE_MAX_SECONDS,
+    last_event_id: Optional[str] = Header(None),
+    session_factory = Depends(get_async_read_session_factory),
+):
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    return StreamingResponse(
+        stream_changes(session_factory, since, request.is_disconnected, max_seconds=min(timeout, SSE_MAX_SECONDS)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/{product_id}", response_model=ProductMain, name="api_get_product")
+async def get_product(
+    product_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
+):
+    etag, not_modified = await check_not_modified(request, db)
+    if not_modified:
+        return not_modified
+    product = await AsyncProductCRUD.get(db, id=product_id)
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No product with such ID",
+        )
+    return json_response(ProductMain.model_validate(product), etag=etag)
+
+
+@router.post("", response_model=ProductMain, status_code=status.HTTP_201_CREATED, name="api_create_product")
+async def create_product(
+    obj_in: ProductBase,
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_api_user),
+):
+    product = await AsyncProductCRUD.create(db, ProductCreate(
+        **obj_in.model_dump(),
+        date_added=datetime.now(),
+        user_id=current_user.id,
+    ))
+    response = json_response(ProductMain.model_validate(product), status_code=status.HTTP_201_CREATED)
+    response.headers["Location"] = router.url_path_for("api_get_product", product_id=product.id)
+    return response
+
+
+async def update_owned_product(db: AsyncSession, product_id: int, obj_in: ProductUpdate, current_user) -> Response:
+    db_product = await AsyncProductCRUD.get(db, id=product_id)
+    if not db_product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No product with such ID",
+        )
+    if db_product.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    try:
+        product = await AsyncProductCRUD.update(db, db_obj=db_product, obj_in=obj_in)
+    except VersionConflict as error:
+        raise conflict_exception(error)
+    return json_response(ProductMain.model_validate(product))
+
+
+@router.put("/{product_id}", response_model=ProductMain, name="api_update_product")
+async def update_product(
+    product_id: int,
+    obj_in: ProductBase,
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_api_user),
+):
+    return await update_owned_product(db, product_id, ProductUpdate(**obj_in.model_dump()), current_user)
+
+
+@router.patch("/{product_id}", response_model=ProductMain, name="api_patch_product")
+async def patch_product(
+    product_id: int,
+    obj_in: ProductUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user = Depends(get_api_user),
+):
+    return await update_owned_product(db, product_id, obj_in, current_user)
@@ -0,0 +1,558 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from app.crud.pagination import encode_cursor
+from app.crud.product_crud import ProductCRUD
+from app.crud.user_crud import UserCRUD
+from app.schemas.product import ProductCreate
+from app.schemas.user import UserCreate
+from .db import create_async_db_engine, create_db_engine
+from .dependencies import get_db, get_read_db, get_read_session_factory, get_sync_db
+from .main import app
+from .migrations import migrate
+from .page_cache import page_cache
+from .read_model import ProductReadModel
+from .utils import get_password_hash
+
+
+SIZES = (10_000, 100_000, 1_000_000)
+ITERATIONS = 30
+WARMUP = 3
+CONCURRENCY = 16
+HTTP_REQUESTS = 500
+LOGIN_REQUESTS = 50
+SEED_CHUNK_SIZE = 5000
+REGRESSION_TOLERANCE = 0.2
+STARTUP_REPEATS = 3
+STARTUP_WORKERS = 2
+STARTUP_TIMEOUT = 60
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_USERNAME = "bench"
+BENCH_PASSWORD = "bench-password"
+
+AREAS = ["Cardiology", "Oncology", "Neurology", "Dermatology", "Pediatrics", "Psychiatry", "Pulmonology", "Rheumatology"]
+REGIONS = ["EU", "US", "UK", "Japan", "China", "India", "Brazil", "Canada", "Australia", "Africa"]
+INGREDIENTS = [
+    "aspirin", "caffeine", "paracetamol", "ibuprofen", "naproxen", "codeine", "lactose", "cellulose",
+    "magnesium stearate", "vitamin c", "zinc", "metformin", "atorvastatin", "omeprazole", "amoxicillin",
+    "cetirizine", "loratadine", "prednisone", "insulin", "heparin",
+]
+WORDS = ["forte", "rapid", "plus", "retard", "junior", "max", "duo", "neo", "extra", "mite"]
+SORTS = [None, "name", "ingredients", "area", "date_added"]
+FILTERS = {
+    "none": {},
+    "user": {"user_id": "1"},
+    "area": {"area": "Oncology"},
+    "region": {"region": "EU"},
+    "ingredient": {"ingredient": "aspirin"},
+    "ingredient_region": {"ingredient": "aspirin", "region": "EU"},
+    "ingredients_any": {"ingredient": "aspirin, caffeine", "match": "any"},
+    "fulltext": {"query": "aspi"},
+}
+
+
+def synthetic_product(rng: random.Random, index: int, user_id: int, start: datetime) -> ProductCreate:
+    ingredients = rng.sample(INGREDIENTS, rng.randint(1, 4))
+    return ProductCreate(
+        name=f"{rng.choice(ingredients).title()} {rng.choice(WORDS)} {index}",
+        description=f"Synthetic product {index} for benchmarking",
+        area=rng.choice(AREAS),
+        regions=", ".join(rng.sample(REGIONS, rng.randint(1, 3))),
+        ingredients=", ".join(ingredients),
+        date_added=start + timedelta(minutes=index),
+        user_id=user_id,
+    )
+
+
+def seed(session_factory: Callable, size: int, seed: int = 0, chunk_size: int = SEED_CHUNK_SIZE) -> None:
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    with session_factory() as db:
+        user = UserCRUD.create(db, UserCreate(
+            username=BENCH_USERNAME,
+            hashed_password=get_password_hash(BENCH_PASSWORD),
+        ))
+        for offset in range(0, size, chunk_size):
+            ProductCRUD.bulk_create(db, [
+                synthetic_product(rng, index, user.id, start)
+                for index in range(offset, min(offset + chunk_size, size))
+            ])
+
+
+def open_catalog(data_dir: str, size: int, seed_value: int = 0):
+    path = os.path.join(data_dir, f"catalog-{size}-{seed_value}.db")
+    if os.path.exists(path):
+        with sqlite3.connect(path) as connection:
+            seeded = connection.execute("PRAGMA user_version").fetchone()[0] == size
+        if not seeded:
+            os.remove(path)
+    url = f"sqlite:///{path}"
+    engine = create_db_engine(url)
+    migrate(engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with engine.connect() as connection:
+        seeded = connection.exec_driver_sql("PRAGMA user_version").scalar() == size
+    if not seeded:
+        seed(session_factory, size, seed=seed_value)
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ANALYZE")
+            connection.exec_driver_sql(f"PRAGMA user_version = {int(size)}")
+    return url, engine, session_factory
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = min(len(ordered), max(1, math.ceil(fraction * len(ordered))))
+    return ordered[rank - 1]
+
+
+def summarize(latencies: Sequence[float], elapsed: float, errors: int = 0) -> Dict[str, float]:
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+def measure(func: Callable[[], object], iterations: int = ITERATIONS, warmup: int = WARMUP) -> Dict[str, float]:
+    for _ in range(warmup):
+        func()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def search_cases() -> List[Tuple[str, Dict[str, str], Dict[str, str]]]:
+    cases = []
+    for (name, filters), sort, direction in itertools.product(FILTERS.items(), SORTS, ("asc", "desc")):
+        if sort is None and direction == "desc":
+            continue
+        label = f"{name}.{sort}.{direction}" if sort else f"{name}.default"
+        cases.append((label, filters, {sort: direction} if sort else {}))
+    return cases
+
+
+def rebuild_read_model(db):
+    ProductReadModel.invalidate()
+    return ProductReadModel.snapshot(db)
+
+
+def read_model_footprint(session_factory: Callable) -> Dict[str, int]:
+    with session_factory() as db:
+        snapshot = ProductReadModel.snapshot(db)
+        return {"rows": len(snapshot), "memory_bytes": snapshot.memory_bytes()}
+
+
+def run_micro(session_factory: Callable, size: int, iterations: int = ITERATIONS) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    def with_session(func):
+        def call():
+            with session_factory() as db:
+                return func(db)
+        return call
+
+    results["get_multi.first_page"] = measure(with_session(ProductCRUD.get_multi), iterations)
+    deep_cursor = encode_cursor("id", size // 2, size // 2)
+    results["get_multi.deep_page"] = measure(
+        with_session(lambda db: ProductCRUD.get_multi(db, cursor=deep_cursor)), iterations,
+    )
+    for label, filters, sorting in search_cases():
+        filters = dict(filters)
+        search_term = filters.pop("query", None)
+        results[f"search.{label}"] = measure(with_session(lambda db: ProductCRUD.search(
+            db, search_term=search_term, filters=filters, sorting=sorting,
+        )), iterations)
+    results["read_model.build"] = measure(with_session(rebuild_read_model), max(1, iterations // 10), warmup=0)
+    for label, filters, sorting in search_cases():
+        filters = dict(filters)
+        if not ProductReadModel.supports(filters.pop("query", None), filters, sorting):
+            continue
+        results[f"search_rm.{label}"] = measure(with_session(lambda db: ProductCRUD.search(
+            db, filters=filters, sorting=sorting, read_model=True,
+        )), iterations)
+    results["authenticate"] = measure(
+        with_session(lambda db: UserCRUD.authenticate(db, BENCH_USERNAME, BENCH_PASSWORD)),
+        max(1, iterations // 3),
+        warmup=1,
+    )
+    rng = random.Random(size)
+    counter = itertools.count(size)
+    results["create"] = measure(with_session(lambda db: ProductCRUD.create(
+        db, synthetic_product(rng, next(counter), 1, datetime.now()),
+    )), iterations)
+    return results
+
+
+async def load(
+    requests: Sequence[Tuple[str, str, dict]],
+    total: int = HTTP_REQUESTS,
+    concurrency: int = CONCURRENCY,
+) -> Dict[str, float]:
+    latencies, errors = [], 0
+    pending = iter(range(total))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+
+        async def worker():
+            nonlocal errors
+            for index in pending:
+                method, url, kwargs = requests[index % len(requests)]
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, url, **kwargs)
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, errors)
+
+
+@contextmanager
+def bind_app(url: str):
+    engine = create_db_engine(url)
+    async_engine = create_async_db_engine(url)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def override_get_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    def override_get_sync_db():
+        with SessionLocal() as db:
+            yield db
+
+    previous = dict(app.dependency_overrides)
+    app.dependency_overrides.update({
+        get_db: override_get_db,
+        get_read_db: override_get_db,
+        get_sync_db: override_get_sync_db,
+        get_read_session_factory: lambda: SessionLocal,
+    })
+    try:
+        yield
+    finally:
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(previous)
+        engine.dispose()
+        asyncio.run(async_engine.dispose())
+
+
+@contextmanager
+def page_cache_enabled(enabled: bool):
+    ttl = page_cache.ttl
+    page_cache.ttl = ttl if enabled else 0
+    page_cache.clear()
+    try:
+        yield
+    finally:
+        page_cache.ttl = ttl
+        page_cache.clear()
+
+
+def http_scenarios(size: int) -> Dict[str, Tuple[List[Tuple[str, str, dict]], int]]:
+    read = [("GET", "/products/read", {})] + [
+        ("GET", "/products/read", {"params": {"cursor": encode_cursor("id", id, id)}})
+        for id in range(size // 10, size, max(1, size // 10))
+    ]
+    search = []
+    for _, filters, sorting in search_cases():
+        params = dict(filters)
+        for order_by, direction in sorting.items():
+            params.update(order_by=order_by, direction=direction)
+        search.append(("GET", "/products/search", {"params": params}))
+    login = [("POST", "/login", {"data": {"username": BENCH_USERNAME, "password": BENCH_PASSWORD}})]
+    return {"products_read": (read, HTTP_REQUESTS), "products_search": (search, HTTP_REQUESTS), "login": (login, LOGIN_REQUESTS)}
+
+
+def run_http(
+    url: str,
+    size: int,
+    total: int = HTTP_REQUESTS,
+    concurrency: int = CONCURRENCY,
+) -> Dict[str, Dict[str, float]]:
+    results = {}
+    with bind_app(url):
+        for name, (requests, default_total) in http_scenarios(size).items():
+            count = min(total, default_total) if name == "login" else total
+            for cached in (True, False):
+                if name == "login" and not cached:
+                    continue
+                with page_cache_enabled(cached):
+                    label = f"http.{name}" if cached else f"http.{name}.uncached"
+                    results[label] = asyncio.run(load(requests, total=count, concurrency=concurrency))
+    return results
+
+
+_STARTUP_PROBE = """
+import json, resource, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+app.main.initialize()
+initialized = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "initialize_ms": (initialized - imported) * 1000,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def startup_env(data_dir: str) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.abspath(os.path.join(data_dir, 'startup.db'))}",
+        "SLOW_QUERY_LOG": os.path.abspath(os.path.join(data_dir, "startup-slow-queries.jsonl")),
+    }
+
+
+def process_memory(pid: int) -> Dict[str, int]:
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as stream:
+            for line in stream:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0])
+    except OSError:
+        return {}
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "pss_kb": fields.get("Pss", 0),
+        "uss_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def child_pids(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="ascii") as stream:
+            return [int(child) for child in stream.read().split()]
+    except OSError:
+        return []
+
+
+def wait_until_serving(url: str, deadline: float) -> None:
+    while True:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{url} did not come up")
+        time.sleep(0.05)
+
+
+def run_startup(data_dir: str, workers: int = STARTUP_WORKERS, repeats: int = STARTUP_REPEATS) -> dict:
+    env = startup_env(data_dir)
+    probes = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", _STARTUP_PROBE], env=env, cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        ).stdout
+        probes.append(json.loads(output.strip().splitlines()[-1]))
+    results = {name: statistics.median(probe[name] for probe in probes) for name in probes[0]}
+
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.server", "--port", "0", "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+        cwd=REPO_ROOT,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        url = server.stdout.readline().split()[2] + "/products/read"
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        wait_until_serving(url, deadline)
+        ready = time.perf_counter() - started
+        while len(child_pids(server.pid)) < workers and workers > 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for _ in range(workers * 8):
+            httpx.get(url, timeout=5)
+        children = child_pids(server.pid)
+        memory = [process_memory(pid) for pid in children]
+        results["server"] = {
+            "workers": workers,
+            "ready_ms": ready * 1000,
+            "parent": process_memory(server.pid),
+            "worker_memory": memory,
+            "worker_uss_kb_avg": statistics.mean(item.get("uss_kb", 0) for item in memory) if memory else None,
+        }
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+        server.stdout.close()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> List[str]:
+    regressions = []
+    for size, benchmarks in results["runs"].items():
+        for name, stats in benchmarks.items():
+            previous = baseline.get("runs", {}).get(size, {}).get(name)
+            if not previous or not previous["p95_ms"]:
+                continue
+            if stats["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{size} {name}: p95 {stats['p95_ms']:.2f}ms vs baseline {previous['p95_ms']:.2f}ms"
+                )
+    return regressions
+
+
+def run(
+    sizes: Sequence[int] = SIZES,
+    data_dir: str = ".benchmarks",
+    iterations: int = ITERATIONS,
+    total: int = HTTP_REQUESTS,
+    concurrency: int = CONCURRENCY,
+    micro: bool = True,
+    http: bool = True,
+    seed_value: int = 0,
+    startup_workers: int = 0,
+) -> dict:
+    os.makedirs(data_dir, exist_ok=True)
+    results = {
+        "meta": {
+            "started_at": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "iterations": iterations,
+            "requests": total,
+            "concurrency": concurrency,
+        },
+        "runs": {},
+        "read_model": {},
+    }
+    for size in sizes:
+        url, engine, session_factory = open_catalog(data_dir, size, seed_value)
+        benchmarks = {}
+        try:
+            if micro:
+                benchmarks.update(run_micro(session_factory, size, iterations))
+                results["read_model"][str(size)] = read_model_footprint(session_factory)
+            if http:
+                benchmarks.update(run_http(url, size, total, concurrency))
+        finally:
+            ProductReadModel.invalidate()
+            engine.dispose()
+        results["runs"][str(size)] = benchmarks
+    if startup_workers > 0:
+        results["startup"] = run_startup(data_dir, startup_workers)
+    return results
+
+
+def print_report(results: dict, stream=sys.stdout) -> None:
+    for size, benchmarks in results["runs"].items():
+        stream.write(f"\n{size} products\n")
+        stream.write(f"{'benchmark':<48}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'errors':>8}\n")
+        for name, stats in benchmarks.items():
+            stream.write(
+                f"{name:<48}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+                f"{stats['throughput_rps']:>10.1f}{stats['errors']:>8}\n"
+            )
+        footprint = results.get("read_model", {}).get(size)
+        if footprint:
+            stream.write(
+                f"read model: {footprint['rows']} rows in {footprint['memory_bytes'] / 1024 / 1024:.1f}MB\n"
+            )
+    startup = results.get("startup")
+    if startup:
+        stream.write(
+            f"\nstartup: import {startup['import_ms']:.1f}ms, initialize {startup['initialize_ms']:.1f}ms, "
+            f"max RSS {startup['max_rss_kb'] / 1024:.1f}MB\n"
+        )
+        server = startup["server"]
+        stream.write(f"server: {server['workers']} workers ready in {server['ready_ms']:.1f}ms\n")
+        for index, memory in enumerate(server["worker_memory"]):
+            if memory:
+                stream.write(
+                    f"  worker {index}: RSS {memory['rss_kb'] / 1024:.1f}MB, PSS {memory['pss_kb'] / 1024:.1f}MB, "
+                    f"private {memory['uss_kb'] / 1024:.1f}MB\n"
+                )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.benchmark", description="Catalog benchmarks and load tests")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES), help="Comma-separated catalog sizes")
+    parser.add_argument("--data-dir", default=".benchmarks", help="Where seeded catalogs are kept between runs")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--requests", type=int, default=HTTP_REQUESTS, help="Requests per HTTP scenario")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument(
+        "--startup-workers", type=int, default=STARTUP_WORKERS,
+        help="Workers for the cold start and memory benchmark, 0 skips it",
+    )
+    parser.add_argument("--output", "-o", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="Allowed p95 slowdown, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    results = run(
+        sizes=[int(size) for size in args.sizes.split(",") if size],
+        data_dir=args.data_dir,
+        iterations=args.iterations,
+        total=args.requests,
+        concurrency=args.concurrency,
+        micro=not args.skip_micro,
+        http=not args.skip_http,
+        seed_value=args.seed,
+        startup_workers=args.startup_workers,
+    )
+    with open(args.output, "w", encoding="utf-8") as stream:
+        json.dump(results, stream, indent=2)
+    print_report(results)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as stream:
+            regressions = compare(results, json.load(stream), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime
+from typing import IO, Callable, Dict, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from app.crud.product_crud import EXPORT_COLUMNS, ProductCRUD
+from app.schemas.bulk import ImportReport, RowError
+from app.schemas.product import ProductCreate
+from .db import ReadSessionLocal, SessionLocal, engine
+from .migrations import migrate
+
+
+FORMATS = ("csv", "jsonl")
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+EXPORT_BATCH_SIZE = 1000
+MEDIA_TYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+OPTIONAL_FIELDS = ("description", "area", "regions", "ingredients")
+
+
+def detect_format(filename: Optional[str], default: str = "csv") -> str:
+    if filename:
+        suffix = filename.rsplit(".", 1)[-1].lower()
+        if suffix in ("jsonl", "ndjson"):
+            return "jsonl"
+        if suffix == "csv":
+            return "csv"
+    return default
+
+
+def iter_rows(stream: IO[str], format: str) -> Iterator[Tuple[int, object]]:
+    if format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == "jsonl":
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as exc:
+                row = ValueError(f"Invalid JSON: {exc.msg}")
+            if not isinstance(row, (dict, Exception)):
+                row = ValueError("Expected a JSON object")
+            yield line_no, row
+    else:
+        raise ValueError(f"Unsupported format: {format}")
+
+
+def to_product(row: dict, user_id: int, now: datetime) -> ProductCreate:
+    data = {
+        key: (value.strip() or None) if isinstance(value, str) else value
+        for key, value in row.items()
+        if key
+    }
+    for field in OPTIONAL_FIELDS:
+        data.setdefault(field, None)
+    if not data.get("date_added"):
+        data["date_added"] = now
+    data["user_id"] = user_id
+    return ProductCreate(**data)
+
+
+def _describe(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            for error in exc.errors()
+        )
+    if isinstance(exc, SQLAlchemyError):
+        return str(exc.orig if getattr(exc, "orig", None) is not None else exc).splitlines()[0]
+    return str(exc)
+
+
+def _record(report: ImportReport, line: int, exc: Exception) -> None:
+    report.failed += 1
+    if len(report.errors) < MAX_REPORTED_ERRORS:
+        report.errors.append(RowError(line=line, error=_describe(exc)))
+
+
+def _flush(db: Session, chunk: List[Tuple[int, ProductCreate]], report: ImportReport) -> None:
+    if not chunk:
+        return
+    try:
+        report.inserted += len(ProductCRUD.bulk_create(db, [obj_in for _, obj_in in chunk]))
+        return
+    except SQLAlchemyError:
+        db.rollback()
+    for line, obj_in in chunk:
+        try:
+            ProductCRUD.bulk_create(db, [obj_in])
+            report.inserted += 1
+        except SQLAlchemyError as exc:
+            db.rollback()
+            _record(report, line, exc)
+
+
+def import_products(
+    db: Session,
+    stream: IO[str],
+    user_id: int,
+    format: str = "csv",
+    chunk_size: int = CHUNK_SIZE,
+) -> ImportReport:
+    report = ImportReport()
+    now = datetime.now()
+    chunk = []
+    for line, row in iter_rows(stream, format):
+        try:
+            if isinstance(row, Exception):
+                raise row
+            chunk.append((line, to_product(row, user_id, now)))
+        except (ValueError, TypeError) as exc:
+            _record(report, line, exc)
+        if len(chunk) >= chunk_size:
+            _flush(db, chunk, report)
+            chunk = []
+    _flush(db, chunk, report)
+    return report
+
+
+def _format_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def iter_export(
+    session_factory: Callable[[], Session],
+    format: str = "csv",
+    search_term: Optional[str] = None,
+    filters: Optional[Dict[str, str]] = None,
+    since: Optional[datetime] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[str]:
+    if format not in FORMATS:
+        raise ValueError(f"Unsupported format: {format}")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        writer.writerow(EXPORT_COLUMNS)
+    with session_factory() as db:
+        rows = ProductCRUD.iter_export(
+            db,
+            search_term=search_term,
+            filters=filters,
+            since=since,
+            batch_size=batch_size,
+        )
+        for count, row in enumerate(rows, 1):
+            values = [_format_value(value) for value in row]
+            if format == "csv":
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, values)), ensure_ascii=False))
+                buffer.write("\n")
+            if count % batch_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.bulk", description="Bulk product catalog tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="Import products from a CSV or JSONL file")
+    import_parser.add_argument("path", help="File to import, or - for stdin")
+    import_parser.add_argument("--user-id", type=int, required=True, help="Owner of the imported products")
+    import_parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension, then csv")
+    import_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    export_parser = commands.add_parser("export", help="Export products as CSV or JSONL")
+    export_parser.add_argument("--output", "-o", default="-", help="Destination file, or - for stdout")
+    export_parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension, then csv")
+    export_parser.add_argument("--query", help="Full-text search term")
+    export_parser.add_argument("--area")
+    export_parser.add_argument("--region", help="Comma-separated regions")
+    export_parser.add_argument("--ingredient", help="Comma-separated ingredients")
+    export_parser.add_argument("--match", choices=("all", "any"), default="all", help="Require all or any of the listed regions/ingredients")
+    export_parser.add_argument("--user-id")
+    export_parser.add_argument("--since", type=datetime.fromisoformat, help="Only products added after this ISO timestamp")
+    args = parser.parse_args(argv)
+
+    migrate(engine)
+    if args.command == "export":
+        return export_command(args)
+    format = args.format or detect_format(args.path)
+    stream = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8-sig")
+    try:
+        with SessionLocal() as db:
+            report = import_products(db, stream, args.user_id, format=format, chunk_size=args.chunk_size)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    print(report.model_dump_json(indent=2))
+    return 1 if report.failed else 0
+
+
+def export_command(args) -> int:
+    filters = {
+        column: value
+        for column, value in (
+            ("area", args.area),
+            ("region", args.region),
+            ("ingredient", args.ingredient),
+            ("user_id", args.user_id),
+        )
+        if value
+    }
+    if args.region or args.ingredient:
+        filters["match"] = args.match
+    format = args.format or detect_format(args.output)
+    stream = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    try:
+        for chunk in iter_export(
+            ReadSessionLocal,
+            format=format,
+            search_term=args.query,
+            filters=filters,
+            since=args.since,
+        ):
+            stream.write(chunk)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import time
+from datetime import date, datetime
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
+from sqlalchemy import func, insert, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from .models import Product, ProductChange
+
+
+CREATE = "create"
+UPDATE = "update"
+CHANGE_PAGE_SIZE = 100
+MAX_CHANGE_PAGE_SIZE = 1000
+MAX_WAIT_SECONDS = 30
+CHANGE_POLL_INTERVAL = float(os.environ.get("CHANGE_POLL_INTERVAL", 0.5))
+SSE_HEARTBEAT_SECONDS = 15
+SSE_MAX_SECONDS = 300
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+
+def snapshot(values: Dict) -> Dict:
+    return {column.key: _json_value(values.get(column.key)) for column in Product.__table__.columns}
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    if not limit or limit < 1:
+        return CHANGE_PAGE_SIZE
+    return min(limit, MAX_CHANGE_PAGE_SIZE)
+
+
+class ChangeFeed:
+
+    @staticmethod
+    def record(db: Session, op: str, rows: Iterable[Dict]) -> None:
+        now = datetime.now()
+        entries = [
+            {"product_id": row["id"], "op": op, "changed_at": now, "data": snapshot(row)}
+            for row in rows
+        ]
+        if entries:
+            db.execute(insert(ProductChange), entries)
+
+    @staticmethod
+    def record_product(db: Session, op: str, product: Product) -> None:
+        ChangeFeed.record(db, op, [{column.key: getattr(product, column.key) for column in Product.__table__.columns}])
+
+    @staticmethod
+    def since(db: Session, seq: int = 0, limit: int = CHANGE_PAGE_SIZE) -> List[ProductChange]:
+        return list(db.scalars(
+            select(ProductChange)
+            .where(ProductChange.seq > seq)
+            .order_by(ProductChange.seq)
+            .limit(limit)
+        ))
+
+    @staticmethod
+    def last_seq(db: Session) -> int:
+        return db.scalar(select(func.max(ProductChange.seq))) or 0
+
+    @staticmethod
+    def backfill(connection: Connection) -> None:
+        last_id = 0
+        columns = [column for column in Product.__table__.columns if column.key != "version"]
+        while True:
+            rows = connection.execute(
+                select(*columns).where(Product.id > last_id).order_by(Product.id).limit(BACKFILL_BATCH_SIZE)
+            ).mappings().all()
+            if not rows:
+                break
+            connection.execute(ProductChange.__table__.insert(), [
+                {"product_id": row["id"], "op": CREATE, "changed_at": row["date_added"] or datetime.now(), "data": snapshot({**row, "version": 1})}
+                for row in rows
+            ])
+            last_id = rows[-1]["id"]
+
+
+async def wait_for_changes(
+    session_factory: Callable,
+    since: int,
+    limit: int,
+    timeout: float = 0,
+) -> List[ProductChange]:
+    deadline = time.monotonic() + max(0.0, min(timeout, MAX_WAIT_SECONDS))
+    while True:
+        async with session_factory() as db:
+            changes = await db.run_sync(ChangeFeed.since, since, limit)
+        if changes or time.monotonic() >= deadline:
+            return changes
+        await asyncio.sleep(min(CHANGE_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+
+
+def format_event(change: ProductChange) -> str:
+    payload = {
+        "seq": change.seq,
+        "product_id": change.product_id,
+        "op": change.op,
+        "changed_at": change.changed_at.isoformat(),
+        "data": change.data,
+    }
+    return f"id: {change.seq}\nevent: {change.op}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def stream_changes(
+    session_factory: Callable,
+    since: int,
+    is_disconnected: Callable,
+    max_seconds: float = SSE_MAX_SECONDS,
+) -> AsyncIterator[str]:
+    deadline = time.monotonic() + max_seconds
+    heartbeat_at = time.monotonic() + SSE_HEARTBEAT_SECONDS
+    yield f"retry: {int(CHANGE_POLL_INTERVAL * 1000)}\n\n"
+    while time.monotonic() < deadline and not await is_disconnected():
+        async with session_factory() as db:
+            changes = await db.run_sync(ChangeFeed.since, since, MAX_CHANGE_PAGE_SIZE)
+        for change in changes:
+            yield format_event(change)
+            since = change.seq
+        if changes:
+            continue
+        if time.monotonic() >= heartbeat_at:
+            yield ": keep-alive\n\n"
+            heartbeat_at = time.monotonic() + SSE_HEARTBEAT_SECONDS
+        await asyncio.sleep(min(CHANGE_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
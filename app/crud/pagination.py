@@ -0,0 +1,92 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, NamedTuple, Optional, Tuple
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.orm import Query
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+class Page(NamedTuple):
+    items: List[Any]
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+
+def encode_cursor(sort: str, value: Any, id: int, backward: bool = False) -> str:
+    payload = {"s": sort, "i": id, "b": backward}
+    if isinstance(value, datetime):
+        payload["d"] = value.isoformat()
+    else:
+        payload["v"] = value
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, int, bool]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        value = datetime.fromisoformat(payload["d"]) if "d" in payload else payload.get("v")
+        id, backward = int(payload["i"]), bool(payload["b"])
+        if payload["s"] != sort:
+            raise ValueError
+    except (ValueError, TypeError, KeyError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+    return value, id, backward
+
+
+def clamp_page_size(page_size: Optional[int]) -> int:
+    if not page_size or page_size < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def _after(sort_expr, id_col, value, id, descending: bool):
+    if sort_expr is id_col:
+        return id_col < id if descending else id_col > id
+    if descending:
+        if value is None:
+            return and_(sort_expr.is_(None), id_col < id)
+        return or_(tuple_(sort_expr, id_col) < tuple_(value, id), sort_expr.is_(None))
+    if value is None:
+        return or_(and_(sort_expr.is_(None), id_col > id), sort_expr.isnot(None))
+    return tuple_(sort_expr, id_col) > tuple_(value, id)
+
+
+def paginate(
+    query: Query,
+    sort: str,
+    sort_expr,
+    id_col,
+    descending: bool = False,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None,
+) -> Page:
+    limit = clamp_page_size(page_size)
+    backward = False
+    if cursor:
+        value, id, backward = decode_cursor(cursor, sort)
+        query = query.filter(_after(sort_expr, id_col, value, id, descending != backward))
+    order = [sort_expr] if sort_expr is id_col else [sort_expr, id_col]
+    if descending != backward:
+        query = query.order_by(*(column.desc() for column in order))
+    else:
+        query = query.order_by(*(column.asc() for column in order))
+    rows = query.add_columns(sort_expr.label("sort_key")).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    if not rows:
+        return Page([], None, None)
+    first, last = rows[0], rows[-1]
+    next_cursor = prev_cursor = None
+    if backward or has_more:
+        next_cursor = encode_cursor(sort, last.sort_key, last[0].id)
+    if (backward and has_more) or (not backward and cursor):
+        prev_cursor = encode_cursor(sort, first.sort_key, first[0].id, backward=True)
+    return Page([row[0] for row in rows], next_cursor, prev_cursor)
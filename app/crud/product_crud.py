@@ -1,17 +1,52 @@
-from typing import Any, Dict, List, Optional, Union
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from app.models import Product
-from app.schemas.product import (
-    ProductBase,
-    ProductCreate,
-    ProductUpdate,
-    ProductMain,
-)
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import bindparam, func, insert, update
+from app.changes import CREATE, UPDATE, ChangeFeed
+from app.crud.pagination import Page, paginate
+from app.facets import ProductFacets, facet_keys
+from app.models import Product, User
+from app.page_cache import page_cache
+from app.read_model import READ_MODEL, ProductReadModel
+from app.search_index import ProductSearchIndex
+from app.suggest import ProductSuggestions
+from app.tags import INGREDIENT, MATCH_ALL, REGION, ProductTags
+from app.versioning import TableVersions
+from app.schemas.product import ProductCreate, ProductUpdate
+
+
+MAX_BATCH_UPDATE = 1000
+UPDATABLE_FIELDS = ("name", "description", "area", "regions", "ingredients")
+FTS_FIELDS = {"name", "description", "area", "regions", "ingredients"}
+TAG_FIELDS = {"regions", "ingredients"}
+FACET_FIELDS = {"area", "regions"}
+
+
+class VersionConflict(Exception):
+
+    def __init__(self, ids: List[int]):
+        super().__init__(f"Products were modified concurrently: {', '.join(map(str, ids))}")
+        self.ids = ids
+
+
+EXPORT_COLUMNS = ("id", "name", "description", "area", "regions", "ingredients", "date_added", "user_id")
 
 
 class ProductCRUD:
 
+    @staticmethod
+    def after_commit(db: Session) -> None:
+        ProductFacets.invalidate(db)
+        page_cache.bump_version()
+
+    @staticmethod
+    def listing_query(db: Session):
+        return db.query(Product).options(
+            joinedload(Product.user).load_only(User.id, User.username),
+        )
+
     @staticmethod
     def create(db: Session, obj_in: ProductCreate) -> Product:
         db_obj = Product(
@@ -24,10 +59,41 @@ class ProductCRUD:
             user_id=obj_in.user_id,
         )
         db.add(db_obj)
+        db.flush()
+        if ProductSearchIndex.is_available(db):
+            ProductSearchIndex.index(db, db_obj)
+        ProductTags.apply(db.connection(), {db_obj.id: (db_obj.regions, db_obj.ingredients)}, replace=False)
+        ProductFacets.apply(db, added=facet_keys(db_obj.area, db_obj.regions))
+        ChangeFeed.record_product(db, CREATE, db_obj)
+        TableVersions.bump(db)
         db.commit()
+        ProductCRUD.after_commit(db)
         db.refresh(db_obj)
+        ProductSuggestions.apply(db, [(db_obj.id, db_obj.name, db_obj.ingredients)])
         return db_obj
 
+    @staticmethod
+    def bulk_create(db: Session, objs_in: List[ProductCreate]) -> List[int]:
+        if not objs_in:
+            return []
+        rows = [obj_in.model_dump() for obj_in in objs_in]
+        inserted = db.execute(insert(Product).returning(Product.id, Product.version, sort_by_parameter_order=True), rows).all()
+        ids = [id for id, _ in inserted]
+        if ProductSearchIndex.is_available(db):
+            ProductSearchIndex.index_many(db, ids)
+        ProductTags.apply(db.connection(), {
+            id: (row["regions"], row["ingredients"]) for id, row in zip(ids, rows)
+        }, replace=False)
+        ProductFacets.apply(db, added=[
+            key for row in rows for key in facet_keys(row["area"], row["regions"])
+        ])
+        ChangeFeed.record(db, CREATE, [{**row, "id": id, "version": version} for (id, version), row in zip(inserted, rows)])
+        TableVersions.bump(db)
+        db.commit()
+        ProductCRUD.after_commit(db)
+        ProductSuggestions.apply(db, [(id, row["name"], row["ingredients"]) for id, row in zip(ids, rows)])
+        return ids
+
     @staticmethod
     def get(db: Session, id: int) -> Optional[Product]:
         return db.query(Product).filter(Product.id == id).first()
@@ -35,45 +101,177 @@ class ProductCRUD:
     @staticmethod
     def get_multi(
         db: Session,
-        skip: int = 0,
-        limit: int = 100,
-    ) -> List[Product]:
-        query = db.query(Product)
-        return query.offset(skip).limit(limit).all()
+        cursor: Optional[str] = None,
+        page_size: Optional[int] = None,
+    ) -> Page:
+        query = ProductCRUD.listing_query(db)
+        return paginate(query, "id", Product.id, Product.id, cursor=cursor, page_size=page_size)
+
+    @staticmethod
+    def get_many(db: Session, ids: List[int]) -> Dict[int, Product]:
+        return {product.id: product for product in db.query(Product).filter(Product.id.in_(ids))}
+
+    @staticmethod
+    def changed_fields(db_obj: Product, obj_in: ProductUpdate) -> Dict[str, Any]:
+        return {
+            field: value
+            for field, value in obj_in.model_dump(exclude_unset=True, include=set(UPDATABLE_FIELDS)).items()
+            if getattr(db_obj, field) != value
+        }
 
     @staticmethod
     def update(db: Session, db_obj: Product, obj_in: ProductUpdate) -> Product:
-        obj_data = obj_in.model_dump()
-        for field in obj_data:
-            setattr(db_obj, field, obj_data[field])
-        db.add(db_obj)
+        return ProductCRUD.update_many(db, [(db_obj, obj_in)])[0]
+
+    @staticmethod
+    def update_many(db: Session, edits: List[Tuple[Product, ProductUpdate]]) -> List[Product]:
+        groups, changed, conflicts = {}, [], []
+        for db_obj, obj_in in edits:
+            expected = obj_in.version if obj_in.version is not None else db_obj.version
+            if expected != db_obj.version:
+                conflicts.append(db_obj.id)
+                continue
+            changes = ProductCRUD.changed_fields(db_obj, obj_in)
+            if changes:
+                groups.setdefault(tuple(sorted(changes)), []).append((db_obj, changes))
+                changed.append((db_obj, changes))
+        if conflicts:
+            raise VersionConflict(conflicts)
+        if not changed:
+            return [db_obj for db_obj, _ in edits]
+        table = Product.__table__
+        for fields, items in groups.items():
+            statement = (
+                update(table)
+                .where(table.c.id == bindparam("_id"), table.c.version == bindparam("_version"))
+                .values({**{field: bindparam(f"_{field}") for field in fields}, "version": table.c.version + 1})
+            )
+            result = db.execute(statement, [
+                {"_id": db_obj.id, "_version": db_obj.version, **{f"_{field}": value for field, value in changes.items()}}
+                for db_obj, changes in items
+            ])
+            if result.rowcount != len(items):
+                expected = {db_obj.id: db_obj.version for db_obj, _ in items}
+                db.rollback()
+                raise VersionConflict(ProductCRUD._stale_ids(db, expected))
+        before = {db_obj.id: {field: getattr(db_obj, field) for field in UPDATABLE_FIELDS} for db_obj, _ in changed}
+        after = {
+            db_obj.id: {**before[db_obj.id], **changes}
+            for db_obj, changes in changed
+        }
+        ProductCRUD._after_update(db, changed, before, after)
+        snapshots = [
+            {column.key: getattr(db_obj, column.key) for column in Product.__table__.columns}
+            | after[db_obj.id] | {"version": db_obj.version + 1}
+            for db_obj, _ in changed
+        ]
+        ChangeFeed.record(db, UPDATE, snapshots)
+        TableVersions.bump(db)
         db.commit()
-        db.refresh(db_obj)
-        return db_obj
+        ProductCRUD.after_commit(db)
+        for db_obj, snapshot in zip([db_obj for db_obj, _ in changed], snapshots):
+            for key, value in snapshot.items():
+                set_committed_value(db_obj, key, value)
+        ProductSuggestions.apply(db, [(row["id"], row["name"], row["ingredients"]) for row in snapshots])
+        return [db_obj for db_obj, _ in edits]
 
     @staticmethod
-    def search(
+    def _after_update(db: Session, changed, before: Dict[int, dict], after: Dict[int, dict]) -> None:
+        fields = set().union(*(changes for _, changes in changed))
+        if fields & FTS_FIELDS and ProductSearchIndex.is_available(db):
+            ProductSearchIndex.index_many(db, [db_obj.id for db_obj, changes in changed if changes.keys() & FTS_FIELDS])
+        if fields & TAG_FIELDS:
+            ProductTags.apply(db.connection(), {
+                id: (after[id]["regions"], after[id]["ingredients"])
+                for id in after if before[id]["regions"] != after[id]["regions"] or before[id]["ingredients"] != after[id]["ingredients"]
+            })
+        if fields & FACET_FIELDS:
+            ProductFacets.apply(
+                db,
+                added=[key for row in after.values() for key in facet_keys(row["area"], row["regions"])],
+                removed=[key for row in before.values() for key in facet_keys(row["area"], row["regions"])],
+            )
+
+    @staticmethod
+    def _stale_ids(db: Session, expected: Dict[int, int]) -> List[int]:
+        current = dict(db.query(Product.id, Product.version).filter(Product.id.in_(list(expected))))
+        return [id for id, version in expected.items() if current.get(id) != version]
+
+    @staticmethod
+    def filter_query(
         db: Session,
+        query,
         search_term: Optional[str] = None,
         filters: Optional[Dict[str, str]] = None,
-        sorting: Optional[Dict[str, str]] = None,
-    ) -> List[Product]:
-        query = db.query(Product)
-        if search_term:
+        use_index: bool = True,
+    ):
+        ranked = None
+        if search_term and use_index and ProductSearchIndex.is_available(db):
+            match = ProductSearchIndex.build_match(search_term)
+            if match is not None:
+                ranked = ProductSearchIndex.ranked(match)
+                query = query.join(ranked, ranked.c.id == Product.id)
+        if search_term and ranked is None:
             search_term = f"%{search_term}%"
             query = query.filter(
                 Product.name.ilike(search_term) |
                 Product.ingredients.ilike(search_term)
             )
         if filters:
+            match = filters.get("match", MATCH_ALL)
             for column, value in filters.items():
-                if hasattr(Product, column):
-                    if column == "user_id":
-                        query = query.filter(getattr(Product, column) == value)
-                    elif column == "area":
-                        query = query.filter(Product.area.ilike(value))
-                    elif column == "region":
-                        query = query.filter(Product.region.ilike(value))
+                if column == "user_id":
+                    query = query.filter(Product.user_id == value)
+                elif column == "area":
+                    query = query.filter(func.lower(Product.area) == func.lower(value))
+                elif column in (REGION, INGREDIENT):
+                    condition = ProductTags.condition(column, value, match)
+                    if condition is not None:
+                        query = query.filter(condition)
+        return query, ranked
+
+    @staticmethod
+    def iter_export(
+        db: Session,
+        search_term: Optional[str] = None,
+        filters: Optional[Dict[str, str]] = None,
+        since: Optional[datetime] = None,
+        batch_size: int = 1000,
+    ):
+        query, _ = ProductCRUD.filter_query(
+            db,
+            db.query(Product),
+            search_term=search_term,
+            filters=filters,
+        )
+        if since is not None:
+            query = query.filter(Product.date_added > since)
+        columns = [getattr(Product, name) for name in EXPORT_COLUMNS]
+        return query.with_entities(*columns).order_by(Product.id).yield_per(batch_size)
+
+    @staticmethod
+    def search(
+        db: Session,
+        search_term: Optional[str] = None,
+        filters: Optional[Dict[str, str]] = None,
+        sorting: Optional[Dict[str, str]] = None,
+        use_index: bool = True,
+        cursor: Optional[str] = None,
+        page_size: Optional[int] = None,
+        read_model: bool = READ_MODEL,
+    ) -> Page:
+        if read_model and ProductReadModel.supports(search_term, filters, sorting):
+            return ProductReadModel.search(db, filters=filters, sorting=sorting, cursor=cursor, page_size=page_size)
+        query, ranked = ProductCRUD.filter_query(
+            db,
+            ProductCRUD.listing_query(db),
+            search_term=search_term,
+            filters=filters,
+            use_index=use_index,
+        )
+        sort, sort_expr, descending = "id", Product.id, False
+        if ranked is not None:
+            sort, sort_expr = "rank", ranked.c.rank
         if sorting:
             fields = {
                 "name": Product.name,
@@ -82,9 +280,50 @@ class ProductCRUD:
                 "date_added": Product.date_added,
             }
             for column, value in sorting.items():
-                if hasattr(Product, column):
-                    if value == "asc":
-                        query = query.order_by(fields[column])
-                    else:
-                        query = query.order_by(desc(fields[column]))
-        return query.all()
+                if column in fields:
+                    sort, sort_expr, descending = column, fields[column], value != "asc"
+                    break
+        return paginate(
+            query,
+            sort,
+            sort_expr,
+            Product.id,
+            descending=descending,
+            cursor=cursor,
+            page_size=page_size,
+        )
+
+
+class AsyncProductCRUD:
+
+    @staticmethod
+    async def create(db: AsyncSession, obj_in: ProductCreate) -> Product:
+        return await db.run_sync(ProductCRUD.create, obj_in)
+
+    @staticmethod
+    async def get(db: AsyncSession, id: int) -> Optional[Product]:
+        return await db.run_sync(ProductCRUD.get, id)
+
+    @staticmethod
+    async def get_multi(
+        db: AsyncSession,
+        cursor: Optional[str] = None,
+        page_size: Optional[int] = None,
+    ) -> Page:
+        return await db.run_sync(ProductCRUD.get_multi, cursor, page_size)
+
+    @staticmethod
+    async def get_many(db: AsyncSession, ids: List[int]) -> Dict[int, Product]:
+        return await db.run_sync(ProductCRUD.get_many, ids)
+
+    @staticmethod
+    async def update(db: AsyncSession, db_obj: Product, obj_in: ProductUpdate) -> Product:
+        return await db.run_sync(ProductCRUD.update, db_obj, obj_in)
+
+    @staticmethod
+    async def update_many(db: AsyncSession, edits: List[Tuple[Product, ProductUpdate]]) -> List[Product]:
+        return await db.run_sync(ProductCRUD.update_many, edits)
+
+    @staticmethod
+    async def search(db: AsyncSession, **kwargs) -> Page:
+        return await db.run_sync(lambda session: ProductCRUD.search(session, **kwargs))
@@ -1,10 +1,11 @@
 from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models import User
 from app.schemas.user import (
     UserCreate,
 )
-from app.utils import get_password_hash, verify_password 
+from app.utils import pwd_context, token_cache
 
 
 class UserCRUD:
@@ -15,6 +16,7 @@ class UserCRUD:
         db.add(db_obj)
         db.commit()
         db.refresh(db_obj)
+        UserCRUD.invalidate_cached(db_obj.username)
         return db_obj
 
     @staticmethod
@@ -26,12 +28,45 @@ class UserCRUD:
         user = UserCRUD.check_user(db, username)
         if not user:
             return None
-        is_valid = verify_password(password, user.hashed_password)
+        is_valid, new_hash = pwd_context.verify_and_update(password, user.hashed_password)
         if not is_valid:
             return None
+        if new_hash:
+            UserCRUD.update_password_hash(db, user, new_hash)
+        return user
+
+    @staticmethod
+    def update_password_hash(db: Session, user: User, hashed_password: str) -> User:
+        user.hashed_password = hashed_password
+        db.add(user)
+        db.commit()
+        db.refresh(user)
         return user
 
     @staticmethod
     def check_user(db: Session, username: str) -> Optional[User]:
         user = db.query(User).filter(User.username == username).first()
         return user
+
+    @staticmethod
+    def invalidate_cached(username: str) -> None:
+        token_cache.discard_where(lambda user: user is not None and user.username == username)
+
+
+class AsyncUserCRUD:
+
+    @staticmethod
+    async def create(db: AsyncSession, obj_in: UserCreate) -> User:
+        return await db.run_sync(UserCRUD.create, obj_in)
+
+    @staticmethod
+    async def get(db: AsyncSession, id: int) -> Optional[User]:
+        return await db.run_sync(UserCRUD.get, id)
+
+    @staticmethod
+    async def check_user(db: AsyncSession, username: str) -> Optional[User]:
+        return await db.run_sync(UserCRUD.check_user, username)
+
+    @staticmethod
+    async def update_password_hash(db: AsyncSession, user: User, hashed_password: str) -> User:
+        return await db.run_sync(UserCRUD.update_password_hash, user, hashed_password)
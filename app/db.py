@@ -1,8 +1,91 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-engine = create_engine("sqlite:///products.db")
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///products.db")
+READ_DATABASE_URL = os.environ.get("READ_DATABASE_URL", DATABASE_URL)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -64000)),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def to_async_url(url: str):
+    url = make_url(url)
+    if url.get_driver_name() in ("aiosqlite", "asyncpg", "aiomysql"):
+        return url
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def _engine_options(url, kwargs: dict) -> dict:
+    if url.get_backend_name() == "sqlite":
+        kwargs.setdefault("connect_args", {}).setdefault("check_same_thread", False)
+    if not _is_memory_sqlite(url) and "poolclass" not in kwargs:
+        kwargs.setdefault("pool_size", DB_POOL_SIZE)
+        kwargs.setdefault("max_overflow", DB_MAX_OVERFLOW)
+        kwargs.setdefault("pool_timeout", DB_POOL_TIMEOUT)
+        kwargs.setdefault("pool_pre_ping", True)
+    return kwargs
+
+
+def _install_sqlite_pragmas(engine: Engine, read_only: bool, pragmas: dict = None) -> None:
+    settings = dict(SQLITE_PRAGMAS if pragmas is None else pragmas)
+    if read_only:
+        settings["query_only"] = "ON"
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+def create_db_engine(url: str, read_only: bool = False, pragmas: dict = None, **kwargs) -> Engine:
+    url = make_url(url)
+    engine = create_engine(url, **_engine_options(url, kwargs))
+    if url.get_backend_name() == "sqlite":
+        _install_sqlite_pragmas(engine, read_only, pragmas)
+    return engine
+
+
+def create_async_db_engine(url: str, read_only: bool = False, pragmas: dict = None, **kwargs) -> AsyncEngine:
+    url = to_async_url(url)
+    engine = create_async_engine(url, **_engine_options(url, kwargs))
+    if url.get_backend_name() == "sqlite":
+        _install_sqlite_pragmas(engine.sync_engine, read_only, pragmas)
+    return engine
+
+
+engine = create_db_engine(DATABASE_URL)
+read_engine = create_db_engine(READ_DATABASE_URL, read_only=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+async_engine = create_async_db_engine(DATABASE_URL)
+async_read_engine = create_async_db_engine(READ_DATABASE_URL, read_only=True)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
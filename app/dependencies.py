@@ -0,0 +1,88 @@
+import time
+from typing import Optional
+from fastapi import Cookie, Depends, Header, HTTPException, status
+from jwt.exceptions import InvalidTokenError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.crud.user_crud import AsyncUserCRUD
+from app.schemas.token import TokenData
+from app.schemas.user import UserIdentity
+from .cache import MISSING
+from .db import AsyncReadSessionLocal, AsyncSessionLocal, ReadSessionLocal, SessionLocal
+from .metrics import AUTH, timed
+from .tokens import revocations
+from .utils import INVALID_TOKEN_TTL, sync_revocations, token_cache, verify_token
+
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+def get_sync_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_read_session_factory():
+    return ReadSessionLocal
+
+
+def get_async_read_session_factory():
+    return AsyncReadSessionLocal
+
+
+async def get_current_user(access_token: str = Cookie(...), db: AsyncSession = Depends(get_db)):
+    with timed(AUTH):
+        return await _resolve_user(access_token, db)
+
+
+async def _resolve_user(access_token: Optional[str], db: AsyncSession):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+    )
+    parts = access_token.split() if access_token else ()
+    if len(parts) != 2:
+        raise credentials_exception
+    token = parts[1]
+    if revocations.sync_due():
+        await db.run_sync(sync_revocations)
+    cached = token_cache.get(token)
+    if cached is not MISSING:
+        if cached is None:
+            raise credentials_exception
+        return cached
+    try:
+        payload = verify_token(token)
+        if payload.get("sub") is None:
+            raise InvalidTokenError("Missing subject")
+        token_data = TokenData(username=payload["sub"], expires_in=payload.get("exp"))
+    except InvalidTokenError:
+        token_cache.set(token, None, ttl=INVALID_TOKEN_TTL)
+        raise credentials_exception
+    if isinstance(payload.get("uid"), int):
+        current_user = UserIdentity(id=payload["uid"], username=token_data.username)
+    else:
+        user = await AsyncUserCRUD.check_user(db, token_data.username)
+        if user is None:
+            raise credentials_exception
+        current_user = UserIdentity.model_validate(user)
+    ttl = token_data.expires_in - time.time() if token_data.expires_in else None
+    token_cache.set(token, current_user, ttl=ttl)
+    return current_user
+
+
+async def get_api_user(
+    authorization: Optional[str] = Header(None),
+    access_token: Optional[str] = Cookie(None),
+    db: AsyncSession = Depends(get_db),
+):
+    return await get_current_user(authorization or access_token, db)
@@ -0,0 +1,110 @@
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import event, inspect, text, tuple_
+from sqlalchemy.orm import Session
+from .models import Facet, Product
+
+
+FACET_CACHE_TTL = 60
+AREA = "area"
+REGION = "region"
+
+_REGION_SEPARATORS = re.compile(r"[,;/|]")
+_cache = {}
+_lock = threading.Lock()
+
+
+def split_regions(regions: Optional[str]) -> List[str]:
+    if not regions:
+        return []
+    values = []
+    for value in _REGION_SEPARATORS.split(regions):
+        value = value.strip()
+        if value and value not in values:
+            values.append(value)
+    return values
+
+
+def facet_keys(area: Optional[str], regions: Optional[str]) -> Set[Tuple[str, str]]:
+    keys = {(REGION, region) for region in split_regions(regions)}
+    if area and area.strip():
+        keys.add((AREA, area.strip()))
+    return keys
+
+
+class ProductFacets:
+
+    @staticmethod
+    def apply(db: Session, added: Iterable[Tuple[str, str]] = (), removed: Iterable[Tuple[str, str]] = ()) -> None:
+        delta = Counter(added)
+        delta.subtract(Counter(removed))
+        delta = {key: count for key, count in delta.items() if count}
+        if not delta:
+            return
+        existing = {
+            (facet.kind, facet.value): facet
+            for facet in db.query(Facet).filter(tuple_(Facet.kind, Facet.value).in_(list(delta)))
+        }
+        for key, count in delta.items():
+            facet = existing.get(key)
+            if facet is None:
+                if count > 0:
+                    db.add(Facet(kind=key[0], value=key[1], product_count=count))
+                continue
+            facet.product_count += count
+            if facet.product_count <= 0:
+                db.delete(facet)
+
+    @staticmethod
+    def rebuild(db: Session) -> None:
+        db.query(Facet).delete()
+        counts = Counter()
+        for area, regions in db.query(Product.area, Product.regions).yield_per(1000):
+            counts.update(facet_keys(area, regions))
+        db.add_all(
+            Facet(kind=kind, value=value, product_count=count)
+            for (kind, value), count in counts.items()
+        )
+        db.commit()
+        ProductFacets.invalidate(db)
+
+    @staticmethod
+    def get(db: Session) -> Dict[str, List[Tuple[str, int]]]:
+        key = ProductFacets._cache_key(db)
+        with _lock:
+            cached = _cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < FACET_CACHE_TTL:
+            return cached[1]
+        facets = {AREA: [], REGION: []}
+        for facet in db.query(Facet).order_by(Facet.kind, Facet.value):
+            facets.setdefault(facet.kind, []).append((facet.value, facet.product_count))
+        with _lock:
+            _cache[key] = (time.monotonic(), facets)
+        return facets
+
+    @staticmethod
+    def invalidate(db: Optional[Session] = None) -> None:
+        with _lock:
+            _cache.clear()
+
+    @staticmethod
+    def _cache_key(db: Session):
+        bind = db.get_bind()
+        return getattr(bind, "engine", bind).url
+
+
+@event.listens_for(Facet.__table__, "after_create")
+def _populate_facets(target, connection, **kw):
+    if not inspect(connection).has_table(Product.__tablename__):
+        return
+    counts = Counter()
+    for area, regions in connection.execute(text("SELECT area, regions FROM products")):
+        counts.update(facet_keys(area, regions))
+    if counts:
+        connection.execute(Facet.__table__.insert(), [
+            {"kind": kind, "value": value, "product_count": count}
+            for (kind, value), count in counts.items()
+        ])
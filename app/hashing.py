@@ -0,0 +1,51 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+from .metrics import AUTH, timed
+from .utils import pwd_context
+
+
+AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", min(4, os.cpu_count() or 1)))
+AUTH_QUEUE_SIZE = int(os.environ.get("AUTH_QUEUE_SIZE", 32))
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+
+    def __init__(self, max_workers: int = AUTH_WORKERS, max_pending: int = AUTH_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hasher")
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HasherBusy()
+        try:
+            loop = asyncio.get_running_loop()
+            with timed(AUTH):
+                return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self.run(pwd_context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: Optional[str]) -> Tuple[bool, Optional[str]]:
+        if hashed_password is None:
+            await self.run(pwd_context.dummy_verify)
+            return False, None
+        return await self.run(pwd_context.verify_and_update, password, hashed_password)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+password_hasher = PasswordHasher()
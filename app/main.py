@@ -1,54 +1,118 @@
+import io
+import os
+from contextlib import asynccontextmanager
 from typing import Optional, Annotated
 from datetime import datetime, timedelta
-from fastapi.templating import Jinja2Templates
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Form, Cookie
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Form, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
-from jwt.exceptions import InvalidTokenError
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.crud.user_crud import UserCRUD
-from app.crud.product_crud import ProductCRUD
+from app.crud.user_crud import AsyncUserCRUD
+from app.crud.product_crud import AsyncProductCRUD, VersionConflict
+from app.schemas.bulk import ImportReport
 from app.schemas.forms import CreateProductForm, UpdateProductForm
 from app.schemas.product import ProductCreate, ProductUpdate
-from app.schemas.token import Token, TokenData
-from app.schemas.user import UserCreate, User
-from .db import SessionLocal, Base, engine
-from .models import Product
-from .utils import create_access_token, get_password_hash, verify_token
+from app.schemas.token import Token
+from app.schemas.user import UserCreate
+from .admission import AdmissionMiddleware, admission
+from .api import router as api_router
+from .bulk import CHUNK_SIZE, FORMATS, MEDIA_TYPES, detect_format, import_products, iter_export
+from .db import ReadSessionLocal, async_engine, async_read_engine, engine, read_engine
+from .dependencies import (
+    get_current_user,
+    get_db,
+    get_read_db,
+    get_read_session_factory,
+    get_sync_db,
+)
+from .facets import ProductFacets
+from .hashing import HasherBusy, password_hasher
+from .metrics import InstrumentationMiddleware, render_metrics
+from .migrations import migrate
+from .page_cache import page_cache
+from .profiler import ProfilerMiddleware
+from .read_model import READ_MODEL, ProductReadModel
+from .slow_log import slow_query_log
+from .suggest import SUGGEST_LIMIT, ProductSuggestions
+from .templating import STREAM_MIN_ITEMS, create_templates, precompile, stream_template, url_prefixes
+from .tokens import revocations
+from .utils import create_access_token, revoke_token, token_cache
+from .versioning import TableVersions
 
 
-templates = Jinja2Templates(directory="./app/templates")
-app = FastAPI()
-Base.metadata.create_all(bind=engine)
+MIGRATE_ON_STARTUP = os.environ.get("MIGRATE_ON_STARTUP", "1").lower() in ("1", "true", "yes")
 
-def get_db():
-    db = SessionLocal()
+templates = create_templates()
+_initialized = False
+
+
+def initialize(run_migrations: bool = MIGRATE_ON_STARTUP) -> None:
+    global _initialized
+    if _initialized:
+        return
+    if run_migrations:
+        migrate(engine)
+    precompile(templates)
+    with ReadSessionLocal() as db:
+        ProductSuggestions.index(db)
+        if READ_MODEL:
+            ProductReadModel.snapshot(db)
+    _initialized = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(initialize)
+    yield
+    slow_query_log.close()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
+    engine.dispose()
+    read_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(InstrumentationMiddleware)
+app.add_middleware(ProfilerMiddleware)
+app.include_router(api_router)
+
+
+async def get_optional_user(request: Request, db: AsyncSession):
     try:
-        yield db
-    finally:
-        db.close()
+        return await get_current_user(request.cookies.get("access_token"), db)
+    except HTTPException:
+        return None
 
 
-def get_current_user(access_token: str = Cookie(...), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
+def auth_busy_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication service is busy, try again shortly",
+        headers={"Retry-After": "1"},
+    )
+
+
+async def listing_cache_key(request: Request, db: AsyncSession, current_user) -> str:
+    version = await db.run_sync(TableVersions.get)
+    return page_cache.key(request.url.path, dict(request.query_params), current_user and current_user.id, version)
+
+
+def render_listing(request: Request, cache_key: str, context: dict):
+    context.update(url_prefixes(request))
+    if len(context["products"]) < STREAM_MIN_ITEMS:
+        response = templates.TemplateResponse(request=request, name="products.html", context=context)
+        page_cache.set(cache_key, response.body)
+        return response
+    return stream_template(
+        templates,
+        request,
+        "products.html",
+        context,
+        on_complete=lambda body: page_cache.set(cache_key, body),
     )
-    try:
-        if access_token:
-            token = access_token.split()[1]
-            payload = verify_token(token)
-            if payload.get("sub") is None:
-                raise credentials_exception
-            token_data = TokenData(username=payload["sub"], expires_in=payload.get("exp"))
-        else:
-            raise credentials_exception
-    except InvalidTokenError:
-        raise credentials_exception
-    user = UserCRUD.check_user(db, token_data.username)
-    if user is None:
-        raise credentials_exception
-    return user
 
 
 @app.get('/login_form')
@@ -57,22 +121,26 @@ def login_form(request: Request, response_class=HTMLResponse):
 
 
 @app.post("/login_form")
-def signup(
+async def signup(
     request: Request,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     response_class=RedirectResponse,
 ):
-    user = UserCRUD.check_user(db, form_data.username)
+    user = await AsyncUserCRUD.check_user(db, form_data.username)
     if user:
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="User already exists",
         )
     try:
-        UserCRUD.create(
+        hashed_password = await password_hasher.hash(form_data.password)
+    except HasherBusy:
+        raise auth_busy_exception()
+    try:
+        await AsyncUserCRUD.create(
             db,
-            UserCreate(username=form_data.username, hashed_password=get_password_hash(form_data.password)),
+            UserCreate(username=form_data.username, hashed_password=hashed_password),
         )
     except:
         raise HTTPException(
@@ -83,20 +151,29 @@ def signup(
 
 
 @app.post("/login")
-def login(
+async def login(
     response: RedirectResponse,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    user = UserCRUD.authenticate(db, form_data.username, form_data.password)
-    if not user:
+    user = await AsyncUserCRUD.check_user(db, form_data.username)
+    try:
+        is_valid, new_hash = await password_hasher.verify_and_update(
+            form_data.password,
+            user.hashed_password if user else None,
+        )
+    except HasherBusy:
+        raise auth_busy_exception()
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
+    if new_hash:
+        await AsyncUserCRUD.update_password_hash(db, user, new_hash)
     access_token_expires = timedelta(minutes=30)
     access_token = create_access_token(
-        data={"sub": user.username},
+        data={"sub": user.username, "uid": user.id},
         expires_delta=access_token_expires,
     )
     token = Token(access_token=access_token, token_type="bearer")
@@ -106,36 +183,45 @@ def login(
 
 
 @app.get("/logout")
-def logout(request: Request, response_class=RedirectResponse):
+def logout(request: Request, response_class=RedirectResponse, db: Session = Depends(get_sync_db)):
+    parts = request.cookies.get("access_token", "").split()
+    if len(parts) == 2:
+        revoke_token(parts[1], db)
     response = RedirectResponse('/products/read', status_code=status.HTTP_303_SEE_OTHER)
     response.delete_cookie("access_token")
     return response
 
 
 @app.get("/products/read")
-def read_products(
+async def read_products(
     request: Request,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
     response_class=HTMLResponse,
 ):
-    products = ProductCRUD.get_multi(
-        db, 
-    )
+    current_user = await get_optional_user(request, db)
+    cache_key = await listing_cache_key(request, db, current_user)
+    cached = page_cache.get(cache_key)
+    if cached is not None:
+        return HTMLResponse(cached)
     try:
-        current_user = get_current_user(request.cookies.get("access_token"), db)
-    except:
-        current_user = None
-    areas = [product.area for product in products if product.area is not None]
-    regions = [product.regions for product in products if product.regions is not None]
-    return templates.TemplateResponse(
-        request=request,
-        name="products.html",
-        context={"products": products, "current_user": current_user, "areas": areas, "regions": regions},
-    )
+        page = await AsyncProductCRUD.get_multi(db, cursor=cursor, page_size=page_size)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    facets = await db.run_sync(ProductFacets.get)
+    return render_listing(request, cache_key, {
+        "products": page.items,
+        "current_user": current_user,
+        "areas": facets["area"],
+        "regions": facets["region"],
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor,
+    })
 
 
 @app.get("/products/create")
-def create_product_form(
+async def create_product_form(
     request: Request,
     current_user = Depends(get_current_user),
     response_class=HTMLResponse,
@@ -144,8 +230,8 @@ def create_product_form(
 
 
 @app.post("/products/create")
-def create_product(
-    db: Session = Depends(get_db),
+async def create_product(
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user),
     form_data: CreateProductForm = Depends(CreateProductForm.as_form),
     response_class=RedirectResponse,
@@ -159,20 +245,20 @@ def create_product(
         date_added=datetime.now(),
         user_id=current_user.id,
     )
-    db_product = ProductCRUD.create(db, obj_in)
+    db_product = await AsyncProductCRUD.create(db, obj_in)
     response = RedirectResponse('/products/read', status_code=status.HTTP_303_SEE_OTHER)
     return response
 
 
 @app.get("/products/edit/{product_id}")
-def edit_product_form(
+async def edit_product_form(
     product_id: int,
     request: Request,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     response_class=HTMLResponse,
 ):
-    product = ProductCRUD.get(db, id=product_id)
+    product = await AsyncProductCRUD.get(db, id=product_id)
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -182,13 +268,13 @@ def edit_product_form(
 
 
 @app.post("/products/edit/{product_id}")
-def update_product(
+async def update_product(
     product_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_user),
     form_data: UpdateProductForm = Depends(UpdateProductForm.as_form)
 ):
-    db_product = ProductCRUD.get(db, id=product_id)
+    db_product = await AsyncProductCRUD.get(db, id=product_id)
     if not db_product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -198,28 +284,38 @@ def update_product(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
     product = ProductUpdate(
         name=form_data.name,
-        description=form_data.description,
-        area=form_data.area,
-        regions=form_data.regions,
-        ingredients=form_data.ingredients,
-        date_added=form_data.date_added,
-        user_id=form_data.user_id,
+        description=form_data.description or None,
+        area=form_data.area or None,
+        regions=form_data.regions or None,
+        ingredients=form_data.ingredients or None,
+        version=form_data.version,
     )
-    updated_product = ProductCRUD.update(db, db_obj=db_product, obj_in=product)
+    try:
+        await AsyncProductCRUD.update(db, db_obj=db_product, obj_in=product)
+    except VersionConflict:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Product was modified by someone else, reload the form and retry",
+        )
     response = RedirectResponse('/products/read', status_code=status.HTTP_303_SEE_OTHER)
     return response
 
 
 @app.get("/products/search")
-def search_products(
+async def search_products(
     request: Request,
     query: Optional[str] = None,
     user_id: Optional[str] = None,
     area: Optional[str] = None,
     region: Optional[str] = None,
+    ingredient: Optional[str] = None,
+    match: str = "all",
     order_by: Optional[str] = None,
     direction: Optional[str] = None,
-    db: Session = Depends(get_db),
+    fulltext: bool = True,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
     response_class=HTMLResponse,
 ):
     filters, sorting = {}, {}
@@ -227,25 +323,130 @@ def search_products(
         filters["area"] = area
     if region:
         filters["region"] = region
+    if ingredient:
+        filters["ingredient"] = ingredient
+    if region or ingredient:
+        filters["match"] = match
     if user_id:
         filters["user_id"] = user_id
     if order_by and direction:
         sorting[order_by] = direction
 
-    products = ProductCRUD.search(
-        db,
-        search_term=query,
-        filters=filters,
-        sorting=sorting,
-    )
-    areas = [product.area for product in products if product.area is not None]
-    regions = [product.regions for product in products if product.regions is not None]
+    current_user = await get_optional_user(request, db)
+    cache_key = await listing_cache_key(request, db, current_user)
+    cached = page_cache.get(cache_key)
+    if cached is not None:
+        return HTMLResponse(cached)
     try:
-        current_user = get_current_user(request.cookies.get("access_token"), db)
-    except:
-        current_user = None
-    return templates.TemplateResponse(
-        request=request,
-        name="products.html",
-        context={"products": products, "current_user": current_user, "areas": areas, "regions": regions},
+        page = await AsyncProductCRUD.search(
+            db,
+            search_term=query,
+            filters=filters,
+            sorting=sorting,
+            use_index=fulltext,
+            cursor=cursor,
+            page_size=page_size,
+        )
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    facets = await db.run_sync(ProductFacets.get)
+    return render_listing(request, cache_key, {
+        "products": page.items,
+        "current_user": current_user,
+        "areas": facets["area"],
+        "regions": facets["region"],
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor,
+    })
+
+
+@app.get("/products/suggest")
+def suggest_products(
+    q: str = "",
+    limit: int = SUGGEST_LIMIT,
+    session_factory = Depends(get_read_session_factory),
+):
+    with session_factory() as db:
+        return {"query": q, "suggestions": ProductSuggestions.suggest(db, q, limit)}
+
+
+@app.get("/products/facets")
+async def product_facets(db: AsyncSession = Depends(get_read_db)):
+    facets = await db.run_sync(ProductFacets.get)
+    return {
+        "areas": [{"value": value, "count": count} for value, count in facets["area"]],
+        "regions": [{"value": value, "count": count} for value, count in facets["region"]],
+    }
+
+
+@app.post("/products/import", response_model=ImportReport)
+def import_products_upload(
+    file: UploadFile,
+    format: Optional[str] = None,
+    chunk_size: int = CHUNK_SIZE,
+    db: Session = Depends(get_sync_db),
+    current_user = Depends(get_current_user),
+):
+    format = format or detect_format(file.filename)
+    if format not in FORMATS or chunk_size < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Format must be one of {', '.join(FORMATS)} with a positive chunk size",
+        )
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return import_products(db, stream, current_user.id, format=format, chunk_size=chunk_size)
+    finally:
+        stream.detach()
+
+
+@app.get("/products/export")
+def export_products(
+    format: str = "csv",
+    query: Optional[str] = None,
+    user_id: Optional[str] = None,
+    area: Optional[str] = None,
+    region: Optional[str] = None,
+    ingredient: Optional[str] = None,
+    match: str = "all",
+    since: Optional[datetime] = None,
+    session_factory = Depends(get_read_session_factory),
+):
+    if format not in FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Format must be one of {', '.join(FORMATS)}",
+        )
+    filters = {}
+    if area:
+        filters["area"] = area
+    if region:
+        filters["region"] = region
+    if ingredient:
+        filters["ingredient"] = ingredient
+    if region or ingredient:
+        filters["match"] = match
+    if user_id:
+        filters["user_id"] = user_id
+    return StreamingResponse(
+        iter_export(session_factory, format=format, search_term=query, filters=filters, since=since),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
     )
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "pages": page_cache.stats(),
+        "tokens": token_cache.stats(),
+        "revoked_tokens": len(revocations),
+        "slow_queries": slow_query_log.logged,
+        "admission": admission.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    body = render_metrics() + "\n".join(admission.render()) + "\n"
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
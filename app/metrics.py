@@ -0,0 +1,238 @@
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", 1.0))
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SQL = "sql"
+RENDER = "render"
+AUTH = "auth"
+PHASES = (SQL, RENDER, AUTH)
+
+_current: ContextVar[Optional["RequestTimings"]] = ContextVar("request_timings", default=None)
+_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+
+
+class RequestTimings:
+    __slots__ = ("durations", "counts")
+
+    def __init__(self):
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+
+    def add(self, phase: str, duration: float) -> None:
+        self.durations[phase] += duration
+        self.counts[phase] += 1
+
+    def server_timing(self, total: float) -> str:
+        entries = [f'{phase};dur={self.durations[phase] * 1000:.2f};desc="{self.counts[phase]}x"' for phase in PHASES]
+        entries.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(entries)
+
+
+def current_endpoint() -> Optional[str]:
+    scope = _scope.get()
+    if scope is None:
+        return None
+    route = scope.get("route")
+    return f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - started)
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, [list(counts), total, count]) for labels, (counts, total, count) in self._series.items())
+        for label_values, (counts, total, count) in series:
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values)]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _labels(labels + [f'le="{_format(bound)}"'])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            inf_labels = _labels(labels + ['le="+Inf"'])
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {_format(total)}")
+            lines.append(f"{self.name}_count{_labels(labels)} {count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: List[str]) -> str:
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format(value: float) -> str:
+    return repr(float(value)) if value != int(value) else f"{int(value)}.0"
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Wall time per request", DURATION_BUCKETS, ("method", "route", "status"),
+)
+SQL_DURATION = Histogram(
+    "http_request_sql_duration_seconds", "Total SQL time per request", DURATION_BUCKETS, ("method", "route"),
+)
+SQL_QUERIES = Histogram(
+    "http_request_sql_queries", "SQL statements executed per request", COUNT_BUCKETS, ("method", "route"),
+)
+RENDER_DURATION = Histogram(
+    "http_request_render_duration_seconds", "Template render time per request", DURATION_BUCKETS, ("method", "route"),
+)
+AUTH_DURATION = Histogram(
+    "http_request_auth_duration_seconds", "Authentication time per request", DURATION_BUCKETS, ("method", "route"),
+)
+ADMISSION_WAIT = Histogram(
+    "http_admission_wait_seconds", "Time spent waiting for an admission slot", DURATION_BUCKETS, ("class", "outcome"),
+)
+HISTOGRAMS = (REQUEST_DURATION, SQL_DURATION, SQL_QUERIES, RENDER_DURATION, AUTH_DURATION, ADMISSION_WAIT)
+
+
+def render_metrics() -> str:
+    return "\n".join(line for histogram in HISTOGRAMS for line in histogram.render()) + "\n"
+
+
+def reset_metrics() -> None:
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+class TimedTemplate(Template):
+
+    def render(self, *args, **kwargs) -> str:
+        with timed(RENDER):
+            return super().render(*args, **kwargs)
+
+    def generate(self, *args, **kwargs) -> Iterator[str]:
+        timings = _current.get()
+        chunks = super().generate(*args, **kwargs)
+        if timings is None:
+            yield from chunks
+            return
+        elapsed = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                chunk = next(chunks, None)
+                elapsed += time.perf_counter() - started
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            timings.add(RENDER, elapsed)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    if timings is None:
+        return
+    started = conn.info.get("metrics_started")
+    if started:
+        timings.add(SQL, time.perf_counter() - started.pop())
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, app, sample_rate: float = METRICS_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        scope_token = _scope.set(scope)
+        try:
+            if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+                await self.app(scope, receive, send)
+            else:
+                await self.instrumented(scope, receive, send)
+        finally:
+            _scope.reset(scope_token)
+
+    async def instrumented(self, scope, receive, send):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing(time.perf_counter() - started).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path", "unmatched"))
+            REQUEST_DURATION.observe(time.perf_counter() - started, *labels, str(status))
+            SQL_DURATION.observe(timings.durations[SQL], *labels)
+            SQL_QUERIES.observe(timings.counts[SQL], *labels)
+            RENDER_DURATION.observe(timings.durations[RENDER], *labels)
+            AUTH_DURATION.observe(timings.durations[AUTH], *labels)
@@ -0,0 +1,75 @@
+from datetime import datetime
+from typing import Callable, List, Tuple
+from sqlalchemy import inspect, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+from . import facets, search_index, versioning
+from .changes import ChangeFeed
+from .db import Base
+from .models import Product, SchemaMigration
+from .tags import ProductTags
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = []
+
+
+def migration(version: int, name: str):
+    def register(func: Callable[[Connection], None]):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return register
+
+
+@migration(1, "product_access_path_indexes")
+def _product_access_path_indexes(connection: Connection) -> None:
+    for index in Product.__table__.indexes:
+        connection.execute(CreateIndex(index, if_not_exists=True))
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("ANALYZE products")
+
+
+@migration(2, "normalize_regions_and_ingredients")
+def _normalize_regions_and_ingredients(connection: Connection) -> None:
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_products_lower_regions")
+    ProductTags.rebuild(connection)
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("ANALYZE")
+
+
+@migration(3, "product_change_feed")
+def _product_change_feed(connection: Connection) -> None:
+    ChangeFeed.backfill(connection)
+
+
+@migration(4, "product_row_version")
+def _product_row_version(connection: Connection) -> None:
+    columns = {column["name"] for column in inspect(connection).get_columns("products")}
+    if "version" not in columns:
+        connection.exec_driver_sql("ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+
+def pending(engine: Engine) -> List[Tuple[int, str, Callable[[Connection], None]]]:
+    with engine.connect() as connection:
+        applied = set(connection.scalars(select(SchemaMigration.version)))
+    return [item for item in MIGRATIONS if item[0] not in applied]
+
+
+def migrate(engine: Engine) -> List[int]:
+    Base.metadata.create_all(bind=engine)
+    applied = []
+    for version, name, func in pending(engine):
+        with engine.begin() as connection:
+            func(connection)
+            connection.execute(SchemaMigration.__table__.insert().values(
+                version=version,
+                name=name,
+                applied_at=datetime.now(),
+            ))
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    from .db import engine
+    print("Applied migrations:", migrate(engine) or "none")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import JSON, Column, Float, Integer, String, DateTime, ForeignKey, Index, Table, func
 from sqlalchemy.orm import relationship
 from .db import Base
 
@@ -13,8 +13,18 @@ class Product(Base):
     ingredients = Column(String)
     date_added = Column(DateTime)
     user_id = Column(Integer, ForeignKey("users.id"))
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     user = relationship("User", back_populates="products")
 
+    __table_args__ = (
+        Index("ix_products_name", "name"),
+        Index("ix_products_ingredients", "ingredients"),
+        Index("ix_products_area", "area"),
+        Index("ix_products_date_added", "date_added"),
+        Index("ix_products_user_id_date_added", "user_id", "date_added"),
+        Index("ix_products_lower_area", func.lower(area)),
+    )
+
 
 class User(Base):
     __tablename__ = "users"
@@ -23,3 +33,79 @@ class User(Base):
     username = Column(String(50), unique=True, index=True, nullable=False)
     hashed_password = Column(String(100), nullable=False)
     products = relationship("Product", back_populates="user")
+
+
+class Facet(Base):
+    __tablename__ = "product_facets"
+
+    kind = Column(String(16), primary_key=True)
+    value = Column(String, primary_key=True)
+    product_count = Column(Integer, nullable=False, default=0)
+
+
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    applied_at = Column(DateTime, nullable=False)
+
+
+class ProductChange(Base):
+    __tablename__ = "product_changes"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False, index=True)
+    op = Column(String(16), nullable=False)
+    changed_at = Column(DateTime, nullable=False)
+    data = Column(JSON, nullable=False)
+
+
+class Region(Base):
+    __tablename__ = "regions"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    key = Column(String, unique=True, nullable=False)
+
+
+class Ingredient(Base):
+    __tablename__ = "ingredients"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    key = Column(String, unique=True, nullable=False)
+
+
+product_regions = Table(
+    "product_regions",
+    Base.metadata,
+    Column("product_id", Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True),
+    Column("region_id", Integer, ForeignKey("regions.id", ondelete="CASCADE"), primary_key=True),
+    Index("ix_product_regions_region_id_product_id", "region_id", "product_id"),
+)
+
+product_ingredients = Table(
+    "product_ingredients",
+    Base.metadata,
+    Column("product_id", Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True),
+    Column("ingredient_id", Integer, ForeignKey("ingredients.id", ondelete="CASCADE"), primary_key=True),
+    Index("ix_product_ingredients_ingredient_id_product_id", "ingredient_id", "product_id"),
+)
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True)
+    jti = Column(String(64), nullable=False, unique=True)
+    expires_at = Column(Float, nullable=False)
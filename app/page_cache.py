@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import urlencode
+
+
+PAGE_CACHE_BACKEND = os.environ.get("PAGE_CACHE_BACKEND", "memory")
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 300))
+VERSION_COUNTER = "catalog_version"
+
+
+class MemoryBackend:
+
+    def __init__(self, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, value)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def incr(self, name: str) -> int:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+            return self._counters[name]
+
+    def counter(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _remove(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class SQLiteBackend:
+
+    def __init__(self, path: str, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS page_cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_page_cache_accessed_at ON page_cache (accessed_at)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM page_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM page_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE page_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO page_cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + ttl, now),
+            )
+            self._connection.execute("DELETE FROM page_cache WHERE expires_at <= ?", (now,))
+            total = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM page_cache").fetchone()[0]
+            while total > self.max_bytes:
+                oldest, size = self._connection.execute(
+                    "SELECT key, size FROM page_cache ORDER BY accessed_at LIMIT 1"
+                ).fetchone()
+                self._connection.execute("DELETE FROM page_cache WHERE key = ?", (oldest,))
+                total -= size
+                self.evictions += 1
+
+    def incr(self, name: str) -> int:
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO counters (name, value) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+                (name,),
+            )
+            return self._connection.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+
+    def counter(self, name: str) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM page_cache")
+
+
+def create_backend(spec: str = PAGE_CACHE_BACKEND, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+    if spec == "memory":
+        return MemoryBackend(max_bytes=max_bytes)
+    if spec.startswith("sqlite:///"):
+        return SQLiteBackend(spec[len("sqlite:///"):], max_bytes=max_bytes)
+    raise ValueError(f"Unsupported page cache backend: {spec}")
+
+
+class PageCache:
+
+    def __init__(self, backend=None, ttl: float = PAGE_CACHE_TTL):
+        self.backend = backend if backend is not None else create_backend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path: str, params: Dict[str, str], user_id: Optional[int] = None, version: Optional[int] = None) -> str:
+        normalized = urlencode(sorted((name, value) for name, value in params.items() if value not in (None, "")))
+        if version is None:
+            version = self.backend.counter(VERSION_COUNTER)
+        raw = f"{version}|{user_id or 'anonymous'}|{path}?{normalized}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        self.backend.set(key, value, self.ttl)
+
+    def bump_version(self) -> int:
+        return self.backend.incr(VERSION_COUNTER)
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "version": self.backend.counter(VERSION_COUNTER),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "bytes": self.backend.size,
+            "max_bytes": self.backend.max_bytes,
+            "evictions": self.backend.evictions,
+        }
+
+
+page_cache = PageCache()
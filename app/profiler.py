@@ -0,0 +1,133 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from urllib.parse import parse_qs
+from jwt.exceptions import InvalidTokenError
+from .utils import verify_token
+
+
+ADMIN_USERNAMES = {name.strip() for name in os.environ.get("ADMIN_USERNAMES", "").split(",") if name.strip()}
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 1))
+MAX_STACK_DEPTH = 128
+
+_labels = {}
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        for path in sorted(sys.path, key=len, reverse=True):
+            if path and filename.startswith(path + os.sep):
+                filename = filename[len(path) + 1:]
+                break
+        label = _labels[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+    return label
+
+
+class SamplingProfiler:
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def _request_token(scope) -> Optional[str]:
+    headers = dict(scope.get("headers") or [])
+    value = headers.get(b"authorization")
+    if value is None:
+        for cookie in headers.get(b"cookie", b"").decode("latin-1").split(";"):
+            name, _, cookie_value = cookie.strip().partition("=")
+            if name == "access_token":
+                value = cookie_value.strip('"').encode("latin-1")
+                break
+    if not value:
+        return None
+    parts = value.decode("latin-1").split()
+    return parts[1] if len(parts) == 2 else None
+
+
+def is_admin(scope) -> bool:
+    token = _request_token(scope)
+    if token is None:
+        return False
+    try:
+        return verify_token(token).get("sub") in ADMIN_USERNAMES
+    except InvalidTokenError:
+        return False
+
+
+class ProfilerMiddleware:
+
+    def __init__(self, app, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.app = app
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or b"profile=" not in scope.get("query_string", b""):
+            await self.app(scope, receive, send)
+            return
+        if parse_qs(scope["query_string"].decode("latin-1")).get("profile") != ["1"]:
+            await self.app(scope, receive, send)
+            return
+        if not is_admin(scope):
+            await self.respond(send, 403, b"Profiling is restricted to administrators\n")
+            return
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        profiler = SamplingProfiler(interval=self.interval).start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            profiler.stop()
+        elapsed = time.perf_counter() - started
+        await self.respond(send, 200, profiler.collapsed().encode(), [
+            (b"x-profile-status", str(status).encode()),
+            (b"x-profile-samples", str(sum(profiler.samples.values())).encode()),
+            (b"x-profile-duration-ms", f"{elapsed * 1000:.2f}".encode()),
+        ])
+
+    @staticmethod
+    async def respond(send, status: int, body: bytes, headers=()) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8"), *headers],
+        })
+        await send({"type": "http.response.body", "body": body})
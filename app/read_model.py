@@ -0,0 +1,421 @@
+import heapq
+import os
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session, joinedload
+from .changes import ChangeFeed
+from .crud.pagination import Page, clamp_page_size, decode_cursor, encode_cursor
+from .facets import split_regions
+from .models import Product, User
+from .tags import INGREDIENT, MATCH_ANY, REGION, split_ingredients, tag_key
+
+
+READ_MODEL = os.environ.get("READ_MODEL", "0").lower() in ("1", "true", "yes")
+READ_MODEL_REFRESH_SECONDS = float(os.environ.get("READ_MODEL_REFRESH_SECONDS", 0))
+BUILD_BATCH_SIZE = 10000
+SORT_COLUMNS = ("name", "ingredients", "area", "date_added")
+FILTER_KEYS = {"user_id", "area", REGION, INGREDIENT, "match"}
+COLUMNS = (Product.id, Product.name, Product.area, Product.regions, Product.ingredients, Product.date_added, Product.user_id)
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+NULL_DATE = -(2 ** 63)
+_NONZERO = re.compile(rb"[^\x00]")
+_models = {}
+_models_lock = threading.Lock()
+
+
+def to_timestamp(value) -> int:
+    if value is None:
+        return NULL_DATE
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return (value - EPOCH) // MICROSECOND
+
+
+def from_timestamp(value: int) -> Optional[datetime]:
+    return None if value == NULL_DATE else EPOCH + value * MICROSECOND
+
+
+def set_bits(mask: int) -> List[int]:
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+    positions = []
+    for match in _NONZERO.finditer(data):
+        byte, base = data[match.start()], match.start() << 3
+        positions.extend(base + bit for bit in range(8) if byte >> bit & 1)
+    return positions
+
+
+class StaleSnapshot(Exception):
+    pass
+
+
+class CatalogSnapshot:
+
+    def __init__(self):
+        self.ids = array("q")
+        self.user_ids = array("q")
+        self.dates = array("q")
+        self.areas = array("l")
+        self.regions = array("l")
+        self.names: List[str] = []
+        self.ingredients: List[Optional[str]] = []
+        self.strings: List[Optional[str]] = [None]
+        self.bitmaps: Dict[Tuple[str, str], bytearray] = {}
+        self.postings: Dict[Tuple[str, object], array] = {}
+        self.orders: Dict[str, array] = {}
+        self.last_seq = 0
+        self.refreshed_at = 0.0
+        self.ready = threading.Event()
+        self._codes: Dict[Optional[str], int] = {None: 0}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def intern(self, value: Optional[str]) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def value(self, column: str, position: int):
+        if column == "name":
+            return self.names[position]
+        if column == "ingredients":
+            return self.ingredients[position]
+        if column == "area":
+            return self.strings[self.areas[position]]
+        if column == "date_added":
+            return from_timestamp(self.dates[position])
+        return self.ids[position]
+
+    def sort_key(self, column: str) -> Callable[[int], tuple]:
+        ids = self.ids
+        if column == "date_added":
+            dates = self.dates
+            return lambda position: (dates[position] != NULL_DATE, dates[position], ids[position])
+        if column == "area":
+            areas, strings = self.areas, self.strings
+            return lambda position: (areas[position] != 0, strings[areas[position]] or "", ids[position])
+        values = self.names if column == "name" else self.ingredients
+        return lambda position: (values[position] is not None, values[position] or "", ids[position])
+
+    def cursor_key(self, column: str, value, id: int) -> tuple:
+        if column == "date_added":
+            value = to_timestamp(value)
+            return (value != NULL_DATE, value, id)
+        return (value is not None, value or "", id)
+
+    @staticmethod
+    def tags(area: Optional[str], regions: Optional[str], ingredients: Optional[str], user_id: Optional[int]):
+        bitmaps = {(REGION, tag_key(region)) for region in split_regions(regions)}
+        if area:
+            bitmaps.add(("area", area.lower()))
+        postings = {(INGREDIENT, tag_key(ingredient)) for ingredient in split_ingredients(ingredients)}
+        if user_id is not None:
+            postings.add(("user_id", user_id))
+        return bitmaps, postings
+
+    def _set_bit(self, key: Tuple[str, str], position: int, on: bool) -> None:
+        bitmap = self.bitmaps.get(key)
+        if bitmap is None:
+            if not on:
+                return
+            bitmap = self.bitmaps[key] = bytearray()
+        index = position >> 3
+        if index >= len(bitmap):
+            bitmap.extend(bytes(index + 1 - len(bitmap)))
+        if on:
+            bitmap[index] |= 1 << (position & 7)
+        else:
+            bitmap[index] &= ~(1 << (position & 7)) & 0xFF
+
+    def _post(self, key: Tuple[str, object], position: int, on: bool) -> None:
+        posting = self.postings.get(key)
+        if posting is None:
+            if not on:
+                return
+            posting = self.postings[key] = array("l")
+        index = bisect_left(posting, position)
+        present = index < len(posting) and posting[index] == position
+        if on and not present:
+            posting.insert(index, position)
+        elif not on and present:
+            del posting[index]
+            if not posting:
+                del self.postings[key]
+
+    def _index(self, position: int, on: bool) -> None:
+        area = self.strings[self.areas[position]]
+        regions = self.strings[self.regions[position]]
+        user_id = self.user_ids[position]
+        bitmaps, postings = self.tags(area, regions, self.ingredients[position], user_id if user_id >= 0 else None)
+        for key in bitmaps:
+            self._set_bit(key, position, on)
+        for key in postings:
+            self._post(key, position, on)
+
+    def _append(self, row) -> int:
+        id, name, area, regions, ingredients, date_added, user_id = row
+        if self.ids and id <= self.ids[-1]:
+            raise StaleSnapshot(id)
+        position = len(self.ids)
+        self.ids.append(id)
+        self.names.append(name)
+        self.areas.append(self.intern(area))
+        self.regions.append(self.intern(regions))
+        self.ingredients.append(ingredients)
+        self.dates.append(to_timestamp(date_added))
+        self.user_ids.append(user_id if user_id is not None else -1)
+        self._index(position, True)
+        return position
+
+    def load(self, rows: Iterable[tuple]) -> None:
+        with self._lock:
+            for row in rows:
+                self._append(row)
+            positions = range(len(self.ids))
+            self.orders = {column: array("l", sorted(positions, key=self.sort_key(column))) for column in SORT_COLUMNS}
+
+    def position(self, id: int) -> Optional[int]:
+        index = bisect_left(self.ids, id)
+        return index if index < len(self.ids) and self.ids[index] == id else None
+
+    def upsert(self, rows: Iterable[tuple]) -> None:
+        with self._lock:
+            for row in rows:
+                position = self.position(row[0])
+                if position is None:
+                    position = self._append(row)
+                else:
+                    self._unsort(position)
+                    self._index(position, False)
+                    _, name, area, regions, ingredients, date_added, user_id = row
+                    self.names[position] = name
+                    self.areas[position] = self.intern(area)
+                    self.regions[position] = self.intern(regions)
+                    self.ingredients[position] = ingredients
+                    self.dates[position] = to_timestamp(date_added)
+                    self.user_ids[position] = user_id if user_id is not None else -1
+                    self._index(position, True)
+                for column, order in self.orders.items():
+                    key = self.sort_key(column)
+                    order.insert(bisect_left(order, key(position), key=key), position)
+
+    def _unsort(self, position: int) -> None:
+        for column, order in self.orders.items():
+            key = self.sort_key(column)
+            index = bisect_left(order, key(position), key=key)
+            if index < len(order) and order[index] == position:
+                del order[index]
+
+    def _mask(self, kind: str, keys: List[str], match: str) -> Optional[int]:
+        masks = [int.from_bytes(self.bitmaps.get((kind, key), b""), "little") for key in keys]
+        if not masks:
+            return None
+        mask = masks[0]
+        for other in masks[1:]:
+            mask = mask | other if match == MATCH_ANY else mask & other
+        return mask
+
+    def _posting(self, kind: str, keys: List, match: str) -> Optional[List[int]]:
+        lists = sorted((self.postings.get((kind, key), array("l")) for key in keys), key=len)
+        if not lists:
+            return None
+        if match == MATCH_ANY and kind != "user_id":
+            return sorted(set().union(*lists))
+        result = set(lists[0])
+        for other in lists[1:]:
+            result.intersection_update(other)
+        return sorted(result)
+
+    def matching(self, filters: Dict[str, str]) -> Tuple[Optional[int], Optional[List[int]]]:
+        match = filters.get("match")
+        mask = positions = None
+        for column, value in filters.items():
+            if column == "area":
+                found = self._mask("area", [value.lower()], match)
+            elif column == REGION:
+                found = self._mask(REGION, sorted({tag_key(value) for value in split_regions(value)}), match)
+            else:
+                found = None
+            if found is not None:
+                mask = found if mask is None else mask & found
+            if column == "user_id":
+                keys = [int(value)] if str(value).lstrip("-").isdigit() else [None]
+                found = self._posting("user_id", keys, match)
+            elif column == INGREDIENT:
+                found = self._posting(INGREDIENT, sorted({tag_key(value) for value in split_ingredients(value)}), match)
+            else:
+                continue
+            if found is not None:
+                positions = found if positions is None else sorted(set(positions).intersection(found))
+        if positions is not None and mask is not None:
+            positions = [position for position in positions if mask >> position & 1]
+        return mask, positions
+
+    def page_positions(
+        self,
+        filters: Dict[str, str],
+        column: Optional[str],
+        forward: bool,
+        after: Optional[tuple],
+        limit: int,
+    ) -> List[int]:
+        with self._lock:
+            mask, positions = self.matching(filters)
+            if column is None:
+                key = self.ids.__getitem__
+                order = range(len(self.ids))
+            else:
+                key = self.sort_key(column)
+                order = self.orders[column]
+            if positions is None and mask is not None and mask.bit_count() ** 2 < limit * len(self.ids):
+                positions, mask = set_bits(mask), None
+            if positions is not None:
+                if after is not None:
+                    positions = [p for p in positions if (key(p) > after if forward else key(p) < after)]
+                pick = heapq.nsmallest if forward else heapq.nlargest
+                return pick(limit, positions, key=key)
+            if after is None:
+                start = 0 if forward else len(order)
+            else:
+                start = bisect_right(order, after, key=key) if forward else bisect_left(order, after, key=key)
+            found = []
+            indexes = range(start, len(order)) if forward else range(start - 1, -1, -1)
+            for index in indexes:
+                position = order[index]
+                if mask is None or mask >> position & 1:
+                    found.append(position)
+                    if len(found) == limit:
+                        break
+            return found
+
+    def memory_bytes(self) -> int:
+        arrays = [self.ids, self.user_ids, self.dates, self.areas, self.regions, *self.orders.values(), *self.postings.values()]
+        total = sum(sys.getsizeof(item) for item in arrays)
+        total += sum(sys.getsizeof(bitmap) for bitmap in self.bitmaps.values())
+        total += sys.getsizeof(self.names) + sum(sys.getsizeof(name) for name in self.names)
+        total += sys.getsizeof(self.ingredients) + sum(sys.getsizeof(value) for value in self.ingredients if value is not None)
+        total += sys.getsizeof(self.strings) + sum(sys.getsizeof(value) for value in self.strings if value is not None)
+        return total
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.refreshed_at >= READ_MODEL_REFRESH_SECONDS
+
+
+class ProductReadModel:
+
+    @staticmethod
+    def supports(search_term: Optional[str], filters: Optional[Dict[str, str]], sorting: Optional[Dict[str, str]]) -> bool:
+        return not search_term and set(filters or ()) <= FILTER_KEYS
+
+    @staticmethod
+    def snapshot(db: Session) -> CatalogSnapshot:
+        key = ProductReadModel._key(db)
+        with _models_lock:
+            snapshot = _models.get(key)
+            created = snapshot is None
+            if created:
+                snapshot = _models[key] = CatalogSnapshot()
+        if created:
+            try:
+                ProductReadModel._build(db, snapshot)
+            except Exception:
+                with _models_lock:
+                    _models.pop(key, None)
+                raise
+            finally:
+                snapshot.ready.set()
+            return snapshot
+        snapshot.ready.wait()
+        if snapshot.is_stale():
+            try:
+                ProductReadModel._refresh(db, snapshot)
+            except StaleSnapshot:
+                with _models_lock:
+                    if _models.get(key) is snapshot:
+                        del _models[key]
+                return ProductReadModel.snapshot(db)
+        return snapshot
+
+    @staticmethod
+    def _build(db: Session, snapshot: CatalogSnapshot) -> None:
+        snapshot.last_seq = ChangeFeed.last_seq(db)
+        snapshot.load(db.execute(select(*COLUMNS).order_by(Product.id)).yield_per(BUILD_BATCH_SIZE))
+        snapshot.refreshed_at = time.monotonic()
+
+    @staticmethod
+    def _refresh(db: Session, snapshot: CatalogSnapshot) -> None:
+        while True:
+            changes = ChangeFeed.since(db, snapshot.last_seq, BUILD_BATCH_SIZE)
+            if changes:
+                snapshot.upsert(
+                    tuple(change.data.get(column.key) for column in COLUMNS)
+                    for change in changes
+                )
+                snapshot.last_seq = changes[-1].seq
+            if len(changes) < BUILD_BATCH_SIZE:
+                break
+        snapshot.refreshed_at = time.monotonic()
+
+    @staticmethod
+    def search(
+        db: Session,
+        filters: Optional[Dict[str, str]] = None,
+        sorting: Optional[Dict[str, str]] = None,
+        cursor: Optional[str] = None,
+        page_size: Optional[int] = None,
+    ) -> Page:
+        snapshot = ProductReadModel.snapshot(db)
+        sort, column, descending = "id", None, False
+        for name, direction in (sorting or {}).items():
+            if name in SORT_COLUMNS:
+                sort, column, descending = name, name, direction != "asc"
+                break
+        limit = clamp_page_size(page_size)
+        backward, after = False, None
+        if cursor:
+            value, id, backward = decode_cursor(cursor, sort)
+            after = id if column is None else snapshot.cursor_key(column, value, id)
+        positions = snapshot.page_positions(filters or {}, column, descending == backward, after, limit + 1)
+        has_more = len(positions) > limit
+        positions = positions[:limit]
+        if backward:
+            positions.reverse()
+        if not positions:
+            return Page([], None, None)
+        ids = [snapshot.ids[position] for position in positions]
+        products = {
+            product.id: product
+            for product in db.query(Product)
+            .options(joinedload(Product.user).load_only(User.id, User.username))
+            .filter(Product.id.in_(ids))
+        }
+        items = [products[id] for id in ids if id in products]
+        first, last = positions[0], positions[-1]
+        next_cursor = prev_cursor = None
+        if backward or has_more:
+            next_cursor = encode_cursor(sort, snapshot.value(sort, last), snapshot.ids[last])
+        if (backward and has_more) or (not backward and cursor):
+            prev_cursor = encode_cursor(sort, snapshot.value(sort, first), snapshot.ids[first], backward=True)
+        return Page(items, next_cursor, prev_cursor)
+
+    @staticmethod
+    def invalidate() -> None:
+        with _models_lock:
+            _models.clear()
+
+    @staticmethod
+    def _key(db: Session):
+        bind = db.get_bind()
+        return str(getattr(bind, "engine", bind).url)
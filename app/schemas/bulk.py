@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from typing import List
+
+
+class RowError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportReport(BaseModel):
+    inserted: int = 0
+    failed: int = 0
+    errors: List[RowError] = []
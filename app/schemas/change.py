@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import List
+
+
+class ProductChangeMain(BaseModel):
+    seq: int
+    product_id: int
+    op: str
+    changed_at: datetime
+    data: dict
+
+    class Config:
+        from_attributes = True
+
+
+class ChangePage(BaseModel):
+    changes: List[ProductChangeMain]
+    last_seq: int
+    has_more: bool
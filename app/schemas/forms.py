@@ -1,4 +1,3 @@
-from datetime import datetime
 from fastapi import Form
 from pydantic import BaseModel
 
@@ -34,8 +33,7 @@ class UpdateProductForm(BaseModel):
 	area: str
 	regions: str
 	ingredients: str
-	date_added: datetime
-	user_id: int
+	version: int
 
 	@classmethod
 	def as_form(
@@ -45,8 +43,7 @@ class UpdateProductForm(BaseModel):
 		area: str = Form(...),
 		regions: str = Form(...),
 		ingredients: str = Form(...),
-		date_added: datetime = Form(...),
-		user_id: int = Form(...),
+		version: int = Form(...),
 	):
 		return cls(
 			name=name,
@@ -54,7 +51,5 @@ class UpdateProductForm(BaseModel):
 	    		area=area,
             		regions=regions,
             		ingredients=ingredients,
-			date_added=date_added,
-			user_id=user_id,
+			version=version,
         	)
-
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 
 class ProductBase(BaseModel):
@@ -17,10 +17,48 @@ class ProductCreate(ProductBase):
 
 
 class ProductUpdate(ProductBase):
-    name: Optional[str]
+    name: Optional[str] = None
+    description: Optional[str] = None
+    area: Optional[str] = None
+    regions: Optional[str] = None
+    ingredients: Optional[str] = None
+    version: Optional[int] = None
+
+    @field_validator("name")
+    @classmethod
+    def name_is_not_null(cls, value):
+        if value is None:
+            raise ValueError("name cannot be null")
+        return value
+
+
+class ProductBatchUpdate(ProductUpdate):
+    id: int
+
+
+class BatchUpdate(BaseModel):
+    updates: List[ProductBatchUpdate]
 
 
 class ProductMain(ProductCreate):
+    id: int
+    version: int = 1
+
+    class Config:
+        from_attributes = True
+
+
+class ProductList(BaseModel):
+    items: List[ProductMain]
+
+    class Config:
+        from_attributes = True
+
+
+class ProductPage(BaseModel):
+    items: List[ProductMain]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -16,3 +16,11 @@ class User(UserBase):
 
     class Config:
         from_attributes = True
+
+
+class UserIdentity(BaseModel):
+    id: int
+    username: str
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,132 @@
+import re
+import weakref
+from typing import List, Optional
+from sqlalchemy import Column, Integer, MetaData, String, Table, bindparam, event, func, literal_column, select, text
+from sqlalchemy.orm import Session
+from .db import Base
+from .models import Product
+
+
+FTS_TABLE = "products_fts"
+FTS_COLUMNS = ("name", "ingredients", "description", "area", "regions")
+
+products_fts = Table(
+    FTS_TABLE,
+    MetaData(),
+    Column("rowid", Integer, primary_key=True),
+    *(Column(name, String) for name in FTS_COLUMNS),
+)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_available = weakref.WeakKeyDictionary()
+
+
+class ProductSearchIndex:
+
+    @staticmethod
+    def is_available(db: Session) -> bool:
+        bind = db.get_bind()
+        if bind.dialect.name != "sqlite":
+            return False
+        engine = getattr(bind, "engine", bind)
+        if engine not in _available:
+            row = db.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": FTS_TABLE},
+            ).first()
+            _available[engine] = row is not None
+        return _available[engine]
+
+    @staticmethod
+    def create(connection) -> None:
+        if connection.dialect.name != "sqlite":
+            return
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE},
+        ).first()
+        _available[connection.engine] = True
+        if exists:
+            return
+        columns = ", ".join(FTS_COLUMNS)
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"{columns}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        ))
+        connection.execute(text(
+            f"INSERT INTO {FTS_TABLE} (rowid, {columns}) SELECT id, {columns} FROM products"
+        ))
+
+    @staticmethod
+    def drop(connection) -> None:
+        if connection.dialect.name == "sqlite":
+            connection.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+            _available.pop(connection.engine, None)
+
+    @staticmethod
+    def rebuild(db: Session) -> None:
+        columns = ", ".join(FTS_COLUMNS)
+        db.execute(text(f"DELETE FROM {FTS_TABLE}"))
+        db.execute(text(
+            f"INSERT INTO {FTS_TABLE} (rowid, {columns}) SELECT id, {columns} FROM products"
+        ))
+        db.commit()
+
+    @staticmethod
+    def index(db: Session, product: Product) -> None:
+        db.execute(products_fts.delete().where(products_fts.c.rowid == product.id))
+        db.execute(products_fts.insert().values(
+            rowid=product.id,
+            **{name: getattr(product, name) for name in FTS_COLUMNS},
+        ))
+
+    @staticmethod
+    def index_many(db: Session, ids: List[int]) -> None:
+        if not ids:
+            return
+        columns = ", ".join(FTS_COLUMNS)
+        db.execute(products_fts.delete().where(products_fts.c.rowid.in_(ids)))
+        db.execute(
+            text(
+                f"INSERT INTO {FTS_TABLE} (rowid, {columns}) "
+                f"SELECT id, {columns} FROM products WHERE id IN :ids"
+            ).bindparams(bindparam("ids", expanding=True)),
+            {"ids": ids},
+        )
+
+    @staticmethod
+    def build_match(search_term: str) -> Optional[str]:
+        tokens = _TOKEN_RE.findall(search_term)
+        if not tokens:
+            return None
+        return " ".join(f'"{token}"*' for token in tokens)
+
+    @staticmethod
+    def ranked(match: str):
+        return (
+            select(
+                products_fts.c.rowid.label("id"),
+                func.bm25(literal_column(FTS_TABLE)).label("rank"),
+            )
+            .where(literal_column(FTS_TABLE).op("MATCH")(match))
+            .subquery()
+        )
+
+    @staticmethod
+    def search(db: Session, search_term: str, limit: int = 100) -> List[int]:
+        match = ProductSearchIndex.build_match(search_term)
+        if match is None:
+            return []
+        ranked = ProductSearchIndex.ranked(match)
+        rows = db.execute(select(ranked.c.id).order_by(ranked.c.rank).limit(limit))
+        return [row.id for row in rows]
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_index(target, connection, **kw):
+    ProductSearchIndex.create(connection)
+
+
+@event.listens_for(Base.metadata, "before_drop")
+def _drop_search_index(target, connection, **kw):
+    ProductSearchIndex.drop(connection)
@@ -0,0 +1,121 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, List, Optional
+import uvicorn
+
+
+WEB_HOST = os.environ.get("WEB_HOST", "127.0.0.1")
+WEB_PORT = int(os.environ.get("WEB_PORT", 8000))
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", os.cpu_count() or 1))
+WEB_BACKLOG = 2048
+RESPAWN_DELAY = 1.0
+
+
+def bind_socket(host: str, port: int, backlog: int = WEB_BACKLOG) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def preload():
+    from .main import app, initialize
+    initialize()
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+def after_fork() -> None:
+    from .db import async_engine, async_read_engine, engine, read_engine
+    for bind in (engine, read_engine, async_engine.sync_engine, async_read_engine.sync_engine):
+        bind.dispose(close=False)
+
+
+def serve(app, sock: socket.socket, log_level: str = "info") -> None:
+    config = uvicorn.Config(app, lifespan="on", log_level=log_level, access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Launcher:
+
+    def __init__(self, app, sock: socket.socket, workers: int = WEB_WORKERS, log_level: str = "info"):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.log_level = log_level
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+
+    def spawn(self, slot: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                after_fork()
+                serve(self.app, self.sock, self.log_level)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = slot
+        return pid
+
+    def stop(self, signum=None, frame=None) -> None:
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(self.workers):
+            self.spawn(slot)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            slot = self.children.pop(pid, None)
+            if slot is not None and not self.stopping:
+                time.sleep(RESPAWN_DELAY)
+                if not self.stopping:
+                    self.spawn(slot)
+        return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.server", description="Preforking production server")
+    parser.add_argument("--host", default=WEB_HOST)
+    parser.add_argument("--port", type=int, default=WEB_PORT, help="0 picks a free port")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    app = preload()
+    sock = bind_socket(args.host, args.port)
+    host, port = sock.getsockname()[:2]
+    print(f"Listening on http://{host}:{port} with {args.workers} workers (pid {os.getpid()})", flush=True)
+    if args.workers <= 1:
+        serve(app, sock, args.log_level)
+        return 0
+    return Launcher(app, sock, args.workers, args.log_level).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
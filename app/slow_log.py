@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date, datetime
+from logging.handlers import RotatingFileHandler
+from typing import Any, List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .metrics import current_endpoint
+
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 250))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "slow_queries.jsonl")
+SLOW_QUERY_LOG_MAX_BYTES = int(os.environ.get("SLOW_QUERY_LOG_MAX_BYTES", 10 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("SLOW_QUERY_LOG_BACKUPS", 5))
+MAX_PARAMETER_LENGTH = 64
+REDACTED = "<redacted>"
+
+_SENSITIVE = re.compile(r"password|token|secret|username", re.IGNORECASE)
+_SENSITIVE_COMPARISON = re.compile(
+    r"(password|token|secret|username)\w*\W*\s*(=|!=|<>|like|in)\s*\(?\s*(\?|:\w+|%\(\w+\)s)",
+    re.IGNORECASE,
+)
+_EXPLAIN = {"sqlite": "EXPLAIN QUERY PLAN ", "postgresql": "EXPLAIN ", "mysql": "EXPLAIN "}
+
+
+def redact_value(value: Any, sensitive: bool) -> Any:
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        if sensitive:
+            return REDACTED
+        if len(value) > MAX_PARAMETER_LENGTH:
+            return value[:MAX_PARAMETER_LENGTH] + "..."
+        return value
+    return f"<{type(value).__name__}>"
+
+
+def is_sensitive(statement: str) -> bool:
+    if statement.lstrip().upper().startswith(("INSERT", "UPDATE")):
+        return bool(_SENSITIVE.search(statement))
+    return bool(_SENSITIVE_COMPARISON.search(statement))
+
+
+def redact_parameters(statement: str, parameters) -> Any:
+    sensitive = is_sensitive(statement)
+    if isinstance(parameters, dict):
+        return {key: redact_value(value, sensitive or bool(_SENSITIVE.search(str(key)))) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_value(value, sensitive) for value in parameters]
+    return redact_value(parameters, sensitive)
+
+
+class SlowQueryLog:
+
+    def __init__(
+        self,
+        path: str = SLOW_QUERY_LOG,
+        threshold_ms: float = SLOW_QUERY_MS,
+        max_bytes: int = SLOW_QUERY_LOG_MAX_BYTES,
+        backups: int = SLOW_QUERY_LOG_BACKUPS,
+    ):
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.logged = 0
+        self._logger = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def logger(self) -> logging.Logger:
+        with self._lock:
+            if self._logger is None:
+                logger = logging.getLogger(f"{__name__}.{id(self)}")
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+                self._logger = logger
+            return self._logger
+
+    def close(self) -> None:
+        with self._lock:
+            if self._logger is not None:
+                for handler in list(self._logger.handlers):
+                    self._logger.removeHandler(handler)
+                    handler.close()
+                self._logger = None
+
+    def record(self, conn, statement: str, parameters, duration: float, executemany: bool) -> None:
+        entry = {
+            "ts": datetime.now().isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "endpoint": current_endpoint(),
+            "statement": statement,
+            "parameters": (
+                [redact_parameters(statement, row) for row in parameters]
+                if executemany else redact_parameters(statement, parameters)
+            ),
+            "plan": None if executemany else self.explain(conn, statement, parameters),
+        }
+        self.logger().info(json.dumps(entry, ensure_ascii=False))
+        self.logged += 1
+
+    @staticmethod
+    def explain(conn, statement: str, parameters) -> Optional[List[str]]:
+        prefix = _EXPLAIN.get(conn.dialect.name)
+        if prefix is None or not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            return None
+        try:
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters)
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        except Exception:
+            return None
+        if conn.dialect.name == "sqlite":
+            return [row[3] for row in rows]
+        return [" ".join(str(value) for value in row) for row in rows]
+
+
+slow_query_log = SlowQueryLog()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if slow_query_log.enabled and context is not None:
+        context._slow_query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_slow_query_started", None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    if duration * 1000 >= slow_query_log.threshold_ms:
+        slow_query_log.record(conn, statement, parameters, duration, executemany)
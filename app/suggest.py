@@ -0,0 +1,186 @@
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from .changes import ChangeFeed
+from .models import Product
+from .tags import split_ingredients, tag_key
+
+
+NAME = "name"
+INGREDIENT = "ingredient"
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+SUGGEST_SCAN_LIMIT = 512
+SUGGEST_REFRESH_SECONDS = float(os.environ.get("SUGGEST_REFRESH_SECONDS", 1.0))
+BUILD_BATCH_SIZE = 5000
+
+_WORD = re.compile(r"\w+")
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def prefix_keys(text: str) -> List[str]:
+    key = tag_key(text)
+    return [key[match.start():] for match in _WORD.finditer(key)]
+
+
+class Entry:
+    __slots__ = ("kind", "text", "product_ids")
+
+    def __init__(self, kind: str, text: str):
+        self.kind = kind
+        self.text = text
+        self.product_ids: Set[int] = set()
+
+
+class SuggestIndex:
+
+    def __init__(self):
+        self.last_seq = 0
+        self.refreshed_at = 0.0
+        self.ready = threading.Event()
+        self._keys: List[Tuple[str, str, str]] = []
+        self._entries: Dict[Tuple[str, str], Entry] = {}
+        self._products: Dict[int, List[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def terms(name: Optional[str], ingredients: Optional[str]) -> List[Tuple[str, str]]:
+        terms = [(NAME, " ".join(name.split()))] if name and name.strip() else []
+        return terms + [(INGREDIENT, ingredient) for ingredient in split_ingredients(ingredients)]
+
+    def apply(self, rows: Iterable[Tuple[int, Optional[str], Optional[str]]], bulk: bool = False) -> None:
+        add_key = self._keys.append if bulk else lambda item: insort(self._keys, item)
+        with self._lock:
+            for product_id, name, ingredients in rows:
+                self._remove(product_id)
+                terms = self.terms(name, ingredients)
+                for kind, text in terms:
+                    entry_key = (kind, tag_key(text))
+                    entry = self._entries.get(entry_key)
+                    if entry is None:
+                        entry = self._entries[entry_key] = Entry(kind, text)
+                        for key in prefix_keys(text):
+                            add_key((key, kind, entry_key[1]))
+                    entry.product_ids.add(product_id)
+                self._products[product_id] = terms
+            if bulk:
+                self._keys.sort()
+
+    def _remove(self, product_id: int) -> None:
+        for kind, text in self._products.pop(product_id, ()):
+            entry_key = (kind, tag_key(text))
+            entry = self._entries.get(entry_key)
+            if entry is None:
+                continue
+            entry.product_ids.discard(product_id)
+            if entry.product_ids:
+                continue
+            del self._entries[entry_key]
+            for key in prefix_keys(text):
+                item = (key, kind, entry_key[1])
+                index = bisect_left(self._keys, item)
+                if index < len(self._keys) and self._keys[index] == item:
+                    del self._keys[index]
+
+    def suggest(self, prefix: str, limit: int = SUGGEST_LIMIT) -> List[dict]:
+        prefix = tag_key(prefix)
+        if not prefix:
+            return []
+        found = {}
+        with self._lock:
+            keys = self._keys
+            index = bisect_left(keys, (prefix,))
+            end = min(len(keys), index + SUGGEST_SCAN_LIMIT)
+            while index < end and keys[index][0].startswith(prefix):
+                _, kind, norm = keys[index]
+                if (kind, norm) not in found:
+                    entry = self._entries[(kind, norm)]
+                    found[(kind, norm)] = (not norm.startswith(prefix), -len(entry.product_ids), norm, entry)
+                index += 1
+            ranked = sorted(found.values(), key=lambda item: item[:3])[:limit]
+            return [
+                {
+                    "text": entry.text,
+                    "kind": entry.kind,
+                    "count": -count,
+                    "product_id": min(entry.product_ids) if entry.kind == NAME else None,
+                }
+                for _, count, _, entry in ranked
+            ]
+
+    def build(self, db: Session) -> None:
+        last_seq = ChangeFeed.last_seq(db)
+        rows = db.execute(select(Product.id, Product.name, Product.ingredients)).yield_per(BUILD_BATCH_SIZE)
+        self.apply(rows, bulk=not self._keys)
+        self.last_seq = last_seq
+        self.refreshed_at = time.monotonic()
+
+    def refresh(self, db: Session) -> int:
+        changes = ChangeFeed.since(db, self.last_seq, BUILD_BATCH_SIZE)
+        while changes:
+            self.apply((change.product_id, change.data.get("name"), change.data.get("ingredients")) for change in changes)
+            self.last_seq = changes[-1].seq
+            changes = ChangeFeed.since(db, self.last_seq, BUILD_BATCH_SIZE) if len(changes) == BUILD_BATCH_SIZE else []
+        self.refreshed_at = time.monotonic()
+        return self.last_seq
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.refreshed_at >= SUGGEST_REFRESH_SECONDS
+
+
+class ProductSuggestions:
+
+    @staticmethod
+    def index(db: Session) -> SuggestIndex:
+        key = ProductSuggestions._index_key(db)
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is not None:
+                built = True
+            else:
+                index = _indexes[key] = SuggestIndex()
+                built = False
+        if not built:
+            try:
+                index.build(db)
+            except Exception:
+                with _indexes_lock:
+                    _indexes.pop(key, None)
+                raise
+            finally:
+                index.ready.set()
+        else:
+            index.ready.wait()
+            if index.is_stale():
+                index.refresh(db)
+        return index
+
+    @staticmethod
+    def suggest(db: Session, prefix: str, limit: int = SUGGEST_LIMIT) -> List[dict]:
+        limit = max(1, min(limit, MAX_SUGGEST_LIMIT))
+        return ProductSuggestions.index(db).suggest(prefix, limit)
+
+    @staticmethod
+    def apply(db: Session, rows: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> None:
+        index = _indexes.get(ProductSuggestions._index_key(db))
+        if index is not None:
+            index.apply(rows)
+
+    @staticmethod
+    def invalidate() -> None:
+        with _indexes_lock:
+            _indexes.clear()
+
+    @staticmethod
+    def _index_key(db: Session):
+        bind = db.get_bind()
+        return str(getattr(bind, "engine", bind).url)
@@ -0,0 +1,112 @@
+import re
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from sqlalchemy import func, select
+from sqlalchemy.engine import Connection
+from .facets import split_regions
+from .models import Ingredient, Product, Region, product_ingredients, product_regions
+
+
+REGION = "region"
+INGREDIENT = "ingredient"
+MATCH_ALL = "all"
+MATCH_ANY = "any"
+BATCH_SIZE = 1000
+
+_INGREDIENT_SEPARATORS = re.compile(r"[,;|+]")
+
+
+def split_ingredients(ingredients: Optional[str]) -> List[str]:
+    if not ingredients:
+        return []
+    values = []
+    for value in _INGREDIENT_SEPARATORS.split(ingredients):
+        value = " ".join(value.split())
+        if value and value not in values:
+            values.append(value)
+    return values
+
+
+def tag_key(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+
+KINDS = {
+    REGION: (Region, product_regions, product_regions.c.region_id, split_regions),
+    INGREDIENT: (Ingredient, product_ingredients, product_ingredients.c.ingredient_id, split_ingredients),
+}
+
+
+class ProductTags:
+
+    @staticmethod
+    def apply(
+        connection: Connection,
+        products: Dict[int, Tuple[Optional[str], Optional[str]]],
+        replace: bool = True,
+    ) -> None:
+        if not products:
+            return
+        for position, (model, link, column, split) in enumerate(KINDS.values()):
+            if replace:
+                connection.execute(link.delete().where(link.c.product_id.in_(list(products))))
+            names, pairs = {}, set()
+            for product_id, values in products.items():
+                for name in split(values[position]):
+                    names.setdefault(tag_key(name), name)
+                    pairs.add((product_id, tag_key(name)))
+            if not pairs:
+                continue
+            ids = ProductTags._resolve(connection, model, names)
+            connection.execute(link.insert(), [
+                {"product_id": product_id, column.name: ids[key]}
+                for product_id, key in sorted(pairs)
+            ])
+
+    @staticmethod
+    def _resolve(connection: Connection, model, names: Dict[str, str]) -> Dict[str, int]:
+        keys = list(names)
+        ids = {}
+        for start in range(0, len(keys), BATCH_SIZE):
+            batch = keys[start:start + BATCH_SIZE]
+            ids.update(connection.execute(select(model.key, model.id).where(model.key.in_(batch))).all())
+        missing = [key for key in keys if key not in ids]
+        if missing:
+            connection.execute(model.__table__.insert(), [{"key": key, "name": names[key]} for key in missing])
+            for start in range(0, len(missing), BATCH_SIZE):
+                batch = missing[start:start + BATCH_SIZE]
+                ids.update(connection.execute(select(model.key, model.id).where(model.key.in_(batch))).all())
+        return ids
+
+    @staticmethod
+    def rebuild(connection: Connection) -> None:
+        for _, link, _, _ in KINDS.values():
+            connection.execute(link.delete())
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                select(Product.id, Product.regions, Product.ingredients)
+                .where(Product.id > last_id)
+                .order_by(Product.id)
+                .limit(BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            ProductTags.apply(connection, {id: (regions, ingredients) for id, regions, ingredients in rows}, replace=False)
+            last_id = rows[-1][0]
+
+    @staticmethod
+    def condition(kind: str, values: Union[str, Iterable[str]], match: str = MATCH_ALL):
+        model, link, column, split = KINDS[kind]
+        if isinstance(values, str):
+            values = split(values)
+        keys = sorted({tag_key(value) for value in values if value and value.strip()})
+        if not keys:
+            return None
+        products = (
+            select(link.c.product_id)
+            .join(model, model.id == column)
+            .where(model.key.in_(keys))
+        )
+        if match != MATCH_ANY and len(keys) > 1:
+            products = products.group_by(link.c.product_id).having(func.count() == len(keys))
+        return Product.id.in_(products)
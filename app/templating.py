@@ -0,0 +1,113 @@
+import os
+import stat
+from typing import Callable, Dict, Iterator, Optional
+from fastapi import Request
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+from starlette.responses import StreamingResponse
+from .metrics import TimedTemplate
+
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+TEMPLATE_CACHE_DIR = os.environ.get("TEMPLATE_CACHE_DIR")
+TEMPLATES_AUTO_RELOAD = os.environ.get("TEMPLATES_AUTO_RELOAD", "0").lower() in ("1", "true", "yes")
+STREAM_MIN_ITEMS = int(os.environ.get("TEMPLATE_STREAM_MIN_ITEMS", 20))
+STREAM_BUFFER_BYTES = 16 * 1024
+
+
+def private_directory(path: str) -> str:
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise RuntimeError(f"Template cache directory {path!r} must be a directory owned and only writable by this user")
+    return path
+
+
+def create_environment(
+    directory: str = TEMPLATES_DIR,
+    cache_dir: Optional[str] = TEMPLATE_CACHE_DIR,
+    auto_reload: bool = TEMPLATES_AUTO_RELOAD,
+) -> Environment:
+    if cache_dir:
+        bytecode_cache = FileSystemBytecodeCache(private_directory(cache_dir))
+    else:
+        bytecode_cache = FileSystemBytecodeCache()
+    environment = Environment(
+        loader=FileSystemLoader(directory),
+        autoescape=True,
+        auto_reload=auto_reload,
+        bytecode_cache=bytecode_cache,
+    )
+    environment.template_class = TimedTemplate
+    return environment
+
+
+def create_templates(**kwargs) -> Jinja2Templates:
+    return Jinja2Templates(env=create_environment(**kwargs))
+
+
+def precompile(templates: Jinja2Templates) -> int:
+    names = templates.env.list_templates(extensions=["html"])
+    for name in names:
+        templates.get_template(name)
+    return len(names)
+
+
+def url_prefixes(request: Request) -> Dict[str, str]:
+    edit_url = str(request.url_for("edit_product_form", product_id="0"))
+    return {
+        "edit_url_prefix": edit_url[:-1],
+        "owner_url_prefix": f"{request.url_for('search_products')}?query=&user_id=",
+    }
+
+
+class StreamingTemplateResponse(StreamingResponse):
+
+    def __init__(
+        self,
+        template: Template,
+        context: dict,
+        status_code: int = 200,
+        on_complete: Optional[Callable[[bytes], None]] = None,
+        buffer_size: int = STREAM_BUFFER_BYTES,
+    ):
+        self.template = template
+        self.context = context
+        super().__init__(self._chunks(on_complete, buffer_size), status_code=status_code, media_type="text/html")
+
+    def _chunks(self, on_complete, buffer_size: int) -> Iterator[bytes]:
+        rendered = [] if on_complete is not None else None
+        buffer, size = [], 0
+        for piece in self.template.generate(self.context):
+            buffer.append(piece)
+            size += len(piece)
+            if size >= buffer_size:
+                chunk = "".join(buffer).encode("utf-8")
+                if rendered is not None:
+                    rendered.append(chunk)
+                yield chunk
+                buffer, size = [], 0
+        chunk = "".join(buffer).encode("utf-8")
+        if rendered is not None:
+            rendered.append(chunk)
+            on_complete(b"".join(rendered))
+        if chunk:
+            yield chunk
+
+    async def __call__(self, scope, receive, send):
+        if "http.response.debug" in scope.get("extensions", {}):
+            await send({"type": "http.response.debug", "info": {"template": self.template, "context": self.context}})
+        await super().__call__(scope, receive, send)
+
+
+def stream_template(
+    templates: Jinja2Templates,
+    request: Request,
+    name: str,
+    context: dict,
+    on_complete: Optional[Callable[[bytes], None]] = None,
+) -> StreamingTemplateResponse:
+    context = {"request": request, **context}
+    for processor in templates.context_processors:
+        context.update(processor(request))
+    return StreamingTemplateResponse(templates.get_template(name), context, on_complete=on_complete)
@@ -1,21 +1,123 @@
-from datetime import timedelta
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from passlib.hash import bcrypt
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.sql import text
+import jwt
 import pytest
-from .db import Base
-from .main import app
-from .utils import get_password_hash, create_access_token
-from app.crud.user_crud import UserCRUD
-from app.crud.product_crud import ProductCRUD
-from app.schemas.user import UserCreate
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+from .db import Base, create_async_db_engine, create_db_engine
+from .models import Product
+from .versioning import TableVersions
+from .main import app, get_db, get_read_db, get_read_session_factory, get_sync_db
+from .utils import get_password_hash, create_access_token, token_cache, verify_token
+from app.crud.user_crud import AsyncUserCRUD, UserCRUD
+from app.crud.product_crud import AsyncProductCRUD, ProductCRUD, VersionConflict
+from app.schemas.product import ProductCreate, ProductUpdate
+from app.schemas.user import UserCreate, UserIdentity
+from app.cache import MISSING, TTLCache
+from app.changes import ChangeFeed
+from app.dependencies import get_async_read_session_factory
+from app.admission import AUTH, EXPORT, READ, SEARCH, WRITE, AdmissionGate, Overloaded, admission, classify, parse_limits
+from app.hashing import HasherBusy, PasswordHasher
+from app.benchmark import REPO_ROOT, compare, percentile, run as run_benchmarks, run_startup
+from app.bulk import import_products, iter_export, main as bulk_main
+from app.crud.pagination import encode_cursor
+from app.facets import ProductFacets
+from app.metrics import SQL_QUERIES, InstrumentationMiddleware, reset_metrics
+from app.migrations import MIGRATIONS, migrate
+from app import profiler
+from app.profiler import SamplingProfiler
+from app.slow_log import SlowQueryLog, redact_parameters, slow_query_log
+from app.page_cache import MemoryBackend, PageCache, SQLiteBackend, page_cache
+from app.search_index import ProductSearchIndex
+from app.read_model import ProductReadModel, set_bits
+from app.suggest import ProductSuggestions, SuggestIndex
+from app.templating import create_templates, precompile
+from app.tokens import BloomFilter, KeyRing, RevocationList, key_ring, revocations
+from app.tags import ProductTags, split_ingredients
 
 
-engine = create_engine(
-    "sqlite:///:memory:",
-    connect_args={"check_same_thread": False},
-)
+TEST_DB_DIR = tempfile.mkdtemp()
+TEST_DATABASE_URL = f"sqlite:///{os.path.join(TEST_DB_DIR, 'test.db')}"
+engine = create_db_engine(TEST_DATABASE_URL)
+async_engine = create_async_db_engine(TEST_DATABASE_URL)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def override_get_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+
+
+def override_get_sync_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+app.dependency_overrides[get_sync_db] = override_get_sync_db
+app.dependency_overrides[get_read_session_factory] = lambda: TestingSessionLocal
+app.dependency_overrides[get_async_read_session_factory] = lambda: AsyncTestingSessionLocal
+
+
+@contextmanager
+def count_queries(binds=(engine, async_engine.sync_engine)):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for bind in binds:
+        event.listen(bind, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for bind in binds:
+            event.remove(bind, "before_cursor_execute", before_cursor_execute)
+
+
+def create_baseline_schema(connection):
+    connection.exec_driver_sql(
+        "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(50) NOT NULL UNIQUE, "
+        "hashed_password VARCHAR(100) NOT NULL)"
+    )
+    connection.exec_driver_sql(
+        "CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, description VARCHAR, "
+        "area VARCHAR, regions VARCHAR, ingredients VARCHAR, date_added DATETIME, "
+        "user_id INTEGER REFERENCES users (id))"
+    )
+
+
+@contextmanager
+def assert_max_queries(count, binds=(engine, async_engine.sync_engine)):
+    with count_queries(binds) as statements:
+        yield statements
+    assert len(statements) <= count, "\n".join(statements)
 
 @pytest.fixture(scope="session")
 def client():
@@ -23,9 +125,12 @@ def client():
 
 @pytest.fixture(scope="session", autouse=True)
 def db_engine():
-    Base.metadata.create_all(bind=engine)
+    migrate(engine)
     yield engine
     Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+    asyncio.run(async_engine.dispose())
+    shutil.rmtree(TEST_DB_DIR, ignore_errors=True)
 
 @pytest.fixture(scope="function", autouse=True)
 def db_session(db_engine):
@@ -38,6 +143,13 @@ def db_session(db_engine):
     for table in reversed(Base.metadata.sorted_tables):
         session.execute(text(f"DELETE FROM {table.name};"))
         session.commit()
+    ProductSearchIndex.rebuild(session)
+    ProductFacets.invalidate()
+    token_cache.clear()
+    revocations.clear()
+    ProductSuggestions.invalidate()
+    ProductReadModel.invalidate()
+    page_cache.clear()
 
     session.close()
 
@@ -152,5 +264,1379 @@ class TestProducts:
         })
         assert response.status_code == 200
         assert len(response.context["products"]) == 1
-        assert response.context["areas"] == ["Area1"]
+        assert response.context["areas"] == [("Area1", 1), ("Area2", 1)]
+
+
+
+def make_product(db, user_id, name, **fields):
+    obj_in = ProductCreate(
+        name=name,
+        description=fields.get("description", "Description"),
+        area=fields.get("area", "Area"),
+        regions=fields.get("regions", "Region"),
+        ingredients=fields.get("ingredients", "Ingredient"),
+        date_added=fields.get("date_added", datetime.now()),
+        user_id=user_id,
+    )
+    return ProductCRUD.create(db, obj_in)
+
+
+class TestSearchIndex:
+    def test_prefix_search_is_ranked(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="fts", hashed_password="x"))
+        make_product(db_session, user.id, "Aspirin", ingredients="acetylsalicylic acid")
+        make_product(db_session, user.id, "Paracetamol", ingredients="paracetamol")
+        make_product(db_session, user.id, "Aspirin Forte", description="aspirin aspirin")
+        products = ProductCRUD.search(db_session, search_term="aspi").items
+        assert [product.name for product in products] == ["Aspirin Forte", "Aspirin"]
+
+    def test_update_keeps_index_in_sync(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="fts2", hashed_password="x"))
+        product = make_product(db_session, user.id, "Ibuprofen")
+        ProductCRUD.update(db_session, product, ProductUpdate(
+            name="Naproxen",
+            description=product.description,
+            area=product.area,
+            regions=product.regions,
+            ingredients=product.ingredients,
+        ))
+        assert ProductSearchIndex.search(db_session, "ibu") == []
+        assert ProductSearchIndex.search(db_session, "napro") == [product.id]
+
+    def test_rebuild_and_ilike_fallback(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="fts3", hashed_password="x"))
+        product = make_product(db_session, user.id, "Cetirizine")
+        db_session.execute(text("DELETE FROM products_fts"))
+        db_session.commit()
+        assert ProductCRUD.search(db_session, search_term="ceti").items == []
+        assert ProductCRUD.search(db_session, search_term="tiri", use_index=False).items == [product]
+        ProductSearchIndex.rebuild(db_session)
+        assert ProductCRUD.search(db_session, search_term="ceti").items == [product]
+
+
+class TestPagination:
+    def test_get_multi_walks_forward_and_back(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="pager", hashed_password="x"))
+        ids = [make_product(db_session, user.id, f"Product {i}").id for i in range(7)]
+        first = ProductCRUD.get_multi(db_session, page_size=3)
+        assert [p.id for p in first.items] == ids[:3]
+        assert first.prev_cursor is None
+        second = ProductCRUD.get_multi(db_session, cursor=first.next_cursor, page_size=3)
+        third = ProductCRUD.get_multi(db_session, cursor=second.next_cursor, page_size=3)
+        assert [p.id for p in second.items] == ids[3:6]
+        assert [p.id for p in third.items] == ids[6:]
+        assert third.next_cursor is None
+        back = ProductCRUD.get_multi(db_session, cursor=third.prev_cursor, page_size=3)
+        assert [p.id for p in back.items] == ids[3:6]
+        assert back.next_cursor is not None and back.prev_cursor is not None
+
+    def test_search_sorted_with_nulls_and_ties(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="pager2", hashed_password="x"))
+        for area in ["B", None, "A", "B", None, "C"]:
+            make_product(db_session, user.id, "P", area=area)
+        for direction in ("asc", "desc"):
+            expected = [p.id for p in ProductCRUD.search(
+                db_session, sorting={"area": direction}, page_size=100,
+            ).items]
+            seen, cursor = [], None
+            while True:
+                page = ProductCRUD.search(
+                    db_session, sorting={"area": direction}, cursor=cursor, page_size=4,
+                )
+                seen += [p.id for p in page.items]
+                cursor = page.next_cursor
+                if cursor is None:
+                    break
+            assert seen == expected
+            assert len(seen) == 6
+
+    def test_invalid_cursor_is_rejected(self, client):
+        response = client.get("/products/read", params={"cursor": "garbage"})
+        assert response.status_code == 400
+
+
+class TestListingQueries:
+    def test_owners_are_loaded_in_listing_query(self, db_session):
+        for i in range(5):
+            user = UserCRUD.create(db_session, UserCreate(username=f"owner{i}", hashed_password="x"))
+            make_product(db_session, user.id, f"Product {i}")
+        db_session.expunge_all()
+        with assert_max_queries(1):
+            page = ProductCRUD.get_multi(db_session)
+            assert {p.user.username for p in page.items} == {f"owner{i}" for i in range(5)}
+        db_session.expunge_all()
+        with assert_max_queries(1):
+            page = ProductCRUD.search(db_session, search_term="product", sorting={"name": "asc"})
+            assert [p.user.username for p in page.items] == [f"owner{i}" for i in range(5)]
+
+    def test_listing_pages_do_not_query_per_card(self, client, db_session):
+        for i in range(20):
+            user = UserCRUD.create(db_session, UserCreate(username=f"owner{i}", hashed_password="x"))
+            make_product(db_session, user.id, f"Product {i}")
+        client.cookies.clear()
+        with assert_max_queries(3):
+            response = client.get("/products/read")
+        assert len(response.context["products"]) == 20
+        with assert_max_queries(3):
+            client.get("/products/search", params={"query": "product"})
+
+
+class TestFacets:
+    def test_counts_follow_create_and_update(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="facets", hashed_password="x"))
+        make_product(db_session, user.id, "A", area="Cardiology", regions="EU, US")
+        product = make_product(db_session, user.id, "B", area="Cardiology", regions="EU")
+        assert ProductFacets.get(db_session) == {
+            "area": [("Cardiology", 2)],
+            "region": [("EU", 2), ("US", 1)],
+        }
+        ProductCRUD.update(db_session, product, ProductUpdate(
+            name="B", description=None, area="Oncology", regions="APAC", ingredients=None,
+        ))
+        assert ProductFacets.get(db_session) == {
+            "area": [("Cardiology", 1), ("Oncology", 1)],
+            "region": [("APAC", 1), ("EU", 1), ("US", 1)],
+        }
+
+    def test_cached_facets_skip_the_database(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="facets2", hashed_password="x"))
+        make_product(db_session, user.id, "A", area="Cardiology", regions="EU")
+        client.get("/products/facets")
+        with count_queries() as statements:
+            response = client.get("/products/facets")
+        assert statements == []
+        assert response.json() == {
+            "areas": [{"value": "Cardiology", "count": 1}],
+            "regions": [{"value": "EU", "count": 1}],
+        }
+
+    def test_rebuild_matches_incremental_counts(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="facets3", hashed_password="x"))
+        make_product(db_session, user.id, "A", area="Cardiology", regions="EU; US")
+        make_product(db_session, user.id, "B", area=None, regions=None)
+        incremental = ProductFacets.get(db_session)
+        ProductFacets.rebuild(db_session)
+        assert ProductFacets.get(db_session) == incremental
+
+
+class TestTokenCache:
+    def login(self, db_session, username):
+        UserCRUD.create(db_session, UserCreate(username=username, hashed_password="x"))
+        return "Bearer " + create_access_token(data={"sub": username})
+
+    def test_hot_session_makes_no_user_queries(self, client, db_session):
+        cookie = self.login(db_session, "cached")
+        client.cookies = {"access_token": cookie}
+        client.get("/products/read")
+        hits = token_cache.hits
+        with count_queries() as statements:
+            response = client.get("/products/read")
+        client.cookies = None
+        assert "Welcome, cached" in response.text
+        assert not [statement for statement in statements if "FROM users" in statement]
+        assert token_cache.hits == hits + 1
+
+    def test_invalid_token_is_negative_cached(self, client):
+        client.cookies = {"access_token": "Bearer not-a-jwt"}
+        assert client.get("/products/create").status_code == 401
+        misses = token_cache.misses
+        assert client.get("/products/create").status_code == 401
+        client.cookies = None
+        assert token_cache.misses == misses
+        assert token_cache.get("not-a-jwt") is None
+
+    def test_cache_is_bounded_and_invalidated(self, db_session):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is MISSING
+        assert cache.get("a") == 1
+        cache.set("expired", 4, ttl=0)
+        assert cache.get("expired") is MISSING
+        token_cache.set("token", UserIdentity(id=1, username="renamed"))
+        UserCRUD.create(db_session, UserCreate(username="renamed", hashed_password="x"))
+        assert token_cache.get("token") is MISSING
+
+
+class TestPasswordHasher:
+    def test_saturated_pool_rejects_immediately(self):
+        hasher = PasswordHasher(max_workers=1, max_pending=1)
+        release = threading.Event()
+
+        async def scenario():
+            blocked = [asyncio.ensure_future(hasher.run(release.wait)) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            with pytest.raises(HasherBusy):
+                await hasher.run(release.wait)
+            release.set()
+            return await asyncio.gather(*blocked)
+
+        assert asyncio.run(scenario()) == [True, True]
+        assert hasher.rejected == 1
+        hasher.shutdown()
+
+    def test_busy_login_returns_503(self, client, monkeypatch):
+        async def busy(*args):
+            raise HasherBusy()
+
+        monkeypatch.setattr("app.main.password_hasher.run", busy)
+        response = client.post("/login", data={"username": "x", "password": "y"})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+
+    def test_login_rehashes_outdated_cost(self, client, db_session):
+        old_hash = bcrypt.using(rounds=5).hash("testpass")
+        UserCRUD.create(db_session, UserCreate(username="rehash", hashed_password=old_hash))
+        response = client.post("/login", data={"username": "rehash", "password": "testpass"})
+        assert response.status_code == 200
+        db_session.expire_all()
+        new_hash = UserCRUD.check_user(db_session, "rehash").hashed_password
+        assert new_hash != old_hash
+        assert new_hash.startswith("$2b$04$")
+
+
+class TestEngineProfile:
+    def test_file_engine_applies_pragmas_and_pool(self, tmp_path):
+        url = f"sqlite:///{tmp_path / 'profile.db'}"
+        writer = create_db_engine(url, pool_size=3)
+        with writer.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+            assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+        assert writer.pool.size() == 3
+        writer.dispose()
+
+    def test_read_engine_rejects_writes(self, tmp_path):
+        url = f"sqlite:///{tmp_path / 'readonly.db'}"
+        writer = create_db_engine(url)
+        Base.metadata.create_all(bind=writer)
+        reader = create_db_engine(url, read_only=True)
+        with reader.connect() as connection:
+            assert connection.exec_driver_sql("SELECT count(*) FROM products").scalar() == 0
+            with pytest.raises(OperationalError):
+                connection.exec_driver_sql("DELETE FROM products")
+        reader.dispose()
+        writer.dispose()
+
+
+class TestAsyncCRUD:
+    def test_async_crud_round_trip(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="async", hashed_password="x"))
+
+        async def scenario():
+            async with AsyncTestingSessionLocal() as db:
+                product = await AsyncProductCRUD.create(db, ProductCreate(
+                    name="Async Aspirin",
+                    description=None,
+                    area="Cardiology",
+                    regions="EU",
+                    ingredients=None,
+                    date_added=datetime.now(),
+                    user_id=user.id,
+                ))
+                found = await AsyncProductCRUD.search(db, search_term="async")
+                owner = await AsyncUserCRUD.check_user(db, "async")
+                return product, found, owner
+
+        product, found, owner = asyncio.run(scenario())
+        assert [p.id for p in found.items] == [product.id]
+        assert found.items[0].user.username == "async"
+        assert owner.id == user.id
+
+    def test_product_routes_are_coroutines(self):
+        endpoints = {route.path: route.endpoint for route in app.routes}
+        for path in ("/products/read", "/products/search", "/products/create", "/products/edit/{product_id}"):
+            assert asyncio.iscoroutinefunction(endpoints[path])
+
+
+class TestBulkImport:
+    def test_import_csv_reports_row_errors(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="importer", hashed_password="x"))
+        stream = io.StringIO(
+            "name,description,area,regions,ingredients\n"
+            "Aspirin,Pain relief,Cardiology,EU,acetylsalicylic acid\n"
+            ",Missing name,Cardiology,EU,\n"
+            "Ibuprofen,,Rheumatology,\"EU, US\",ibuprofen\n"
+        )
+        report = import_products(db_session, stream, user.id, chunk_size=2)
+        assert report.inserted == 2
+        assert report.failed == 1
+        assert report.errors[0].line == 3
+        assert report.errors[0].error.startswith("name:")
+        assert [p.id for p in ProductCRUD.search(db_session, search_term="ibupro").items]
+        assert ProductFacets.get(db_session)["region"] == [("EU", 2), ("US", 1)]
+
+    def test_import_jsonl_isolates_failing_rows(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="importer2", hashed_password="x"))
+        stream = io.StringIO(
+            '{"name": "A", "date_added": "2024-01-01T00:00:00"}\n'
+            "not json\n"
+            '{"name": "B"}\n'
+        )
+        report = import_products(db_session, stream, user.id, format="jsonl")
+        assert (report.inserted, report.failed) == (2, 1)
+        assert report.errors[0].line == 2
+        missing_owner = import_products(db_session, io.StringIO('{"name": "C"}\n'), 999, format="jsonl")
+        assert (missing_owner.inserted, missing_owner.failed) == (0, 1)
+
+    def test_upload_endpoint(self, client, db_session):
+        UserCRUD.create(db_session, UserCreate(username="uploader", hashed_password="x"))
+        client.cookies = {"access_token": "Bearer " + create_access_token(data={"sub": "uploader"})}
+        response = client.post(
+            "/products/import",
+            files={"file": ("catalog.jsonl", b'{"name": "Uploaded"}\n', "application/x-ndjson")},
+        )
+        client.cookies = None
+        assert response.status_code == 200
+        assert response.json() == {"inserted": 1, "failed": 0, "errors": []}
+
+    def test_cli_import(self, db_session, tmp_path, monkeypatch, capsys):
+        user = UserCRUD.create(db_session, UserCreate(username="cli", hashed_password="x"))
+        path = tmp_path / "catalog.csv"
+        path.write_text("name\nFrom CLI\n")
+        monkeypatch.setattr("app.bulk.SessionLocal", TestingSessionLocal)
+        monkeypatch.setattr("app.bulk.engine", engine)
+        assert bulk_main(["import", str(path), "--user-id", str(user.id)]) == 0
+        assert '"inserted": 1' in capsys.readouterr().out
+
+    def test_cli_import_migrates_legacy_database(self, tmp_path, monkeypatch, capsys):
+        legacy = create_db_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        try:
+            with legacy.begin() as connection:
+                create_baseline_schema(connection)
+                connection.exec_driver_sql("INSERT INTO users (username, hashed_password) VALUES ('old', 'x')")
+            path = tmp_path / "catalog.csv"
+            path.write_text("name,regions\nFrom CLI,EU\n")
+            monkeypatch.setattr("app.bulk.SessionLocal", sessionmaker(bind=legacy))
+            monkeypatch.setattr("app.bulk.engine", legacy)
+            assert bulk_main(["import", str(path), "--user-id", "1"]) == 0
+            assert '"inserted": 1' in capsys.readouterr().out
+            with legacy.connect() as connection:
+                assert connection.exec_driver_sql("SELECT COUNT(*) FROM schema_migrations").scalar() == len(MIGRATIONS)
+                assert connection.exec_driver_sql("SELECT version FROM products").scalar() == 1
+                assert connection.exec_driver_sql("SELECT COUNT(*) FROM product_regions").scalar() == 1
+        finally:
+            legacy.dispose()
+
+
+class TestBulkExport:
+    def test_csv_export_streams_filtered_rows(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="exporter", hashed_password="x"))
+        make_product(db_session, user.id, "Aspirin", area="Cardiology", regions="EU, US")
+        make_product(db_session, user.id, "Ibuprofen", area="Rheumatology")
+        response = client.get("/products/export", params={"area": "cardiology"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [row["name"] for row in rows] == ["Aspirin"]
+        assert rows[0]["regions"] == "EU, US"
+
+    def test_jsonl_export_since_is_incremental(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="exporter2", hashed_password="x"))
+        make_product(db_session, user.id, "Old", date_added=datetime(2024, 1, 1))
+        make_product(db_session, user.id, "New", date_added=datetime(2024, 6, 1))
+        response = client.get("/products/export", params={"format": "jsonl", "since": "2024-01-01T00:00:00"})
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["name"] for line in lines] == ["New"]
+        assert lines[0]["date_added"] == "2024-06-01T00:00:00"
+
+    def test_export_yields_in_batches(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="exporter3", hashed_password="x"))
+        for i in range(5):
+            make_product(db_session, user.id, f"P{i}")
+        chunks = list(iter_export(TestingSessionLocal, format="jsonl", batch_size=2))
+        assert [chunk.count("\n") for chunk in chunks] == [2, 2, 1]
+
+
+class TestProductAPI:
+    def auth_headers(self, db_session, username):
+        UserCRUD.create(db_session, UserCreate(username=username, hashed_password="x"))
+        return {"Authorization": "Bearer " + create_access_token(data={"sub": username})}
+
+    def payload(self, name, **fields):
+        return {"name": name, "description": None, "area": None, "regions": None, "ingredients": None, **fields}
+
+    def test_html_route_names_are_not_shadowed(self):
+        assert app.url_path_for("search_products") == "/products/search"
+        assert app.url_path_for("create_product") == "/products/create"
+        assert app.url_path_for("api_search_products") == "/api/v1/products/search"
+
+    def test_create_get_update(self, client, db_session):
+        headers = self.auth_headers(db_session, "api")
+        response = client.post("/api/v1/products", json=self.payload("Aspirin", area="Cardiology"), headers=headers)
+        assert response.status_code == 201
+        product = response.json()
+        assert response.headers["Location"] == f"/api/v1/products/{product['id']}"
+        assert client.get(f"/api/v1/products/{product['id']}").json() == product
+        response = client.put(
+            f"/api/v1/products/{product['id']}",
+            json=self.payload("Aspirin Forte", area="Cardiology"),
+            headers=headers,
+        )
+        assert response.json()["name"] == "Aspirin Forte"
+        other = self.auth_headers(db_session, "api-other")
+        response = client.put(f"/api/v1/products/{product['id']}", json=self.payload("Nope"), headers=other)
+        assert response.status_code == 403
+        assert client.post("/api/v1/products", json=self.payload("Anon")).status_code == 401
+
+    def test_list_and_search(self, client, db_session):
+        headers = self.auth_headers(db_session, "api2")
+        for name in ("Aspirin", "Ibuprofen", "Aspirin Junior"):
+            client.post("/api/v1/products", json=self.payload(name), headers=headers)
+        listing = client.get("/api/v1/products", params={"page_size": 2}).json()
+        assert [item["name"] for item in listing["items"]] == ["Aspirin", "Ibuprofen"]
+        assert listing["next_cursor"]
+        found = client.get("/api/v1/products/search", params={"query": "aspi", "order_by": "name", "direction": "asc"})
+        assert [item["name"] for item in found.json()["items"]] == ["Aspirin", "Aspirin Junior"]
+
+    def test_conditional_get_until_catalog_changes(self, client, db_session):
+        headers = self.auth_headers(db_session, "api3")
+        client.post("/api/v1/products", json=self.payload("Aspirin"), headers=headers)
+        first = client.get("/api/v1/products")
+        etag = first.headers["ETag"]
+        with count_queries() as statements:
+            cached = client.get("/api/v1/products", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert len(statements) == 1
+        assert client.get("/api/v1/products", params={"page_size": 1}).headers["ETag"] != etag
+        client.post("/api/v1/products", json=self.payload("Ibuprofen"), headers=headers)
+        changed = client.get("/api/v1/products", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["ETag"] != etag
+
+
+class TestPageCache:
+    def test_hot_pages_skip_database_until_catalog_changes(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="pages", hashed_password="x"))
+        make_product(db_session, user.id, "Aspirin")
+        client.cookies.clear()
+        first = client.get("/products/search", params={"query": "aspirin", "area": ""})
+        hits = page_cache.hits
+        with count_queries() as statements:
+            second = client.get("/products/search", params={"area": "", "query": "aspirin"})
+        assert len(statements) == 1 and "FROM table_versions" in statements[0]
+        assert second.text == first.text
+        assert page_cache.hits == hits + 1
+        make_product(db_session, user.id, "Aspirin Forte")
+        third = client.get("/products/search", params={"query": "aspirin"})
+        assert "Aspirin Forte" in third.text
+
+    def test_writes_from_other_workers_invalidate_pages(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="pages3", hashed_password="x"))
+        make_product(db_session, user.id, "Aspirin")
+        client.cookies.clear()
+        assert "Aspirin" in client.get("/products/read").text
+        db_session.add(Product(name="Written elsewhere", user_id=user.id, date_added=datetime.now()))
+        TableVersions.bump(db_session)
+        db_session.commit()
+        assert "Written elsewhere" in client.get("/products/read").text
+
+    def test_login_state_is_part_of_the_key(self, client, db_session):
+        UserCRUD.create(db_session, UserCreate(username="pages2", hashed_password="x"))
+        client.cookies.clear()
+        anonymous = client.get("/products/read")
+        client.cookies = {"access_token": "Bearer " + create_access_token(data={"sub": "pages2"})}
+        logged_in = client.get("/products/read")
+        client.cookies = None
+        assert "Welcome, pages2" not in anonymous.text
+        assert "Welcome, pages2" in logged_in.text
+
+    @pytest.mark.parametrize("backend", ["memory", "sqlite"])
+    def test_backends_evict_least_recently_used(self, backend, tmp_path):
+        if backend == "memory":
+            store = MemoryBackend(max_bytes=10)
+        else:
+            store = SQLiteBackend(str(tmp_path / "pages.db"), max_bytes=10)
+        cache = PageCache(backend=store, ttl=60)
+        keys = [cache.key("/products/read", {"cursor": str(i)}) for i in range(3)]
+        cache.set(keys[0], b"aaaa")
+        cache.set(keys[1], b"bbbb")
+        assert cache.get(keys[0]) == b"aaaa"
+        cache.set(keys[2], b"cccc")
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) == b"aaaa"
+        assert store.evictions == 1
+        cache.bump_version()
+        assert cache.key("/products/read", {"cursor": "0"}) != keys[0]
+        assert cache.stats()["hit_rate"] == pytest.approx(2 / 3)
+
+
+class TestQueryPlans:
+    CURSOR_VALUES = {
+        "id": 5,
+        "name": "Aspirin",
+        "ingredients": "Ingredient",
+        "area": "Area",
+        "date_added": datetime(2024, 1, 1),
+    }
+
+    def plan(self, db_session, **kwargs):
+        self.captured.clear()
+        ProductCRUD.search(db_session, **kwargs)
+        statement, parameters = self.captured[-1]
+        rows = db_session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+        return [row[3] for row in rows]
+
+    @pytest.fixture(autouse=True)
+    def capture_parameters(self):
+        self.captured = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if "FROM products" in statement:
+                self.captured.append((statement, parameters))
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        yield
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    @pytest.mark.parametrize("filters", [
+        {},
+        {"user_id": "1"},
+        {"area": "area"},
+        {"region": "region"},
+        {"ingredient": "aspirin", "region": "region"},
+        {"ingredient": "aspirin, caffeine", "match": "any"},
+    ])
+    @pytest.mark.parametrize("order_by", [None, "name", "ingredients", "area", "date_added"])
+    @pytest.mark.parametrize("direction", ["asc", "desc"])
+    @pytest.mark.parametrize("with_cursor", [False, True])
+    def test_listing_queries_avoid_table_scans(self, db_session, filters, order_by, direction, with_cursor):
+        sort = order_by or "id"
+        cursor = encode_cursor(sort, self.CURSOR_VALUES[sort], 5) if with_cursor else None
+        plan = self.plan(
+            db_session,
+            filters=filters,
+            sorting={order_by: direction} if order_by else {},
+            cursor=cursor,
+        )
+        scans = [detail for detail in plan if detail.startswith("SCAN products") and "USING" not in detail]
+        if not filters and order_by is None and not with_cursor:
+            assert scans == ["SCAN products"]
+        else:
+            assert scans == [], plan
+
+    def test_fulltext_search_uses_index(self, db_session):
+        plan = self.plan(db_session, search_term="aspirin", filters={"area": "area"})
+        assert any("products_fts" in detail for detail in plan)
+        assert not [detail for detail in plan if detail == "SCAN products"]
+
+    def test_migrations_are_recorded_and_idempotent(self, db_session):
+        migrate(engine)
+        assert migrate(engine) == []
+        applied = db_session.execute(text("SELECT version FROM schema_migrations ORDER BY version")).scalars().all()
+        assert applied == [version for version, _, _ in MIGRATIONS]
+
+
+class TestProductTags:
+    def names(self, db_session, product_id, table, column, model):
+        return sorted(db_session.execute(text(
+            f"SELECT t.name FROM {model} t JOIN {table} l ON l.{column} = t.id WHERE l.product_id = :id"
+        ), {"id": product_id}).scalars())
+
+    def test_split_ingredients(self):
+        assert split_ingredients(" Aspirin ,caffeine;  vitamin   C + Aspirin") == ["Aspirin", "caffeine", "vitamin C"]
+        assert split_ingredients(None) == []
+
+    def test_create_and_update_keep_links_in_sync(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="tags", hashed_password="x"))
+        product = make_product(db_session, user.id, "Combo", regions="EU, US", ingredients="Aspirin, Caffeine")
+        assert self.names(db_session, product.id, "product_regions", "region_id", "regions") == ["EU", "US"]
+        ProductCRUD.update(db_session, product, ProductUpdate(
+            name=product.name,
+            description=product.description,
+            area=product.area,
+            regions="eu",
+            ingredients="Paracetamol",
+        ))
+        assert self.names(db_session, product.id, "product_regions", "region_id", "regions") == ["EU"]
+        assert self.names(db_session, product.id, "product_ingredients", "ingredient_id", "ingredients") == ["Paracetamol"]
+
+    def test_search_with_all_and_any_semantics(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="tags2", hashed_password="x"))
+        both = make_product(db_session, user.id, "Both", regions="EU/US", ingredients="Aspirin, Caffeine")
+        aspirin = make_product(db_session, user.id, "Aspirin", regions="US", ingredients="aspirin")
+        make_product(db_session, user.id, "Other", regions="Asia", ingredients="Ibuprofen")
+
+        def ids(**filters):
+            return [p.id for p in ProductCRUD.search(db_session, filters=filters).items]
+
+        assert ids(ingredient="ASPIRIN") == [both.id, aspirin.id]
+        assert ids(ingredient="aspirin, caffeine") == [both.id]
+        assert ids(ingredient="aspirin, caffeine", match="any") == [both.id, aspirin.id]
+        assert ids(ingredient="aspirin", region="eu") == [both.id]
+        assert ids(region="us") == [both.id, aspirin.id]
+        assert ids(ingredient="unknown") == []
+
+    def test_backfill_migration_parses_existing_rows(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="tags3", hashed_password="x"))
+        product = make_product(db_session, user.id, "Legacy", regions="EU; Asia", ingredients="Aspirin")
+        db_session.execute(text("DELETE FROM product_regions"))
+        db_session.execute(text("DELETE FROM product_ingredients"))
+        db_session.commit()
+        assert ProductCRUD.search(db_session, filters={"region": "asia"}).items == []
+        ProductTags.rebuild(db_session.connection())
+        db_session.commit()
+        assert ProductCRUD.search(db_session, filters={"region": "asia"}).items == [product]
+        assert ProductCRUD.search(db_session, filters={"ingredient": "aspirin"}).items == [product]
+
+    def test_api_search_filters_by_ingredient(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="tags4", hashed_password="x"))
+        make_product(db_session, user.id, "Both", ingredients="Aspirin, Caffeine")
+        make_product(db_session, user.id, "Aspirin", ingredients="Aspirin")
+        response = client.get("/api/v1/products/search", params={"ingredient": "aspirin,caffeine"})
+        assert [item["name"] for item in response.json()["items"]] == ["Both"]
+        response = client.get("/api/v1/products/search", params={"ingredient": "aspirin,caffeine", "match": "any"})
+        assert len(response.json()["items"]) == 2
+
+
+class TestBenchmark:
+    def test_percentiles_and_regressions(self):
+        values = [i / 1000 for i in range(1, 101)]
+        assert percentile(values, 0.50) == 0.050
+        assert percentile(values, 0.95) == 0.095
+        assert percentile(values, 0.99) == 0.099
+        baseline = {"runs": {"100": {"search": {"p95_ms": 10.0}, "create": {"p95_ms": 5.0}}}}
+        results = {"runs": {"100": {"search": {"p95_ms": 11.0}, "create": {"p95_ms": 7.0}, "new": {"p95_ms": 1.0}}}}
+        assert compare(results, baseline, tolerance=0.2) == ["100 create: p95 7.00ms vs baseline 5.00ms"]
+
+    def test_small_catalog_run(self, tmp_path):
+        results = run_benchmarks(sizes=[30], data_dir=str(tmp_path), iterations=1, total=4, concurrency=2)
+        benchmarks = results["runs"]["30"]
+        assert {"get_multi.first_page", "search.ingredient_region.name.asc", "authenticate", "create"} <= set(benchmarks)
+        assert {"read_model.build", "search_rm.ingredient_region.name.asc"} <= set(benchmarks)
+        assert results["read_model"]["30"]["rows"] >= 30
+        assert results["read_model"]["30"]["memory_bytes"] > 0
+        for name in ("http.products_read", "http.products_search", "http.login"):
+            assert benchmarks[name]["errors"] == 0
+            assert benchmarks[name]["p99_ms"] >= benchmarks[name]["p50_ms"] > 0
+
+
+class TestInstrumentation:
+    def server_timing(self, response):
+        timings = {}
+        for entry in response.headers["server-timing"].split(", "):
+            name, *params = entry.split(";")
+            timings[name] = dict(param.split("=", 1) for param in params)
+        return timings
+
+    def test_server_timing_breaks_down_request(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="timing", hashed_password="x"))
+        make_product(db_session, user.id, "Aspirin")
+        client.cookies.clear()
+        with count_queries() as statements:
+            response = client.get("/products/read")
+        timings = self.server_timing(response)
+        assert timings["sql"]["desc"] == f'"{len(statements)}x"'
+        assert float(timings["render"]["dur"]) > 0
+        assert float(timings["total"]["dur"]) >= float(timings["sql"]["dur"])
+        assert "auth" in timings
+
+    def test_metrics_endpoint_exposes_histograms(self, client):
+        reset_metrics()
+        client.cookies.clear()
+        client.get("/products/read")
+        client.get("/products/read")
+        assert SQL_QUERIES.count("GET", "/products/read") == 2
+        body = client.get("/metrics").text
+        assert '# TYPE http_request_duration_seconds histogram' in body
+        assert 'http_request_duration_seconds_count{method="GET",route="/products/read",status="200"} 2' in body
+        assert 'http_request_render_duration_seconds_bucket{method="GET",route="/products/read",le="+Inf"} 2' in body
+
+    def test_sampling_disabled_skips_instrumentation(self):
+        sampled = FastAPI()
+        sampled.add_middleware(InstrumentationMiddleware, sample_rate=0)
+        sampled.get("/ping")(lambda: {"ok": True})
+        reset_metrics()
+        response = TestClient(sampled).get("/ping")
+        assert response.status_code == 200
+        assert "server-timing" not in response.headers
+        assert SQL_QUERIES.count("GET", "/ping") == 0
+
+
+class TestSlowQueryLog:
+    @pytest.fixture
+    def log_path(self, tmp_path, monkeypatch):
+        path = tmp_path / "slow.jsonl"
+        slow_query_log.close()
+        monkeypatch.setattr(slow_query_log, "path", str(path))
+        monkeypatch.setattr(slow_query_log, "threshold_ms", 1e-9)
+        yield path
+        slow_query_log.close()
+
+    def entries(self, path):
+        return [json.loads(line) for line in path.read_text().splitlines()]
+
+    def test_records_statement_plan_and_endpoint(self, client, db_session, log_path):
+        user = UserCRUD.create(db_session, UserCreate(username="slow", hashed_password="x"))
+        make_product(db_session, user.id, "Aspirin", area="Oncology")
+        log_path.write_text("")
+        client.get("/api/v1/products/search", params={"area": "Oncology"})
+        entries = [entry for entry in self.entries(log_path) if "FROM products" in entry["statement"]]
+        assert entries
+        entry = entries[-1]
+        assert entry["endpoint"] == "GET /api/v1/products/search"
+        assert "Oncology" in entry["parameters"]
+        assert any("ix_products_lower_area" in detail for detail in entry["plan"])
+        assert entry["duration_ms"] >= 0
+
+    def test_sensitive_parameters_are_redacted(self):
+        statement = "SELECT users.hashed_password FROM users WHERE users.username = ?"
+        assert redact_parameters(statement, ("admin",)) == ["<redacted>"]
+        assert redact_parameters("SELECT 1 WHERE a = :token", {"token": "abc"}) == {"token": "<redacted>"}
+        assert redact_parameters("SELECT ?, ?", ("x" * 100, datetime(2024, 1, 1))) == ["x" * 64 + "...", "2024-01-01T00:00:00"]
+
+    def test_log_rotates(self, tmp_path):
+        log = SlowQueryLog(path=str(tmp_path / "rotating.jsonl"), threshold_ms=1, max_bytes=300, backups=2)
+        with engine.connect() as connection:
+            for _ in range(10):
+                log.record(connection, "SELECT 1", (), 0.5, False)
+        log.close()
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            "rotating.jsonl", "rotating.jsonl.1", "rotating.jsonl.2",
+        ]
+
+
+class TestProfiler:
+    def test_sampling_profiler_collapses_stacks(self):
+        sampler = SamplingProfiler(interval=0.001).start()
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        sampler.stop()
+        assert sum(sampler.samples.values()) > 0
+        assert "test_sampling_profiler_collapses_stacks" in sampler.collapsed()
+
+    def test_profile_requires_admin(self, client, db_session, monkeypatch):
+        monkeypatch.setattr(profiler, "ADMIN_USERNAMES", {"admin"})
+        UserCRUD.create(db_session, UserCreate(username="visitor", hashed_password="x"))
+        client.cookies = {"access_token": "Bearer " + create_access_token(data={"sub": "visitor"})}
+        assert client.get("/products/read", params={"profile": "1"}).status_code == 403
+        client.cookies = None
+
+    def test_admin_gets_collapsed_stacks(self, client, db_session, monkeypatch):
+        monkeypatch.setattr(profiler, "ADMIN_USERNAMES", {"admin"})
+        UserCRUD.create(db_session, UserCreate(username="admin", hashed_password="x"))
+        token = create_access_token(data={"sub": "admin"})
+        response = client.get(
+            "/products/read",
+            params={"profile": "1"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == 200
+        assert response.headers["x-profile-status"] == "200"
+        assert response.headers["content-type"].startswith("text/plain")
+        for line in response.text.splitlines():
+            stack, count = line.rsplit(" ", 1)
+            assert int(count) > 0 and stack
+
+
+class TestTemplates:
+    def test_precompile_fills_bytecode_cache(self, tmp_path):
+        templates = create_templates(cache_dir=str(tmp_path))
+        assert templates.env.auto_reload is False
+        assert precompile(templates) == 5
+        assert len(list(tmp_path.iterdir())) == 5
+
+    def test_bytecode_cache_directory_must_be_private(self, tmp_path):
+        default = create_templates().env.bytecode_cache.directory
+        assert os.stat(default).st_uid == os.getuid()
+        shared = tmp_path / "shared"
+        shared.mkdir()
+        shared.chmod(0o777)
+        with pytest.raises(RuntimeError):
+            create_templates(cache_dir=str(shared))
+        created = tmp_path / "created"
+        create_templates(cache_dir=str(created))
+        assert created.stat().st_mode & 0o777 == 0o700
+
+    def test_large_listing_is_streamed_and_cached(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="stream", hashed_password="x"))
+        products = [make_product(db_session, user.id, f"Streamed {i}") for i in range(25)]
+        client.cookies = {"access_token": "Bearer " + create_access_token(data={"sub": "stream"})}
+        response = client.get("/products/read")
+        assert "content-length" not in response.headers
+        assert len(response.context["products"]) == 25
+        for product in products:
+            assert f'href="http://testserver/products/edit/{product.id}"' in response.text
+        assert f'href="http://testserver/products/search?query=&amp;user_id={user.id}"' in response.text
+        assert response.text.rstrip().endswith("</html>")
+        with count_queries() as statements:
+            cached = client.get("/products/read")
+        client.cookies = None
+        assert cached.text == response.text
+        assert len(statements) == 1 and "FROM table_versions" in statements[0]
+
+
+class TestChangeFeed:
+    def test_create_and_update_are_recorded_in_order(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="feed", hashed_password="x"))
+        start = ChangeFeed.last_seq(db_session)
+        product = make_product(db_session, user.id, "Aspirin", area="Cardiology")
+        ProductCRUD.update(db_session, product, ProductUpdate(
+            name="Aspirin Forte", description=None, area="Cardiology", regions=None, ingredients=None,
+        ))
+        changes = ChangeFeed.since(db_session, start)
+        assert [(change.op, change.data["name"]) for change in changes] == [("create", "Aspirin"), ("update", "Aspirin Forte")]
+        assert changes[0].seq < changes[1].seq
+        assert changes[1].data["id"] == product.id
+
+    def test_bulk_create_records_every_row(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="feed-bulk", hashed_password="x"))
+        start = ChangeFeed.last_seq(db_session)
+        ProductCRUD.bulk_create(db_session, [
+            ProductCreate(
+                name=f"P{i}", description=None, area=None, regions=None, ingredients=None,
+                date_added=datetime.now(), user_id=user.id,
+            )
+            for i in range(3)
+        ])
+        changes = ChangeFeed.since(db_session, start)
+        assert [(change.data["name"], change.data["version"]) for change in changes] == [("P0", 1), ("P1", 1), ("P2", 1)]
+
+    def test_pagination_with_since(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="feed-api", hashed_password="x"))
+        start = ChangeFeed.last_seq(db_session)
+        for i in range(3):
+            make_product(db_session, user.id, f"P{i}")
+        first = client.get("/api/v1/products/changes", params={"since": start, "limit": 2}).json()
+        assert [change["data"]["name"] for change in first["changes"]] == ["P0", "P1"]
+        assert first["has_more"]
+        second = client.get("/api/v1/products/changes", params={"since": first["last_seq"], "limit": 2}).json()
+        assert [change["data"]["name"] for change in second["changes"]] == ["P2"]
+        assert not second["has_more"]
+        empty = client.get("/api/v1/products/changes", params={"since": second["last_seq"]}).json()
+        assert empty == {"changes": [], "last_seq": second["last_seq"], "has_more": False}
+
+    def test_long_poll_returns_when_change_arrives(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="feed-wait", hashed_password="x"))
+        start = ChangeFeed.last_seq(db_session)
+        started = time.monotonic()
+
+        def add_later():
+            with TestingSessionLocal() as db:
+                make_product(db, user.id, "Late")
+
+        timer = threading.Timer(0.3, add_later)
+        timer.start()
+        try:
+            response = client.get("/api/v1/products/changes", params={"since": start, "wait": 5})
+        finally:
+            timer.join()
+        assert [change["data"]["name"] for change in response.json()["changes"]] == ["Late"]
+        assert time.monotonic() - started < 5
+
+    def test_long_poll_times_out_empty(self, client, db_session):
+        started = time.monotonic()
+        response = client.get("/api/v1/products/changes", params={"since": 0, "wait": 0.2})
+        assert response.json()["changes"] == []
+        assert time.monotonic() - started >= 0.2
+
+    def test_event_stream_resumes_from_last_event_id(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="feed-sse", hashed_password="x"))
+        make_product(db_session, user.id, "First")
+        make_product(db_session, user.id, "Second")
+        seq = ChangeFeed.since(db_session, 0)[0].seq
+        response = client.get(
+            "/api/v1/products/changes/stream",
+            params={"timeout": 0.2},
+            headers={"Last-Event-ID": str(seq)},
+        )
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [block for block in response.text.split("\n\n") if block.startswith("id:")]
+        assert len(events) == 1
+        assert events[0].startswith(f"id: {seq + 1}\nevent: create\n")
+        assert json.loads(events[0].split("data: ", 1)[1])["data"]["name"] == "Second"
+
+    def test_backfill_records_existing_products(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="feed-backfill", hashed_password="x"))
+        make_product(db_session, user.id, "Old")
+        db_session.execute(text("DELETE FROM product_changes"))
+        db_session.commit()
+        with engine.begin() as connection:
+            ChangeFeed.backfill(connection)
+        changes = ChangeFeed.since(db_session, 0)
+        assert [(change.op, change.data["name"]) for change in changes] == [("create", "Old")]
+
+
+class TestTokens:
+    def test_rotated_keys_keep_verifying_until_removed(self, monkeypatch):
+        ring = KeyRing({"old": "old-secret"})
+        monkeypatch.setattr("app.tokens.key_ring", ring)
+        old_token = create_access_token(data={"sub": "rotated"})
+        assert jwt.get_unverified_header(old_token)["kid"] == "old"
+        ring.add("new", "new-secret", activate=True)
+        new_token = create_access_token(data={"sub": "rotated"})
+        assert jwt.get_unverified_header(new_token)["kid"] == "new"
+        assert verify_token(old_token)["sub"] == verify_token(new_token)["sub"] == "rotated"
+        ring.remove("old")
+        with pytest.raises(jwt.InvalidTokenError):
+            verify_token(old_token)
+        with pytest.raises(ValueError):
+            ring.remove("new")
+
+    def test_expiry_is_timezone_aware(self):
+        payload = verify_token(create_access_token(data={"sub": "tz"}, expires_delta=timedelta(minutes=5)))
+        assert abs(payload["exp"] - time.time() - 300) < 5
+        assert payload["jti"]
+        expired = create_access_token(data={"sub": "tz"}, expires_delta=timedelta(seconds=-1))
+        with pytest.raises(jwt.ExpiredSignatureError):
+            verify_token(expired)
+
+    def test_embedded_claims_skip_user_lookup(self, client):
+        token = create_access_token(data={"sub": "claims", "uid": 42})
+        client.cookies = {"access_token": f"Bearer {token}"}
+        with count_queries() as statements:
+            response = client.get("/products/read")
+        client.cookies = None
+        assert "Welcome, claims" in response.text
+        assert not [statement for statement in statements if "FROM users" in statement]
+
+    def test_login_embeds_user_id(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="embedded", hashed_password=get_password_hash("pw")))
+        response = client.post("/login", data={"username": "embedded", "password": "pw"}, follow_redirects=False)
+        token = response.cookies["access_token"].strip('"').split()[1]
+        assert verify_token(token)["uid"] == user.id
+
+    def test_logout_revokes_token(self, client, db_session):
+        UserCRUD.create(db_session, UserCreate(username="revoked", hashed_password="x"))
+        token = create_access_token(data={"sub": "revoked"})
+        cookies = {"access_token": f"Bearer {token}"}
+        client.cookies = cookies
+        assert client.get("/products/create").status_code == 200
+        client.get("/logout", follow_redirects=False)
+        client.cookies = cookies
+        assert client.get("/products/create").status_code == 401
+        client.cookies = None
+        with pytest.raises(jwt.InvalidTokenError):
+            verify_token(token)
+        assert len(revocations) == 1
+
+    def test_revocation_reaches_other_workers(self, client, db_session):
+        UserCRUD.create(db_session, UserCreate(username="everywhere", hashed_password="x"))
+        token = create_access_token(data={"sub": "everywhere"})
+        cookies = {"access_token": f"Bearer {token}"}
+        client.cookies = cookies
+        assert client.get("/products/create").status_code == 200
+        other = RevocationList(bits=1024)
+        assert other.sync(db_session) == []
+        client.get("/logout", follow_redirects=False)
+        assert other.sync(db_session) == [key_ring.decode(token)["jti"]]
+        assert other.sync(db_session) == []
+        revocations.clear()
+        token_cache.set(token, UserIdentity(id=1, username="everywhere"))
+        client.cookies = cookies
+        assert client.get("/products/create").status_code == 401
+        client.cookies = None
+
+    def test_revoking_twice_keeps_one_row(self, db_session):
+        revocations.revoke("twice", time.time() + 60, db_session)
+        revocations.revoke("twice", time.time() + 60, db_session)
+        assert db_session.scalar(text("SELECT COUNT(*) FROM revoked_tokens WHERE jti = 'twice'")) == 1
+        assert revocations.is_revoked("twice")
+
+    def test_revocation_list_expires_entries(self):
+        bloom = BloomFilter(bits=1024)
+        bloom.add("a")
+        assert "a" in bloom
+        revoked = RevocationList(bits=1024)
+        revoked.revoke("live", time.time() + 60)
+        revoked.revoke("stale", time.time() - 1)
+        assert revoked.is_revoked("live")
+        assert not revoked.is_revoked("stale")
+        assert not revoked.is_revoked("other")
+        assert revoked.prune() == 1
+        assert RevocationList(enabled=False).is_revoked("live") is False
+
+
+class TestStartup:
+    def run_python(self, code, database):
+        env = {**os.environ, "DATABASE_URL": f"sqlite:///{database}", "SLOW_QUERY_LOG": f"{database}.slow"}
+        return subprocess.run([sys.executable, "-c", code], env=env, cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+
+    def test_import_has_no_database_side_effects(self, tmp_path):
+        database = tmp_path / "startup.db"
+        self.run_python("import app.main", database)
+        assert not database.exists()
+        result = self.run_python(
+            "from fastapi.testclient import TestClient\n"
+            "from app.main import app\n"
+            "with TestClient(app) as client:\n"
+            "    print(client.get('/products/read').status_code)\n",
+            database,
+        )
+        assert result.stdout.split() == ["200"]
+        assert database.exists()
+
+    def test_startup_benchmark_measures_workers(self, tmp_path):
+        results = run_startup(str(tmp_path), workers=2, repeats=1)
+        assert results["import_ms"] > 0 and results["initialize_ms"] > 0
+        server = results["server"]
+        assert server["ready_ms"] > 0
+        if server["parent"]:
+            assert len(server["worker_memory"]) == 2
+            assert all(memory["uss_kb"] < memory["rss_kb"] for memory in server["worker_memory"])
+
+
+class TestSuggest:
+    def test_prefix_matches_names_and_ingredients(self):
+        index = SuggestIndex()
+        index.apply([(1, "Aspirin Forte", "Aspirin, Caffeine"), (2, "Aspirin", "aspirin"), (3, "Ibuprofen", "Ibuprofen")])
+        assert [(item["kind"], item["text"], item["count"]) for item in index.suggest("asp")] == [
+            ("ingredient", "Aspirin", 2), ("name", "Aspirin", 1), ("name", "Aspirin Forte", 1),
+        ]
+        assert [item["text"] for item in index.suggest("for")] == ["Aspirin Forte"]
+        assert index.suggest("  ") == []
+        index.apply([(1, "Paracetamol", None)])
+        assert [item["text"] for item in index.suggest("for")] == []
+        assert [item["count"] for item in index.suggest("aspirin") if item["kind"] == "ingredient"] == [1]
+        assert [item["product_id"] for item in index.suggest("par")] == [1]
+
+    def test_endpoint_serves_from_memory_and_tracks_writes(self, client, db_session, monkeypatch):
+        monkeypatch.setattr("app.suggest.SUGGEST_REFRESH_SECONDS", 60)
+        user = UserCRUD.create(db_session, UserCreate(username="suggest", hashed_password="x"))
+        product = make_product(db_session, user.id, "Aspirin", ingredients="Caffeine")
+        assert [item["text"] for item in client.get("/products/suggest", params={"q": "as"}).json()["suggestions"]] == ["Aspirin"]
+        make_product(db_session, user.id, "Astemizole")
+        ProductCRUD.update(db_session, product, ProductUpdate(
+            name="Paracetamol", description=None, area=None, regions=None, ingredients=None,
+        ))
+        with count_queries() as statements:
+            response = client.get("/products/suggest", params={"q": "AS", "limit": 5})
+        assert [item["text"] for item in response.json()["suggestions"]] == ["Astemizole"]
+        assert statements == []
+
+    def test_other_workers_catch_up_from_change_feed(self, client, db_session, monkeypatch):
+        user = UserCRUD.create(db_session, UserCreate(username="suggest-feed", hashed_password="x"))
+        client.get("/products/suggest", params={"q": "x"})
+        monkeypatch.setattr("app.suggest.ProductSuggestions.apply", staticmethod(lambda db, rows: None))
+        make_product(db_session, user.id, "Zolpidem")
+        monkeypatch.setattr("app.suggest.SUGGEST_REFRESH_SECONDS", 0)
+        assert [item["text"] for item in client.get("/products/suggest", params={"q": "zol"}).json()["suggestions"]] == ["Zolpidem"]
+
+    def test_lookup_is_sub_millisecond(self):
+        index = SuggestIndex()
+        index.apply(((i, f"Product {i:05d} forte", "aspirin, caffeine") for i in range(20000)), bulk=True)
+        started = time.perf_counter()
+        for _ in range(100):
+            index.suggest("product 01")
+        assert (time.perf_counter() - started) / 100 < 0.001
+
+
+class TestProductUpdates:
+    def auth_headers(self, db_session, username):
+        user = UserCRUD.create(db_session, UserCreate(username=username, hashed_password="x"))
+        return user, {"Authorization": "Bearer " + create_access_token(data={"sub": username})}
+
+    def test_patch_writes_only_changed_columns_without_refresh(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="partial", hashed_password="x"))
+        product = make_product(db_session, user.id, "Aspirin", area="Cardiology")
+        with count_queries() as statements:
+            ProductCRUD.update(db_session, product, ProductUpdate(name="Aspirin Forte", area="Cardiology"))
+        updates = [statement for statement in statements if statement.startswith("UPDATE products")]
+        assert len(updates) == 1
+        assert updates[0].split(" WHERE ")[0] == "UPDATE products SET name=?, version=(products.version + ?)"
+        assert not [statement for statement in statements if statement.startswith("SELECT") and "FROM products" in statement]
+        with count_queries() as statements:
+            assert (product.name, product.area, product.version) == ("Aspirin Forte", "Cardiology", 2)
+        assert statements == []
+        db_session.expire_all()
+        assert ProductCRUD.get(db_session, product.id).version == 2
+
+    def test_stale_version_is_rejected(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="stale", hashed_password="x"))
+        product = make_product(db_session, user.id, "Aspirin")
+        with pytest.raises(VersionConflict) as error:
+            ProductCRUD.update(db_session, product, ProductUpdate(name="Nope", version=7))
+        assert error.value.ids == [product.id]
+        other = TestingSessionLocal()
+        try:
+            ProductCRUD.update(other, ProductCRUD.get(other, product.id), ProductUpdate(name="Concurrent"))
+        finally:
+            other.close()
+        with pytest.raises(VersionConflict):
+            ProductCRUD.update(db_session, product, ProductUpdate(name="Lost update"))
+        db_session.expire_all()
+        assert ProductCRUD.get(db_session, product.id).name == "Concurrent"
+
+    def test_concurrent_write_reports_stale_ids(self, client, db_session, monkeypatch):
+        user, headers = self.auth_headers(db_session, "racer")
+        products = [make_product(db_session, user.id, f"Race {i}") for i in range(2)]
+        other = TestingSessionLocal()
+        try:
+            ProductCRUD.update(other, ProductCRUD.get(other, products[1].id), ProductUpdate(name="Concurrent"))
+        finally:
+            other.close()
+        with pytest.raises(VersionConflict) as error:
+            ProductCRUD.update_many(db_session, [
+                (products[0], ProductUpdate(name="Mine 0")),
+                (products[1], ProductUpdate(name="Mine 1")),
+            ])
+        assert error.value.ids == [products[1].id]
+        db_session.expire_all()
+        assert [ProductCRUD.get(db_session, product.id).name for product in products] == ["Race 0", "Concurrent"]
+        changed_fields = ProductCRUD.changed_fields
+
+        def race(db_obj, obj_in):
+            monkeypatch.setattr(ProductCRUD, "changed_fields", changed_fields)
+            other = TestingSessionLocal()
+            try:
+                ProductCRUD.update(other, ProductCRUD.get(other, db_obj.id), ProductUpdate(name="Concurrent 0"))
+            finally:
+                other.close()
+            return changed_fields(db_obj, obj_in)
+
+        monkeypatch.setattr(ProductCRUD, "changed_fields", staticmethod(race))
+        response = client.patch("/api/v1/products", json={"updates": [{"id": products[0].id, "name": "Mine"}]}, headers=headers)
+        assert response.status_code == 409
+        assert response.json()["detail"]["ids"] == [products[0].id]
+
+    def test_batch_groups_statements_by_column_set(self, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="batch", hashed_password="x"))
+        products = [make_product(db_session, user.id, f"P{i}", area="Oncology", regions="EU") for i in range(3)]
+        with count_queries() as statements:
+            ProductCRUD.update_many(db_session, [
+                (products[0], ProductUpdate(name="Renamed 0")),
+                (products[1], ProductUpdate(name="Renamed 1")),
+                (products[2], ProductUpdate(area="Neurology", regions="US")),
+            ])
+        assert len([statement for statement in statements if statement.startswith("UPDATE products")]) == 2
+        assert [product.version for product in products] == [2, 2, 2]
+        assert dict(ProductFacets.get(db_session)["area"]) == {"Neurology": 1, "Oncology": 2}
+        assert [page.name for page in ProductCRUD.search(db_session, filters={"region": "US"}).items] == ["P2"]
+
+    def test_api_patch_and_batch(self, client, db_session):
+        user, headers = self.auth_headers(db_session, "patcher")
+        product = make_product(db_session, user.id, "Aspirin", area="Cardiology")
+        other = make_product(db_session, user.id, "Ibuprofen")
+        response = client.patch(f"/api/v1/products/{product.id}", json={"description": "New", "version": 1}, headers=headers)
+        assert response.status_code == 200
+        assert (response.json()["description"], response.json()["area"], response.json()["version"]) == ("New", "Cardiology", 2)
+        stale = client.patch(f"/api/v1/products/{product.id}", json={"name": "Stale", "version": 1}, headers=headers)
+        assert stale.status_code == 409
+        assert stale.json()["detail"]["ids"] == [product.id]
+        assert client.patch(f"/api/v1/products/{product.id}", json={"name": None}, headers=headers).status_code == 422
+        response = client.patch("/api/v1/products", json={"updates": [
+            {"id": product.id, "version": 2, "area": "Neurology"},
+            {"id": other.id, "name": "Ibuprofen 400"},
+        ]}, headers=headers)
+        assert [(item["name"], item["area"], item["version"]) for item in response.json()["items"]] == [
+            ("Aspirin", "Neurology", 3), ("Ibuprofen 400", "Area", 2),
+        ]
+        _, intruder = self.auth_headers(db_session, "intruder")
+        response = client.patch("/api/v1/products", json={"updates": [{"id": product.id, "name": "Mine"}]}, headers=intruder)
+        assert response.status_code == 403
+        response = client.patch("/api/v1/products", json={"updates": [{"id": 999999, "name": "Ghost"}]}, headers=headers)
+        assert response.status_code == 404
+
+    def test_edit_form_sends_version(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="editor", hashed_password="x"))
+        product = make_product(db_session, user.id, "Aspirin")
+        client.cookies = {"access_token": "Bearer " + create_access_token(data={"sub": "editor"})}
+        try:
+            form = client.get(f"/products/edit/{product.id}")
+            assert 'name="version" value="1"' in form.text
+            assert 'name="user_id"' not in form.text
+            data = {"name": "Aspirin 2", "description": "D", "area": "A", "regions": "R", "ingredients": "I", "version": "1"}
+            response = client.post(f"/products/edit/{product.id}", data=data, follow_redirects=False)
+            assert response.status_code == 303
+            assert client.post(f"/products/edit/{product.id}", data=data, follow_redirects=False).status_code == 409
+        finally:
+            client.cookies = None
+
+    def test_unchanged_edit_form_writes_nothing(self, client, db_session):
+        user = UserCRUD.create(db_session, UserCreate(username="roundtrip", hashed_password="x"))
+        product = make_product(
+            db_session, user.id, "Vitamin C", description=None, area="Immune support", regions="EU, US", ingredients="ascorbic acid",
+        )
+        client.cookies = {"access_token": "Bearer " + create_access_token(data={"sub": "roundtrip"})}
+        try:
+            form = client.get(f"/products/edit/{product.id}").text
+            data = dict(re.findall(r'<input type="(?:text|hidden)" (?:id="\w+" )?name="(\w+)" value="([^"]*)">', form))
+            assert data == {
+                "name": "Vitamin C", "description": "", "area": "Immune support", "regions": "EU, US",
+                "ingredients": "ascorbic acid", "version": "1",
+            }
+            with count_queries() as statements:
+                response = client.post(f"/products/edit/{product.id}", data=data, follow_redirects=False)
+            assert response.status_code == 303
+            assert not [statement for statement in statements if statement.startswith(("UPDATE", "INSERT"))]
+        finally:
+            client.cookies = None
+
+    def test_baseline_database_migrates_end_to_end(self, tmp_path):
+        legacy = create_db_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        try:
+            with legacy.begin() as connection:
+                create_baseline_schema(connection)
+                connection.exec_driver_sql("INSERT INTO users (username, hashed_password) VALUES ('old', 'x')")
+                connection.exec_driver_sql(
+                    "INSERT INTO products (name, area, regions, ingredients, date_added, user_id) "
+                    "VALUES ('Old', 'Oncology', 'EU', 'Aspirin', '2024-01-01 00:00:00', 1)"
+                )
+            assert migrate(legacy) == [1, 2, 3, 4]
+            with legacy.connect() as connection:
+                assert list(connection.exec_driver_sql("SELECT version FROM schema_migrations ORDER BY version").scalars()) == [1, 2, 3, 4]
+                assert connection.exec_driver_sql("SELECT version FROM products").scalar() == 1
+                data = json.loads(connection.exec_driver_sql("SELECT data FROM product_changes").scalar())
+                assert (data["name"], data["version"]) == ("Old", 1)
+            assert migrate(legacy) == []
+        finally:
+            legacy.dispose()
+
+
+class TestReadModel:
+    CASES = [
+        ({}, {}),
+        ({"area": "oncology"}, {"name": "asc"}),
+        ({"region": "EU"}, {"date_added": "desc"}),
+        ({"region": "EU, US", "match": "any"}, {"area": "asc"}),
+        ({"region": "EU/US", "match": "all"}, {}),
+        ({"ingredient": "aspirin"}, {"ingredients": "desc"}),
+        ({"ingredient": "aspirin, caffeine", "match": "any", "region": "US"}, {"name": "desc"}),
+        ({"user_id": "1"}, {"date_added": "asc"}),
+        ({"user_id": "nope"}, {}),
+        ({"area": "Cardiology", "ingredient": "caffeine"}, {"area": "desc"}),
+    ]
+
+    def seed(self, db_session):
+        users = [UserCRUD.create(db_session, UserCreate(username=f"rm{i}", hashed_password="x")) for i in range(2)]
+        start = datetime(2024, 1, 1)
+        for i in range(60):
+            make_product(
+                db_session,
+                users[i % 2].id,
+                f"Product {i % 7}",
+                area=[None, "Oncology", "Cardiology", ""][i % 4],
+                regions=["EU", "US", "EU/US", None][i % 4],
+                ingredients=[None, "Aspirin", "aspirin, Caffeine", "Caffeine"][i % 3],
+                date_added=start + timedelta(hours=i % 9),
+            )
+        return users
+
+    def walk(self, db_session, filters, sorting, read_model):
+        ids, cursor, pages = [], None, []
+        while True:
+            page = ProductCRUD.search(
+                db_session, filters=dict(filters), sorting=sorting, cursor=cursor, page_size=7, read_model=read_model,
+            )
+            ids.extend(product.id for product in page.items)
+            pages.append(page)
+            cursor = page.next_cursor
+            if not cursor:
+                break
+        back = ProductCRUD.search(
+            db_session, filters=dict(filters), sorting=sorting, cursor=pages[-1].prev_cursor, page_size=7, read_model=read_model,
+        ) if pages[-1].prev_cursor else None
+        return ids, [product.id for product in back.items] if back else None
+
+    def test_matches_sql_path(self, db_session):
+        self.seed(db_session)
+        for filters, sorting in self.CASES:
+            assert self.walk(db_session, filters, sorting, True) == self.walk(db_session, filters, sorting, False), (filters, sorting)
+
+    def test_refreshes_from_change_feed(self, db_session):
+        users = self.seed(db_session)
+        filters, sorting = {"region": "Asia"}, {"name": "asc"}
+        assert self.walk(db_session, filters, sorting, True)[0] == []
+        product = ProductCRUD.get(db_session, ProductCRUD.search(db_session, page_size=1).items[0].id)
+        ProductCRUD.update(db_session, product, ProductUpdate(name="Zeta", regions="Asia"))
+        make_product(db_session, users[0].id, "Alpha", regions="asia")
+        assert self.walk(db_session, filters, sorting, True) == self.walk(db_session, filters, sorting, False)
+        assert [item.name for item in ProductCRUD.search(db_session, filters=filters, sorting=sorting, read_model=True).items] == ["Alpha", "Zeta"]
+
+    def test_page_queries_only_hydrate_by_id(self, db_session):
+        self.seed(db_session)
+        ProductCRUD.search(db_session, read_model=True)
+        with count_queries() as statements:
+            ProductCRUD.search(db_session, filters={"region": "EU"}, sorting={"name": "asc"}, read_model=True)
+        product_queries = [statement for statement in statements if "FROM products" in statement]
+        assert len(product_queries) == 1
+        assert "products.id IN" in product_queries[0]
+        assert "product_regions" not in product_queries[0]
+
+    def test_set_bits(self):
+        assert set_bits(0) == []
+        assert set_bits(0b1010_0000_0001 | 1 << 70) == [0, 9, 11, 70]
+
+
+class TestAdmission:
+    def test_classifies_endpoints(self):
+        assert classify("POST", "/login") == AUTH
+        assert classify("GET", "/login_form") == READ
+        assert classify("GET", "/products/search") == SEARCH
+        assert classify("GET", "/api/v1/products/search") == SEARCH
+        assert classify("GET", "/products/suggest") == SEARCH
+        assert classify("GET", "/products/export") == EXPORT
+        assert classify("GET", "/products/read") == READ
+        assert classify("POST", "/products/create") == WRITE
+        assert classify("PATCH", "/api/v1/products") == WRITE
+        assert classify("GET", "/metrics") is None
+        assert classify("GET", "/api/v1/products/changes/stream") is None
+
+    def test_parse_limits(self):
+        limits = parse_limits("search=2:4:0.5, write=1:0:3")
+        assert limits[SEARCH] == (2, 4, 0.5)
+        assert limits[WRITE] == (1, 0, 3.0)
+        with pytest.raises(ValueError):
+            parse_limits("admin=1:1:1")
+
+    def test_gate_queues_hands_over_and_sheds(self):
+        gate = AdmissionGate("test", concurrency=1, max_queue=1, timeout=5)
+
+        async def scenario():
+            await gate.acquire()
+            queued = asyncio.ensure_future(gate.acquire())
+            await asyncio.sleep(0.01)
+            assert (gate.active, gate.queued) == (1, 1)
+            with pytest.raises(Overloaded):
+                await gate.acquire()
+            gate.release()
+            await queued
+            assert (gate.active, gate.queued) == (1, 0)
+            gate.release()
+
+        asyncio.run(scenario())
+        assert (gate.active, gate.admitted, gate.rejected, gate.timed_out) == (0, 2, 1, 0)
+
+    def test_gate_sheds_after_queue_deadline(self):
+        gate = AdmissionGate("test", concurrency=1, max_queue=4, timeout=0.02)
+
+        async def scenario():
+            await gate.acquire()
+            started = time.perf_counter()
+            with pytest.raises(Overloaded):
+                await gate.acquire()
+            assert time.perf_counter() - started < 1
+            gate.release()
+
+        asyncio.run(scenario())
+        assert (gate.active, gate.queued, gate.timed_out) == (0, 0, 1)
+
+    def test_overloaded_class_does_not_affect_others(self, client, monkeypatch):
+        gate = admission.gates[SEARCH]
+        monkeypatch.setattr(gate, "concurrency", 0)
+        monkeypatch.setattr(gate, "max_queue", 0)
+        rejected = gate.rejected
+        response = client.get("/api/v1/products/search", params={"query": "x"})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert response.json()["detail"] == "Too many search requests, try again shortly"
+        assert client.get("/api/v1/products").status_code == 200
+        assert client.get("/products/export").status_code == 200
+        stats = client.get("/cache/stats").json()["admission"]
+        assert stats["search"]["rejected"] == rejected + 1
+        assert stats["read"]["active"] == 0
+        assert 'http_admission_rejected_total{class="search"}' in client.get("/metrics").text
 
+    def test_queued_request_times_out_with_503(self, client, monkeypatch):
+        gate = admission.gates[WRITE]
+        monkeypatch.setattr(gate, "concurrency", 0)
+        monkeypatch.setattr(gate, "timeout", 0.01)
+        timed_out = gate.timed_out
+        response = client.post("/api/v1/products", json={})
+        assert response.status_code == 503
+        assert gate.timed_out == timed_out + 1
+        assert gate.queued == 0
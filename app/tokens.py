@@ -0,0 +1,186 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import jwt
+from jwt.exceptions import InvalidTokenError
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .models import RevokedToken
+
+
+SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-here")
+ALGORITHM = "HS256"
+DEFAULT_KID = "default"
+JWT_KEYS = os.environ.get("JWT_KEYS", "")
+JWT_ACTIVE_KID = os.environ.get("JWT_ACTIVE_KID")
+TOKEN_REVOCATION = os.environ.get("TOKEN_REVOCATION", "1").lower() in ("1", "true", "yes")
+REVOCATION_BLOOM_BITS = int(os.environ.get("REVOCATION_BLOOM_BITS", 1 << 20))
+REVOCATION_BLOOM_HASHES = 7
+REVOCATION_PRUNE_EVERY = 1024
+REVOCATION_REFRESH_SECONDS = float(os.environ.get("REVOCATION_REFRESH_SECONDS", 1.0))
+
+
+class KeyRing:
+
+    def __init__(self, keys: Dict[str, str], active_kid: Optional[str] = None):
+        if not keys:
+            raise ValueError("Key ring needs at least one key")
+        self.keys = dict(keys)
+        self.active_kid = active_kid or next(iter(self.keys))
+        if self.active_kid not in self.keys:
+            raise ValueError(f"Unknown active key id {self.active_kid!r}")
+
+    @classmethod
+    def from_env(cls, value: str = JWT_KEYS, active_kid: Optional[str] = JWT_ACTIVE_KID) -> "KeyRing":
+        keys = {}
+        for entry in value.split(","):
+            kid, _, secret = entry.strip().partition("=")
+            if kid and secret:
+                keys[kid] = secret
+        return cls(keys or {DEFAULT_KID: SECRET_KEY}, active_kid)
+
+    def add(self, kid: str, secret: str, activate: bool = False) -> None:
+        self.keys[kid] = secret
+        if activate:
+            self.active_kid = kid
+
+    def remove(self, kid: str) -> None:
+        if kid == self.active_kid:
+            raise ValueError("Cannot remove the active key")
+        self.keys.pop(kid, None)
+
+    def encode(self, claims: dict) -> str:
+        return jwt.encode(claims, self.keys[self.active_kid], algorithm=ALGORITHM, headers={"kid": self.active_kid})
+
+    def decode(self, token: str) -> dict:
+        kid = jwt.get_unverified_header(token).get("kid", self.active_kid)
+        secret = self.keys.get(kid)
+        if secret is None:
+            raise InvalidTokenError(f"Unknown key id {kid!r}")
+        return jwt.decode(token, secret, algorithms=[ALGORITHM], options={"require": ["exp"]})
+
+
+class BloomFilter:
+
+    def __init__(self, bits: int = REVOCATION_BLOOM_BITS, hashes: int = REVOCATION_BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.bits for i in range(self.hashes)]
+
+    def add(self, value: str) -> None:
+        for position in self._positions(value):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class RevocationList:
+
+    def __init__(
+        self,
+        bits: int = REVOCATION_BLOOM_BITS,
+        enabled: bool = TOKEN_REVOCATION,
+        refresh_seconds: float = REVOCATION_REFRESH_SECONDS,
+    ):
+        self.bits = bits
+        self.enabled = enabled
+        self.refresh_seconds = refresh_seconds
+        self.last_seq = 0
+        self.synced_at = float("-inf")
+        self._expiry: Dict[str, float] = {}
+        self._filter = BloomFilter(bits)
+        self._lock = threading.Lock()
+
+    def revoke(self, jti: str, expires_at: float, db: Optional[Session] = None) -> None:
+        if not self.enabled:
+            return
+        if db is not None:
+            try:
+                db.execute(insert(RevokedToken).values(jti=jti, expires_at=expires_at))
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+        with self._lock:
+            self._expiry[jti] = expires_at
+            self._filter.add(jti)
+            should_prune = len(self._expiry) % REVOCATION_PRUNE_EVERY == 0
+        if should_prune:
+            self.prune(db)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        if not self.enabled or jti is None or jti not in self._filter:
+            return False
+        expires_at = self._expiry.get(jti)
+        return expires_at is not None and expires_at > time.time()
+
+    def sync_due(self) -> bool:
+        return self.enabled and time.monotonic() - self.synced_at >= self.refresh_seconds
+
+    def sync(self, db: Session) -> List[str]:
+        rows = db.execute(
+            select(RevokedToken.seq, RevokedToken.jti, RevokedToken.expires_at)
+            .where(RevokedToken.seq > self.last_seq)
+            .order_by(RevokedToken.seq)
+        ).all()
+        now = time.time()
+        added = []
+        with self._lock:
+            for seq, jti, expires_at in rows:
+                self.last_seq = max(self.last_seq, seq)
+                if expires_at > now and jti not in self._expiry:
+                    self._expiry[jti] = expires_at
+                    self._filter.add(jti)
+                    added.append(jti)
+            self.synced_at = time.monotonic()
+        return added
+
+    def prune(self, db: Optional[Session] = None) -> int:
+        with self._lock:
+            now = time.time()
+            self._expiry = {jti: expires_at for jti, expires_at in self._expiry.items() if expires_at > now}
+            self._filter = BloomFilter(self.bits)
+            for jti in self._expiry:
+                self._filter.add(jti)
+            remaining = len(self._expiry)
+        if db is not None:
+            db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+            db.commit()
+        return remaining
+
+    def clear(self) -> None:
+        with self._lock:
+            self._expiry.clear()
+            self._filter = BloomFilter(self.bits)
+            self.last_seq = 0
+            self.synced_at = float("-inf")
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+
+key_ring = KeyRing.from_env()
+revocations = RevocationList()
+
+
+def issue_token(claims: dict, expires_delta: timedelta) -> str:
+    now = datetime.now(timezone.utc)
+    return key_ring.encode({**claims, "iat": now, "exp": now + expires_delta, "jti": uuid.uuid4().hex})
+
+
+def decode_token(token: str) -> dict:
+    payload = key_ring.decode(token)
+    if revocations.is_revoked(payload.get("jti")):
+        raise InvalidTokenError("Token has been revoked")
+    return payload
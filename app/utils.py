@@ -1,13 +1,28 @@
-from datetime import datetime, timedelta
+import os
+from datetime import timedelta
+from typing import Optional
 from passlib.context import CryptContext
-import jwt
+from jwt.exceptions import InvalidTokenError
+from sqlalchemy.orm import Session
+from .cache import TTLCache
+from .tokens import ALGORITHM, SECRET_KEY, decode_token, issue_token, revocations
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
-SECRET_KEY = "your-secret-key-here"
-ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+TOKEN_CACHE_SIZE = 4096
+INVALID_TOKEN_TTL = 60
+
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -19,15 +34,25 @@ def get_password_hash(password: str) -> str:
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-
-
-def verify_token(token: str) -> str:
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-    return payload
+    return issue_token(data, expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+
+def verify_token(token: str) -> dict:
+    return decode_token(token)
+
+
+def revoke_token(token: str, db: Optional[Session] = None) -> bool:
+    try:
+        payload = decode_token(token)
+    except InvalidTokenError:
+        return False
+    token_cache.delete(token)
+    if payload.get("jti") is None:
+        return False
+    revocations.revoke(payload["jti"], payload["exp"], db)
+    return True
+
+
+def sync_revocations(db: Session) -> None:
+    if revocations.sync(db):
+        token_cache.clear()
@@ -0,0 +1,43 @@
+import hashlib
+from typing import Iterable
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+from .models import Product, TableVersion
+
+
+PRODUCTS = Product.__tablename__
+
+
+class TableVersions:
+
+    @staticmethod
+    def bump(db: Session, name: str = PRODUCTS) -> None:
+        result = db.execute(
+            update(TableVersion)
+            .where(TableVersion.name == name)
+            .values(version=TableVersion.version + 1)
+        )
+        if result.rowcount == 0:
+            db.add(TableVersion(name=name, version=1))
+            db.flush()
+
+    @staticmethod
+    def get(db: Session, name: str = PRODUCTS) -> int:
+        return db.scalar(select(TableVersion.version).where(TableVersion.name == name)) or 0
+
+
+def make_etag(version: int, *parts: Iterable) -> str:
+    digest = hashlib.sha256(repr((version, parts)).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+@event.listens_for(TableVersion.__table__, "after_create")
+def _seed_versions(target, connection, **kw):
+    connection.execute(TableVersion.__table__.insert(), [{"name": PRODUCTS, "version": 0}])